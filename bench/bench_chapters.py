@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark native chapter extraction (chapters.read_chapters) against the
+ffprobe subprocess path, over a directory of M4B files.
+
+Checks that both paths agree on every file and reports per-file and total
+wall time, and the bytes the native path reads. Usage:
+
+  python bench/bench_chapters.py [M4B_DIR] [--repeat N]
+  python bench/bench_chapters.py --corpus N [--corpus-mb MB] [--repeat N]
+
+M4B_DIR defaults to $M4B_DIR or /tmp/vibelib-m4bs (where
+bootstrap-tools/download_m4bs.py puts its sample).
+
+--corpus generates N make_corpus.py M4Bs with QuickTime chapter tracks, each
+in two layouts: chapter samples together after the audio, and interleaved
+with it. Each interleaved file must give the same chapters as its
+contiguous twin (and as ffprobe, if installed) while reading about as
+little of it.
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "loader"))
+
+from chapters import ffprobe_chapters, read_chapters  # noqa: E402
+from make_corpus import make_m4b, write_m4b           # noqa: E402
+from mp4atoms import read_moov                       # noqa: E402
+
+
+class CountingFile(io.FileIO):
+    """A file that counts the bytes read through it."""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def native(path):
+    with CountingFile(path) as f:
+        return read_chapters(read_moov(f), f)
+
+
+def native_bytes_read(path):
+    with CountingFile(path) as f:
+        read_chapters(read_moov(f), f)
+        return f.bytes_read
+
+
+def timed(fn, path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(path)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def make_files(out_dir, count, audio_mb):
+    """Write `count` pairs of contiguous and interleaved M4Bs with QuickTime
+    chapters. Returns [(path, reference path)]: each file is checked against
+    the contiguous one of its pair."""
+    files, seed = [], 0
+    while len(files) < 2 * count:
+        audio = int(audio_mb * 1024 * 1024)
+        interleaved = make_m4b(random.Random(seed), seed, audio, interleave=True)
+        if len(interleaved) > 3:     # a QuickTime track with several chapters
+            together = out_dir / f"{seed:04d}-together.m4b"
+            write_m4b(together, make_m4b(random.Random(seed), seed, audio))
+            write_m4b(out_dir / f"{seed:04d}-interleaved.m4b", interleaved)
+            files += [(together, together), (out_dir / f"{seed:04d}-interleaved.m4b", together)]
+        seed += 1
+    return files
+
+
+def compare(files, repeat, use_ffprobe):
+    total_native = total_ffprobe = 0.0
+    mismatches = 0
+    print(
+        f"{'File':<40} {'Chapters':>8} {'KB read':>9} {'native ms':>10} "
+        f"{'ffprobe ms':>11} {'speedup':>8}  Match"
+    )
+    print("-" * 100)
+    for path, reference in files:
+        n_result, n_time = timed(native, str(path), repeat)
+        if use_ffprobe:
+            f_result, f_time = timed(ffprobe_chapters, str(path), repeat)
+        else:
+            f_result, f_time = None, 0.0
+        match = (not use_ffprobe or n_result == f_result) and (
+            reference == path or n_result == native(str(reference))
+        )
+        mismatches += not match
+        total_native += n_time
+        total_ffprobe += f_time
+        count = len(n_result) if n_result is not None else "-"
+        if use_ffprobe:
+            ffprobe = f"{f_time * 1000:>11.2f} {f_time / n_time if n_time else 0:>7.1f}x"
+        else:
+            ffprobe = f"{'-':>11} {'-':>8}"
+        print(
+            f"{path.name[:40]:<40} {count:>8} {native_bytes_read(str(path)) / 1024:>9.1f} "
+            f"{n_time * 1000:>10.2f} {ffprobe}  {'yes' if match else 'NO'}"
+        )
+
+    print("-" * 100)
+    speedup = f" ({total_ffprobe / total_native if total_native else 0:.1f}x)" if use_ffprobe else ""
+    print(
+        f"{len(files)} files: native {total_native * 1000:.1f} ms, "
+        f"ffprobe {total_ffprobe * 1000:.1f} ms{speedup}, "
+        f"{mismatches} mismatches"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Native vs. ffprobe chapter extraction.")
+    parser.add_argument("m4b_dir", nargs="?", default=os.environ.get("M4B_DIR", "/tmp/vibelib-m4bs"))
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per file (default: 3)")
+    parser.add_argument("--corpus", type=int, metavar="N",
+                        help="Generate N contiguous/interleaved pairs instead of reading M4B_DIR")
+    parser.add_argument("--corpus-mb", type=float, default=16,
+                        help="Audio payload of generated M4Bs in MB (default: 16)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with tempfile.TemporaryDirectory() as tmp:
+            files = make_files(Path(tmp), args.corpus, args.corpus_mb)
+            compare(files, args.repeat, use_ffprobe=shutil.which("ffprobe") is not None)
+        return
+
+    files = sorted(Path(args.m4b_dir).glob("*.m4b"))
+    if not files:
+        sys.exit(f"No .m4b files in {args.m4b_dir}")
+    compare([(path, path) for path in files], args.repeat, use_ffprobe=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Benchmark a full loader pass (loader.run_once) against a synthetic corpus
+served from a local S3 stand-in and loaded into a local Postgres.
+
+Each repeat starts from an empty scratch database and cover store, loads the
+whole corpus in one pass, and reports files/s, MB/s, peak RSS and the time
+spent in each stage (from the loader's metrics, see loader/metrics.py).
+Usage:
+
+  python bench/bench_loader.py [CORPUS_DIR] [--repeat N] [--json OUT]
+                               [--compare BASELINE.json] [--endpoint HOST:PORT]
+
+CORPUS_DIR defaults to /tmp/vibelib-corpus and is generated with
+make_corpus.py (--epubs/--m4bs/--seed) if it has no corpus.json yet.
+
+The S3 stand-in is a moto server (pip install "moto[server]") started on a
+free local port, unless --endpoint points at one already running, e.g. a
+MinIO container. Postgres comes from POSTGRES_HOST/PORT/USER/PASSWORD
+(default localhost:5432, user vibelib); the scratch database (--db, default
+vibelib_bench) is dropped and recreated on every repeat, so the user must be
+allowed to create databases.
+
+Loader settings are read from the environment as usual, so tuning runs are
+e.g. `DOWNLOAD_WORKERS=16 FETCH_MODE=range python bench/bench_loader.py`.
+--compare exits non-zero if files/s fell more than --tolerance percent below
+a previous --json result.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import boto3
+import psycopg2
+from botocore.client import Config
+from prometheus_client import REGISTRY
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR  = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR / "loader"))
+sys.path.insert(0, str(BENCH_DIR))
+
+from make_corpus import generate  # noqa: E402
+
+STAGES = ("list", "download", "parse", "write", "cover")
+KNOBS  = (
+    "ENGINE", "FETCH_MODE", "DOWNLOAD_WORKERS", "ADAPTIVE_DOWNLOADS", "PARSE_WORKERS",
+    "COVER_WORKERS", "COVER_DERIVATIVES", "QUEUE_DEPTH", "WRITE_BATCH_SIZE", "WRITE_BATCH_MS",
+    "ASYNC_CONCURRENCY", "ASYNC_INMEMORY_BYTES", "PG_POOL_SIZE", "INMEMORY_MAX_BYTES",
+    "RANGE_BLOCK_SIZE", "PARSE_CACHE", "SKIP_DUPLICATES",
+)
+
+# ── S3 stand-in ───────────────────────────────────────────────────────────────
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_moto():
+    """Start a moto S3 server subprocess; returns (process, "host:port")."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc, f"127.0.0.1:{port}"
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit('moto server did not start; is "moto[server]" installed?')
+
+def upload_corpus(corpus, bucket):
+    """Upload every corpus file under its path relative to the corpus, skipping
+    objects already there at the same size."""
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=f"{os.environ['OBJECT_STORE_SCHEME']}://{os.environ['OBJECT_STORE_BUCKET_ENDPOINT']}",
+        aws_access_key_id=os.environ["OBJECT_STORE_ACCESS_KEY_ID"],
+        aws_secret_access_key=os.environ["OBJECT_STORE_SECRET_ACCESS_KEY"],
+        region_name=os.environ["OBJECT_STORE_BUCKET_REGION"],
+        config=Config(signature_version="s3v4"),
+    )
+    try:
+        s3.create_bucket(Bucket=bucket)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    existing = {
+        obj["Key"]: obj["Size"]
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket)
+        for obj in page.get("Contents", [])
+    }
+    uploaded = 0
+    for path in sorted(p for p in corpus.rglob("*") if p.suffix in (".epub", ".m4b")):
+        key = path.relative_to(corpus).as_posix()
+        if existing.get(key) != path.stat().st_size:
+            s3.upload_file(str(path), bucket, key)
+            uploaded += 1
+    print(f"Uploaded {uploaded} objects to s3://{bucket} ({len(existing)} already there).")
+
+# ── Database ──────────────────────────────────────────────────────────────────
+
+def recreate_database(name):
+    conn = psycopg2.connect(
+        host=os.environ["POSTGRES_HOST"], port=os.environ["POSTGRES_PORT"], dbname="postgres",
+        user=os.environ["POSTGRES_USER"], password=os.environ.get("POSTGRES_PASSWORD"),
+    )
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # FORCE also drops the loader's lister-lock connection from the last repeat.
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+
+# ── Runs ──────────────────────────────────────────────────────────────────────
+
+def stage_totals():
+    """{stage: (items, seconds)} from the loader's stage histogram."""
+    totals = {}
+    for stage in STAGES:
+        labels = {"stage": stage}
+        count = REGISTRY.get_sample_value("vibelib_loader_stage_seconds_count", labels) or 0
+        total = REGISTRY.get_sample_value("vibelib_loader_stage_seconds_sum", labels) or 0
+        totals[stage] = (count, total)
+    return totals
+
+def peak_rss_mb():
+    """(loader process, largest reaped child) peak RSS in MB. ru_maxrss is a
+    high-water mark, so it only grows across repeats."""
+    self_kb  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, child_kb / 1024
+
+def run(loader, corpus_info, db):
+    from jobs import state_counts
+
+    recreate_database(db)
+    covers = Path(loader.COVERS_DIR)
+    shutil.rmtree(covers, ignore_errors=True)
+    covers.mkdir(parents=True)
+    conn = loader.connect_db()
+    loader.apply_schema(conn)
+
+    before = stage_totals()
+    start = time.perf_counter()
+    if loader.ENGINE == "async":
+        import async_engine
+        asyncio.run(async_engine.run_once(loader))
+    else:
+        loader.run_once()
+    elapsed = time.perf_counter() - start
+    after = stage_totals()
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT (SELECT count(*) FROM epubs) + (SELECT count(*) FROM m4bs)")
+        loaded = cur.fetchone()[0]
+    jobs = state_counts(conn)
+    conn.close()
+
+    rss, child_rss = peak_rss_mb()
+    return {
+        "seconds":        elapsed,
+        "files":          loaded,
+        "errors":         jobs.get("failed", 0) + jobs.get("quarantined", 0),
+        "files_per_s":    loaded / elapsed,
+        "object_mb_per_s":  corpus_info["bytes"] / 1e6 / elapsed,
+        "fetched_mb_per_s": loader.FETCH_STATS.fetched_bytes / 1e6 / elapsed,
+        "peak_rss_mb":    rss,
+        "peak_child_rss_mb": child_rss,
+        "stages": {
+            stage: {
+                "items":   after[stage][0] - before[stage][0],
+                "seconds": after[stage][1] - before[stage][1],
+            }
+            for stage in STAGES
+        },
+    }
+
+def print_result(i, r):
+    print(
+        f"run {i}: {r['files']} files in {r['seconds']:.2f}s = {r['files_per_s']:.1f} files/s, "
+        f"{r['object_mb_per_s']:.1f} MB/s of objects ({r['fetched_mb_per_s']:.1f} MB/s fetched), "
+        f"{r['errors']} errors, peak RSS {r['peak_rss_mb']:.0f} MB "
+        f"(largest child {r['peak_child_rss_mb']:.0f} MB)"
+    )
+    print(f"  {'stage':<10} {'items':>7} {'busy s':>9} {'mean ms':>9}")
+    for stage, s in r["stages"].items():
+        mean = 1000 * s["seconds"] / s["items"] if s["items"] else 0.0
+        print(f"  {stage:<10} {s['items']:>7} {s['seconds']:>9.2f} {mean:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loader throughput on a synthetic corpus.")
+    parser.add_argument("corpus", nargs="?", default=os.environ.get("CORPUS_DIR", "/tmp/vibelib-corpus"))
+    parser.add_argument("--epubs", type=int, default=200, help="EPUBs when generating (default: 200)")
+    parser.add_argument("--m4bs", type=int, default=20, help="M4Bs when generating (default: 20)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed when generating (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes to run (default: 3)")
+    parser.add_argument("--endpoint", help="HOST:PORT of a running S3 stand-in (default: start moto)")
+    parser.add_argument("--bucket", default="vibelib-bench", help="Bucket to load from")
+    parser.add_argument("--db", default="vibelib_bench", help="Scratch database, recreated per run")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Fail if slower than this earlier --json result")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="Allowed files/s drop against --compare, in percent (default: 10)")
+    args = parser.parse_args()
+
+    corpus = Path(args.corpus)
+    if (corpus / "corpus.json").exists():
+        corpus_info = json.loads((corpus / "corpus.json").read_text())
+    else:
+        print(f"Generating corpus in {corpus}...")
+        corpus_info = generate(corpus, args.epubs, args.m4bs, args.seed)
+    print(
+        f"Corpus: {corpus_info['files']} files, {corpus_info['bytes'] / 1e6:.1f} MB "
+        f"({corpus_info['epubs']} epubs, {corpus_info['m4bs']} m4bs, seed {corpus_info['seed']})."
+    )
+
+    moto = None
+    if args.endpoint:
+        endpoint = args.endpoint
+    else:
+        moto, endpoint = start_moto()
+    covers_dir = tempfile.mkdtemp(prefix="vibelib-bench-covers-")
+    # The loader reads its configuration at import, so set it up first.
+    os.environ.update({
+        "OBJECT_STORE_BUCKET_ENDPOINT":   endpoint,
+        "OBJECT_STORE_SCHEME":            os.environ.get("OBJECT_STORE_SCHEME", "http"),
+        "OBJECT_STORE_ACCESS_KEY_ID":     os.environ.get("OBJECT_STORE_ACCESS_KEY_ID", "bench"),
+        "OBJECT_STORE_SECRET_ACCESS_KEY": os.environ.get("OBJECT_STORE_SECRET_ACCESS_KEY", "bench"),
+        "OBJECT_STORE_BUCKET_REGION":     os.environ.get("OBJECT_STORE_BUCKET_REGION", "us-east-1"),
+        "OBJECT_STORE_BUCKET_NAME":       args.bucket,
+        "POSTGRES_HOST":                  os.environ.get("POSTGRES_HOST", "localhost"),
+        "POSTGRES_PORT":                  os.environ.get("POSTGRES_PORT", "5432"),
+        "POSTGRES_USER":                  os.environ.get("POSTGRES_USER", "vibelib"),
+        "POSTGRES_DB":                    args.db,
+        "COVERS_DIR":                     covers_dir,
+        "SCHEMA_FILE":                    str(REPO_DIR / "sql" / "schema.sql"),
+        "MIGRATIONS_DIR":                 str(REPO_DIR / "sql" / "migrations"),
+        "METRICS_PORT":                   "0",
+        "LOADER_ID":                      "bench",
+    })
+
+    try:
+        upload_corpus(corpus, args.bucket)
+        import loader
+        config = {knob: getattr(loader, knob) for knob in KNOBS}
+        print("Config: " + ", ".join(f"{k}={v}" for k, v in config.items()))
+
+        results = []
+        for i in range(1, args.repeat + 1):
+            results.append(run(loader, corpus_info, args.db))
+            print_result(i, results[-1])
+    finally:
+        if moto is not None:
+            moto.terminate()
+            moto.wait()
+        shutil.rmtree(covers_dir, ignore_errors=True)
+
+    median = statistics.median(r["files_per_s"] for r in results)
+    print(
+        f"\nmedian of {len(results)}: {median:.1f} files/s, "
+        f"{statistics.median(r['object_mb_per_s'] for r in results):.1f} MB/s"
+    )
+    summary = {"corpus": corpus_info, "config": config, "median_files_per_s": median, "runs": results}
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2) + "\n")
+        print(f"Results written to {args.json}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        change = 100.0 * (median - baseline["median_files_per_s"]) / baseline["median_files_per_s"]
+        print(f"vs. {args.compare}: {change:+.1f}% files/s")
+        if baseline["corpus"] != corpus_info:
+            print("  warning: baseline was measured on a different corpus")
+        if change < -args.tolerance:
+            sys.exit(f"Regression: files/s fell {-change:.1f}% (tolerance {args.tolerance}%)")
+
+
+if __name__ == "__main__":
+    main()
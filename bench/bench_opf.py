@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Benchmark the single-pass OPF extractor (opf.read_opf) against the
+ElementTree walk parse_epub used before it (opf.read_opf_tree).
+
+Runs both over a built-in set of OPF shapes found in real EPUBs (Calibre
+EPUB2, EPUB3, prefixed and un-namespaced packages, OEBPS 1.x, a comic with
+a few thousand manifest items, and the odd cases: comments and entities in
+text, mis-declared or invalid encodings, malformed XML), plus the OPF of
+every EPUB in EPUB_DIR if one is given. Checks that both return the same
+result (or both fail) on every document and reports per-document and total
+time. Usage:
+
+  python bench/bench_opf.py [EPUB_DIR] [--repeat N]
+
+EPUB_DIR defaults to $EPUB_DIR; make_corpus.py or
+bootstrap-tools/download_epubs.py can fill one.
+"""
+
+import argparse
+import os
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "loader"))
+
+from opf import find_opf_path, opf_base, read_opf, read_opf_tree  # noqa: E402
+
+PACKAGE = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<package xmlns="http://www.idpf.org/2007/opf" version="{version}" unique-identifier="uid">\n'
+    '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:opf="http://www.idpf.org/2007/opf">\n{metadata}\n  </metadata>\n'
+    '  <manifest>\n{manifest}\n  </manifest>\n'
+    '  <spine toc="ncx">\n{spine}\n  </spine>\n'
+    '</package>\n'
+)
+
+
+def chapters(n, cover=None, cover_props=False):
+    items = ['    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>']
+    if cover:
+        props = ' properties="cover-image"' if cover_props else ""
+        items.append(f'    <item id="cover" href="{cover}" media-type="image/jpeg"{props}/>')
+    items += [
+        f'    <item id="ch{i:04d}" href="text/chapter{i:04d}.xhtml" media-type="application/xhtml+xml"/>'
+        for i in range(n)
+    ]
+    spine = [f'    <itemref idref="ch{i:04d}"/>' for i in range(n)]
+    return "\n".join(items), "\n".join(spine)
+
+
+def package(metadata, n=30, cover="images/cover.jpg", cover_props=False, version="2.0"):
+    manifest, spine = chapters(n, cover, cover_props)
+    return PACKAGE.format(version=version, metadata=metadata, manifest=manifest, spine=spine)
+
+
+CALIBRE = package("""
+    <dc:title>The Long Way Home</dc:title>
+    <dc:creator opf:role="aut" opf:file-as="Doe, Jane">Jane Doe</dc:creator>
+    <dc:creator opf:role="trl">John Roe</dc:creator>
+    <dc:contributor opf:role="bkp">calibre (6.11.0) [https://calibre-ebook.com]</dc:contributor>
+    <dc:date>2019-03-05T00:00:00+00:00</dc:date>
+    <dc:description>&lt;div&gt;&lt;p&gt;A novel.&lt;/p&gt;&lt;/div&gt;</dc:description>
+    <dc:publisher>Example House</dc:publisher>
+    <dc:identifier id="uid" opf:scheme="uuid">1b6f0c2e-2d59-4a3c-9b7e-3b8f5b8e9f10</dc:identifier>
+    <dc:identifier opf:scheme="calibre">1b6f0c2e-2d59-4a3c-9b7e-3b8f5b8e9f10</dc:identifier>
+    <dc:identifier opf:scheme="ISBN">9780000000001</dc:identifier>
+    <dc:identifier opf:scheme="MOBI-ASIN">B00EXAMPLE</dc:identifier>
+    <dc:language>en</dc:language>
+    <dc:subject>Fiction</dc:subject>
+    <dc:subject>Adventure</dc:subject>
+    <meta name="calibre:series" content="Homeward"/>
+    <meta name="calibre:series_index" content="2.0"/>
+    <meta name="calibre:timestamp" content="2020-01-01T00:00:00+00:00"/>
+    <meta name="calibre:title_sort" content="Long Way Home, The"/>
+    <meta name="cover" content="cover"/>""")
+
+EPUB3 = package("""
+    <dc:identifier id="uid">urn:isbn:9780000000002</dc:identifier>
+    <dc:title id="t1">Stars Below</dc:title>
+    <meta refines="#t1" property="title-type">main</meta>
+    <dc:creator id="c1">Ann Author</dc:creator>
+    <meta refines="#c1" property="role" scheme="marc:relators">aut</meta>
+    <dc:language>en-GB</dc:language>
+    <dc:publisher>Orbit Example</dc:publisher>
+    <dc:date>2021-07-01</dc:date>
+    <meta property="dcterms:modified">2021-07-01T12:00:00Z</meta>
+    <meta property="belongs-to-collection" id="col">Stars</meta>""",
+    cover="images/cover.png", cover_props=True, version="3.0")
+
+PREFIXED = (
+    '<?xml version="1.0"?>\n'
+    '<opf:package xmlns:opf="http://www.idpf.org/2007/opf" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" version="2.0">\n'
+    '  <opf:metadata>\n'
+    '    <dc:title>Prefixed</dc:title>\n'
+    '    <dc:creator opf:role="aut">P. Writer</dc:creator>\n'
+    '    <dc:identifier opf:scheme="AMAZON">B0PREFIXED</dc:identifier>\n'
+    '    <opf:meta name="calibre:series" content="Prefix"/>\n'
+    '    <opf:meta name="calibre:series_index" content="1"/>\n'
+    '    <opf:meta name="cover" content="img"/>\n'
+    '  </opf:metadata>\n'
+    '  <opf:manifest><opf:item id="img" href="/cover.jpeg" media-type="image/jpeg"/></opf:manifest>\n'
+    '</opf:package>\n'
+)
+
+UNNAMESPACED = (
+    '<package version="2.0">\n'
+    '  <metadata>\n'
+    '    <dc:title xmlns:dc="http://purl.org/dc/elements/1.1/">No Namespace</dc:title>\n'
+    '    <meta name="cover" content="c"/>\n'
+    '    <meta name="calibre:series_index" content="one"/>\n'
+    '  </metadata>\n'
+    '  <manifest><item id="c" href="cover.gif"/></manifest>\n'
+    '</package>\n'
+)
+
+OEBPS1 = (
+    '<?xml version="1.0"?>\n'
+    '<package unique-identifier="id">\n'
+    '  <metadata>\n'
+    '    <dc-metadata xmlns:dc="http://purl.org/dc/elements/1.0/">\n'
+    '      <dc:Title>Old Style</dc:Title>\n'
+    '      <dc:Identifier id="id" scheme="ISBN">0000000000</dc:Identifier>\n'
+    '    </dc-metadata>\n'
+    '    <x-metadata><meta name="cover" content="c"/></x-metadata>\n'
+    '  </metadata>\n'
+    '  <manifest><item id="c" href="cover.jpg"/></manifest>\n'
+    '</package>\n'
+)
+
+MESSY = package("""
+    <dc:title>  Caf&#233; <!-- working title -->Stories &amp; Tales<![CDATA[ <Vol. 1> ]]></dc:title>
+    <dc:title>Second Title</dc:title>
+    <dc:publisher>   </dc:publisher>
+    <dc:description><p xmlns="http://www.w3.org/1999/xhtml">Rich</p> tail</dc:description>
+    <dc:creator opf:role="aut"></dc:creator>
+    <dc:creator>  Second Creator  </dc:creator>
+    <dc:creator opf:role=""><b>Bold</b> Third</dc:creator>
+    <dc:identifier scheme="" opf:scheme="ISBN">978-0-00-000000-3</dc:identifier>
+    <dc:identifier>urn:asin:B0MESSY000</dc:identifier>
+    <dc:identifier>   </dc:identifier>
+    <dc:identifier opf:scheme="DOI">10.1000/xyz</dc:identifier>
+    <meta name="calibre:series" content="Opf Series"/>
+    <meta xmlns="" name="calibre:series" content="Plain Series"/>
+    <meta xmlns="" name="calibre:series_index" content=" 3.5 "/>
+    <meta name="calibre:series_index" content="not a number"/>
+    <meta name="calibre:series"/>
+    <meta name="cover" content="missing"/>
+    <dc:source name="cover" content="cover"/>""",
+    cover="Images/Cover.JPG")
+MESSY = MESSY.replace(
+    "  </manifest>",
+    '    <item id="cover" href="images/later.webp"/>\n'
+    '    <item id="" href="orphan.png" properties="nav cover-image-ish"/>\n'
+    "  </manifest>",
+)
+
+COMIC = package("""
+    <dc:title>Big Comic</dc:title>
+    <dc:creator opf:role="aut">Artist</dc:creator>
+    <dc:language>ja</dc:language>""", n=3000, cover="img/p0000.jpg", cover_props=True, version="3.0")
+
+SHAPES = {
+    "calibre-epub2":    CALIBRE.encode(),
+    "epub3":            EPUB3.encode(),
+    "prefixed":         PREFIXED.encode(),
+    "unnamespaced":     UNNAMESPACED.encode(),
+    "oebps1":           OEBPS1.encode(),
+    "messy":            MESSY.encode(),
+    "comic-3000-items": COMIC.encode(),
+    "utf8-bom":         b"\xef\xbb\xbf" + CALIBRE.encode(),
+    "declared-latin1":  CALIBRE.replace('encoding="utf-8"', 'encoding="iso-8859-1"')
+                               .replace("Jane Doe", "Renée Doe").encode(),
+    "invalid-utf8":     CALIBRE.replace("Jane Doe", "Renée Doe").encode("latin-1"),
+    "no-metadata":      b'<package xmlns="http://www.idpf.org/2007/opf"><manifest/></package>',
+    "truncated":        CALIBRE.encode()[:700],
+    "undefined-entity": (
+        b'<!DOCTYPE package PUBLIC "+//ISBN 0-9673008-1-9//DTD OEB 1.2 Package//EN" '
+        b'"http://openebook.org/dtds/oeb-1.2/oebpkg12.dtd">\n'
+        + UNNAMESPACED.replace("No Namespace", "No&nbsp;Namespace").encode()
+    ),
+}
+
+
+def epub_opfs(epub_dir):
+    """{file name: (OPF bytes, base)} for the EPUBs in epub_dir."""
+    opfs = {}
+    for path in sorted(Path(epub_dir).rglob("*.epub")):
+        try:
+            with zipfile.ZipFile(path) as zf:
+                opf_path = find_opf_path(zf)
+                if opf_path:
+                    opfs[path.name] = (zf.read(opf_path), opf_base(opf_path))
+        except (zipfile.BadZipFile, KeyError) as e:
+            print(f"skipping {path.name}: {e}", file=sys.stderr)
+    return opfs
+
+
+def outcome(fn, data, base):
+    try:
+        return fn(data, base)
+    except Exception as e:
+        return f"error: {type(e).__name__}"
+
+
+def timed(fn, data, base, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outcome(fn, data, base)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-pass vs. ElementTree OPF extraction.")
+    parser.add_argument("epub_dir", nargs="?", default=os.environ.get("EPUB_DIR"))
+    parser.add_argument("--repeat", type=int, default=200, help="Runs per document (default: 200)")
+    args = parser.parse_args()
+
+    docs = {name: (data, "OEBPS/") for name, data in SHAPES.items()}
+    if args.epub_dir:
+        docs.update(epub_opfs(args.epub_dir))
+
+    total_tree = total_stream = 0.0
+    mismatches = 0
+    print(f"{'Document':<40} {'KB':>7} {'tree us':>9} {'stream us':>10} {'speedup':>8}  Match")
+    print("-" * 86)
+    for name, (data, base) in docs.items():
+        tree, stream = outcome(read_opf_tree, data, base), outcome(read_opf, data, base)
+        # Errors only need to agree on failing; the messages differ.
+        match = tree == stream or (isinstance(tree, str) and isinstance(stream, str))
+        mismatches += not match
+        t_time = timed(read_opf_tree, data, base, args.repeat)
+        s_time = timed(read_opf, data, base, args.repeat)
+        total_tree += t_time
+        total_stream += s_time
+        print(
+            f"{name[:40]:<40} {len(data) / 1024:>7.1f} {t_time * 1e6:>9.1f} {s_time * 1e6:>10.1f} "
+            f"{t_time / s_time if s_time else 0:>7.2f}x  {'yes' if match else 'NO'}"
+        )
+        if not match:
+            print(f"    tree:   {tree}\n    stream: {stream}")
+
+    print("-" * 86)
+    print(
+        f"{len(docs)} documents: tree {total_tree * 1000:.2f} ms, "
+        f"stream {total_stream * 1000:.2f} ms "
+        f"({total_tree / total_stream if total_stream else 0:.2f}x), "
+        f"{mismatches} mismatches"
+    )
+
+
+if __name__ == "__main__":
+    main()
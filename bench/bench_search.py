@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Benchmark catalog search (loader/search.py) on a synthetic catalog of
+100k+ rows.
+
+Fills a scratch database with --epubs EPUB and --m4bs M4B rows through the
+loader's own upserts (catalog.write_records), so the search columns are
+built the way the loader builds them, and reports the write rate. Titles,
+descriptions, authors and series are drawn from a generated vocabulary
+with a Zipf-like word frequency, so queries range from words in a third of
+the rows to words in a handful. It then times search.search() for a set
+of query shapes picked from the data (whole titles, prefixes, authors,
+words split between title and description, common and rare words,
+misspellings, no match, a deep page) and reports hits and p50/p95/max
+latency for each. Misspelled queries find nothing by full text, so unless
+--exact they time the trigram fallback as well. Usage:
+
+  python bench/bench_search.py [--epubs N] [--m4bs N] [--seed S] [--repeat N]
+                               [--db NAME] [--reuse] [--exact] [--explain]
+                               [--json OUT]
+
+Postgres comes from POSTGRES_HOST/PORT/USER/PASSWORD as for bench_loader.py;
+the scratch database (--db, default vibelib_search_bench) is dropped and
+recreated unless --reuse keeps one filled by an earlier run. --explain
+prints each query's plan, to check that the GIN indexes are used.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR  = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR / "loader"))
+
+from catalog import write_records  # noqa: E402
+from migrate import migrate  # noqa: E402
+from search import search, search_query  # noqa: E402
+
+SYLLABLES = (
+    "ka lo ri an ve mo sa tel in dor ma wen ar is ol beth ru na ce fen "
+    "gar hal jo lin mer nor pa quin ros sil tor ul vin wy zan bre cor"
+).split()
+BATCH = 1000
+
+# ── Catalog ───────────────────────────────────────────────────────────────────
+
+class Vocabulary:
+    """Deterministic pseudo-words and names, drawn with Zipf-like weights."""
+
+    def __init__(self, rng, words=5000, surnames=3000, given=400, series=3000):
+        self.rng = rng
+        self.words = self._unique(words, 2, 4)
+        self.rng.shuffle(self.words)   # so frequency does not follow spelling
+        self._cum = list(_cumulative(len(self.words)))
+        self.surnames = [w.capitalize() for w in self._unique(surnames, 2, 3)]
+        self.given = [w.capitalize() for w in self._unique(given, 1, 2)]
+        self.series = [self.title(2, 3) for _ in range(series)]
+
+    def _unique(self, n, lo, hi):
+        seen = set()
+        while len(seen) < n:
+            seen.add("".join(self.rng.choices(SYLLABLES, k=self.rng.randint(lo, hi))))
+        return sorted(seen)
+
+    def text(self, n):
+        return self.rng.choices(self.words, cum_weights=self._cum, k=n)
+
+    def title(self, lo=2, hi=6):
+        return " ".join(w.capitalize() for w in self.text(self.rng.randint(lo, hi)))
+
+    def name(self):
+        return f"{self.rng.choice(self.given)} {self.rng.choice(self.surnames)}"
+
+def _cumulative(n):
+    total = 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank
+        yield total
+
+def epub_record(vocab, i):
+    rng = vocab.rng
+    meta = {
+        "title":       vocab.title(),
+        "language":    "en",
+        "description": " ".join(vocab.text(rng.randint(40, 120))),
+    }
+    if rng.random() < 0.3:
+        meta["series"], meta["series_position"] = rng.choice(vocab.series), float(rng.randint(1, 12))
+    authors = [(vocab.name(), "aut", n) for n in range(1, rng.choice((1, 1, 1, 2, 3)) + 1)]
+    return ("epub", f"epub/{i:07d}.epub", None, meta, authors)
+
+def m4b_record(vocab, i):
+    rng = vocab.rng
+    meta = {
+        "title":       vocab.title(),
+        "artist":      vocab.name(),
+        "narrator":    vocab.name(),
+        "album":       rng.choice(vocab.series) if rng.random() < 0.3 else None,
+        "description": " ".join(vocab.text(rng.randint(20, 80))),
+        "duration_s":  rng.randint(3600, 72000),
+    }
+    return ("m4b", f"m4b/{i:07d}.m4b", None, meta, [])
+
+def connect(db):
+    return psycopg2.connect(
+        host=os.environ["POSTGRES_HOST"], port=os.environ["POSTGRES_PORT"], dbname=db,
+        user=os.environ["POSTGRES_USER"], password=os.environ.get("POSTGRES_PASSWORD"),
+    )
+
+def recreate_database(name):
+    conn = connect("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+
+def fill(conn, vocab, epubs, m4bs):
+    """Write the synthetic catalog in BATCH-record transactions. Returns
+    rows written per second."""
+    migrate(conn, REPO_DIR / "sql" / "schema.sql", REPO_DIR / "sql" / "migrations")
+    records = [("epub", i) for i in range(epubs)] + [("m4b", i) for i in range(m4bs)]
+    start = time.perf_counter()
+    for n in range(0, len(records), BATCH):
+        write_records(conn, [
+            epub_record(vocab, i) if kind == "epub" else m4b_record(vocab, i)
+            for kind, i in records[n:n + BATCH]
+        ])
+        conn.commit()
+        print(f"\r  wrote {min(n + BATCH, len(records))}/{len(records)} rows", end="", flush=True)
+    elapsed = time.perf_counter() - start
+    print()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE epubs")
+        cur.execute("VACUUM ANALYZE m4bs")
+    conn.autocommit = False
+    return len(records) / elapsed
+
+# ── Queries ───────────────────────────────────────────────────────────────────
+
+def misspell(rng, word):
+    """`word` with one inner letter dropped."""
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+def queries(conn, rng):
+    """[(label, text, offset)] picked from the filled catalog."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT title, author_names, description FROM epubs ORDER BY id LIMIT 1 OFFSET %s",
+            (rng.randrange(1000),),
+        )
+        title, authors, description = cur.fetchone()
+        cur.execute("""
+            SELECT word, ndoc FROM ts_stat('SELECT search FROM epubs')
+            ORDER BY ndoc DESC, word
+        """)
+        stats = cur.fetchall()
+    words = title.split()
+    author = authors.split("; ")[0]
+    common = stats[0][0]
+    # Queries match words as prefixes, so a rare word must not start others.
+    lexemes = sorted(word for word, _ in stats)
+    prefixes = {w for w, following in zip(lexemes, lexemes[1:]) if following.startswith(w)}
+    rare = next(word for word, _ in reversed(stats) if len(word) > 4 and word not in prefixes)
+    long_word = max(words, key=len)
+    # A description word of the same row that is not in its title.
+    described = next(w for w in reversed(description.split()) if w.lower() not in title.lower())
+    return [
+        ("whole title",       title, 0),
+        ("title prefixes",    " ".join(w[:4] for w in words[:2]), 0),
+        ("author",            author, 0),
+        ("title + descr.",    f"{words[0]} {described}", 0),
+        ("common word",       common, 0),
+        ("rare word",         rare, 0),
+        ("misspelled title",  title.replace(long_word, misspell(rng, long_word)), 0),
+        ("misspelled author", author.replace(author.split()[-1], misspell(rng, author.split()[-1])), 0),
+        ("no match",          "qxzv", 0),
+        ("common, page 50",   common, 49 * 20),
+    ]
+
+def explain(conn, text, offset, similar):
+    """Print the plan and timing of one search statement."""
+    sql, params = search_query(text, offset=offset, similar=similar)
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        print("\n".join("      " + row[0] for row in cur.fetchall()))
+
+def time_query(conn, text, offset, repeat, fuzzy):
+    """(total hits, [latency ms]) over `repeat` runs after one warm-up."""
+    search(conn, text, offset=offset, fuzzy=fuzzy)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total, _ = search(conn, text, offset=offset, fuzzy=fuzzy)
+        times.append(1000 * (time.perf_counter() - start))
+    return total, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalog search latency.")
+    parser.add_argument("--epubs", type=int, default=100000, help="EPUB rows (default: 100000)")
+    parser.add_argument("--m4bs", type=int, default=50000, help="M4B rows (default: 50000)")
+    parser.add_argument("--seed", type=int, default=1, help="Catalog and query seed (default: 1)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query (default: 20)")
+    parser.add_argument("--db", default="vibelib_search_bench", help="Scratch database")
+    parser.add_argument("--reuse", action="store_true", help="Search the existing --db without refilling it")
+    parser.add_argument("--exact", action="store_true", help="Search without trigram matches")
+    parser.add_argument("--explain", action="store_true", help="Print each query's plan")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("POSTGRES_HOST", "localhost")
+    os.environ.setdefault("POSTGRES_PORT", "5432")
+    os.environ.setdefault("POSTGRES_USER", "vibelib")
+
+    rng = random.Random(args.seed)
+    write_rate = None
+    if not args.reuse:
+        recreate_database(args.db)
+        print(f"Filling {args.db} with {args.epubs} epubs and {args.m4bs} m4bs...")
+        conn = connect(args.db)
+        write_rate = fill(conn, Vocabulary(rng), args.epubs, args.m4bs)
+        print(f"  {write_rate:.0f} rows/s through catalog.write_records")
+    else:
+        conn = connect(args.db)
+    with conn.cursor() as cur:
+        cur.execute("SELECT (SELECT count(*) FROM epubs), (SELECT count(*) FROM m4bs)")
+        epubs, m4bs = cur.fetchone()
+    print(f"Catalog: {epubs} epubs, {m4bs} m4bs. Search: {'exact' if args.exact else 'full text + trigram'}.")
+
+    results = []
+    print(f"  {'query':<18} {'hits':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}  text")
+    for label, text, offset in queries(conn, rng):
+        total, times = time_query(conn, text, offset, args.repeat, not args.exact)
+        times.sort()
+        p50, p95 = statistics.median(times), times[min(len(times) - 1, int(0.95 * len(times)))]
+        print(f"  {label:<18} {total:>7} {p50:>8.1f} {p95:>8.1f} {times[-1]:>8.1f}  {text!r}")
+        results.append({"query": label, "text": text, "offset": offset, "hits": total,
+                        "p50_ms": p50, "p95_ms": p95, "max_ms": times[-1]})
+        if args.explain:
+            explain(conn, text, offset, False)
+            if total and not search(conn, text, offset=offset, fuzzy=False)[0]:
+                explain(conn, text, offset, True)
+    conn.close()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "epubs": epubs, "m4bs": m4bs, "seed": args.seed, "exact": args.exact,
+            "write_rows_per_s": write_rate, "queries": results,
+        }, indent=2) + "\n")
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic, reproducible corpus of EPUBs and M4Bs for loader
+benchmarks (see bench_loader.py).
+
+The same --seed always produces byte-identical files. The corpus varies the
+shapes the loader's parsers care about:
+
+  EPUBs  OPF location and file name, EPUB2 (<meta name="cover">) vs.
+         EPUB3 (properties="cover-image") vs. no cover, cover dimensions,
+         1-6 creators with roles, Calibre series tags, identifier schemes,
+         and body size.
+  M4Bs   audio payload size, chapter count and format (QuickTime chapter
+         track, Nero chpl, both, none), JPEG/PNG/no cover atom, and moov
+         before mdat ("fast start") or after it, as most encoders write it.
+         With --interleave-chapters, QuickTime chapter samples sit between
+         the audio chunks instead of together after them.
+
+The audio payload is filler: the files parse like real M4Bs (mutagen,
+chapters.read_chapters, ffprobe) but do not play. Usage:
+
+  python bench/make_corpus.py OUT_DIR [--epubs N] [--m4bs N] [--seed S]
+                               [--interleave-chapters]
+
+OUT_DIR gets epub/ and m4b/ subdirectories and a corpus.json describing the
+parameters and totals.
+"""
+
+import argparse
+import io
+import json
+import random
+import struct
+import zipfile
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+WORDS = (
+    "amber river silent crown winter garden iron letter shadow harbor glass "
+    "northern empire last orchard hidden station broken compass salt machine "
+    "paper kingdom bright hollow stone signal"
+).split()
+NAMES = (
+    "Ada Byrne", "Tomas Okafor", "Mei Lindqvist", "Ravi Castellanos", "June Hartmann",
+    "Idris Novak", "Clara Mbeki", "Oskar Takahashi", "Lena Fairweather", "Samir Duarte",
+)
+ROLES = ("aut", "aut", "aut", "edt", "trl", "ill")
+
+# ── Covers ────────────────────────────────────────────────────────────────────
+
+COVER_SIZES = ((300, 450), (600, 900), (1000, 1500), (1600, 2400))
+
+def cover_image(rng, index, fmt="JPEG"):
+    """A deterministic, per-book distinct cover in JPEG or PNG."""
+    w, h = rng.choice(COVER_SIZES)
+    img = Image.new("RGB", (w, h), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(4, 12)):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        draw.rectangle(
+            (x0, y0, x0 + rng.randrange(w // 2), y0 + rng.randrange(h // 2)),
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    draw.text((w // 10, h // 10), f"#{index}", fill=(255, 255, 255))
+    buf = io.BytesIO()
+    img.save(buf, fmt, quality=85) if fmt == "JPEG" else img.save(buf, fmt)
+    return buf.getvalue()
+
+def title(rng):
+    return " ".join(w.capitalize() for w in rng.sample(WORDS, rng.randint(2, 5)))
+
+# ── EPUB ──────────────────────────────────────────────────────────────────────
+
+CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="{opf}" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+OPF_DIRS = ("OEBPS/", "OPS/", "")
+
+def make_epub(rng, index):
+    opf_dir   = rng.choice(OPF_DIRS)
+    opf_path  = opf_dir + rng.choice(("content.opf", "package.opf"))
+    epub3     = rng.random() < 0.5
+    cover     = rng.choices(("jpg", "png", None), weights=(6, 2, 2))[0]
+    n_authors = rng.choices(range(1, 7), weights=(50, 25, 10, 8, 4, 3))[0]
+    n_chaps   = rng.randint(3, 40)
+
+    creators = []
+    for i, name in enumerate(rng.sample(NAMES, n_authors)):
+        role = "aut" if i == 0 else rng.choice(ROLES)
+        creators.append(f'<dc:creator opf:role="{role}">{name}</dc:creator>')
+    ids = [f'<dc:identifier id="uid">urn:uuid:{rng.getrandbits(128):032x}</dc:identifier>']
+    if rng.random() < 0.6:
+        ids.append(f'<dc:identifier opf:scheme="ISBN">978{rng.randrange(10**10):010d}</dc:identifier>')
+    if rng.random() < 0.3:
+        ids.append(f'<dc:identifier opf:scheme="AMAZON">B0{rng.randrange(10**8):08d}</dc:identifier>')
+    metas = []
+    if rng.random() < 0.4:
+        metas.append(f'<meta name="calibre:series" content="{title(rng)}"/>')
+        metas.append(f'<meta name="calibre:series_index" content="{rng.randint(1, 12)}"/>')
+
+    manifest = [
+        f'<item id="c{i}" href="text/ch{i}.xhtml" media-type="application/xhtml+xml"/>'
+        for i in range(n_chaps)
+    ]
+    files = {}
+    if cover:
+        href = f"images/cover.{cover}"
+        media = "image/jpeg" if cover == "jpg" else "image/png"
+        props = ' properties="cover-image"' if epub3 else ""
+        manifest.append(f'<item id="cover-img" href="{href}" media-type="{media}"{props}/>')
+        if not epub3:
+            metas.append('<meta name="cover" content="cover-img"/>')
+        files[opf_dir + href] = cover_image(rng, index, "JPEG" if cover == "jpg" else "PNG")
+    spine = "".join(f'<itemref idref="c{i}"/>' for i in range(n_chaps))
+
+    opf = f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="{'3.0' if epub3 else '2.0'}" unique-identifier="uid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:title>{title(rng)}</dc:title>
+    {''.join(creators)}
+    <dc:publisher>{rng.choice(NAMES).split()[1]} Press</dc:publisher>
+    <dc:date>{rng.randint(1950, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}</dc:date>
+    <dc:language>{rng.choice(('en', 'en-US', 'de', 'fr'))}</dc:language>
+    <dc:subject>{rng.choice(WORDS).capitalize()}</dc:subject>
+    <dc:description>{' '.join(rng.choices(WORDS, k=rng.randint(20, 200)))}</dc:description>
+    {''.join(ids)}
+    {''.join(metas)}
+  </metadata>
+  <manifest>{''.join(manifest)}</manifest>
+  <spine>{spine}</spine>
+</package>
+"""
+    for i in range(n_chaps):
+        para = " ".join(rng.choices(WORDS, k=rng.randint(200, 3000)))
+        files[f"{opf_dir}text/ch{i}.xhtml"] = (
+            f'<html xmlns="http://www.w3.org/1999/xhtml"><body><p>{para}</p></body></html>'
+        ).encode()
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        def add(name, data, compress=zipfile.ZIP_DEFLATED):
+            # A fixed timestamp keeps the output identical across runs.
+            info = zipfile.ZipInfo(name, date_time=(2000, 1, 1, 0, 0, 0))
+            info.compress_type = compress
+            zf.writestr(info, data)
+        add("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        add("META-INF/container.xml", CONTAINER.format(opf=opf_path))
+        add(opf_path, opf)
+        for name, data in files.items():
+            add(name, data, zipfile.ZIP_STORED if name.endswith((".jpg", ".png")) else zipfile.ZIP_DEFLATED)
+    return buf.getvalue()
+
+# ── M4B ───────────────────────────────────────────────────────────────────────
+
+def box(kind, *payload):
+    data = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(data), kind) + data
+
+def full_box(kind, version, flags, *payload):
+    return box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+SAMPLE_RATES = {48000: 3, 44100: 4, 22050: 7}
+
+def _descriptor(tag, payload):
+    return bytes([tag, len(payload)]) + payload
+
+def _esds(sample_rate, channels, bitrate):
+    asc = (2 << 11) | (SAMPLE_RATES[sample_rate] << 7) | (channels << 3)   # AAC LC
+    decoder = _descriptor(0x04, (
+        bytes([0x40, 0x15]) + (0).to_bytes(3, "big")
+        + struct.pack(">II", bitrate, bitrate)
+        + _descriptor(0x05, struct.pack(">H", asc))
+    ))
+    es = _descriptor(0x03, struct.pack(">HB", 1, 0) + decoder + _descriptor(0x06, b"\x02"))
+    return full_box(b"esds", 0, 0, es)
+
+def _stbl(entry, sizes, deltas, chunk_offsets):
+    """Sample table with every sample in one chunk, or given one offset per
+    sample, each sample in a chunk of its own."""
+    stts = struct.pack(">I", len(deltas)) + b"".join(struct.pack(">II", 1, d) for d in deltas)
+    per_chunk = len(sizes) if len(chunk_offsets) == 1 else 1
+    return box(
+        b"stbl",
+        full_box(b"stsd", 0, 0, struct.pack(">I", 1), entry),
+        full_box(b"stts", 0, 0, stts),
+        full_box(b"stsc", 0, 0, struct.pack(">IIII", 1, 1, per_chunk, 1)),
+        full_box(b"stsz", 0, 0, struct.pack(">II", 0, len(sizes)),
+                 struct.pack(f">{len(sizes)}I", *sizes)),
+        full_box(b"stco", 0, 0, struct.pack(f">I{len(chunk_offsets)}I", len(chunk_offsets), *chunk_offsets)),
+    )
+
+def _trak(track_id, handler, timescale, duration, header, stbl, tref=b""):
+    tkhd = full_box(
+        b"tkhd", 0, 3,
+        struct.pack(">IIIII", 0, 0, track_id, 0, duration * 1000 // timescale),
+        bytes(8), struct.pack(">hhhH", 0, 0, 0x100 if handler == b"soun" else 0, 0),
+        MATRIX, struct.pack(">II", 0, 0),
+    )
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, timescale, duration, 0x55C4, 0))
+    hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, handler), bytes(12), b"\x00")
+    dinf = box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1)))
+    minf = box(b"minf", header, dinf, stbl)
+    return box(b"trak", tkhd, tref, box(b"mdia", mdhd, hdlr, minf))
+
+def _ilst_item(kind, value, data_type=1):
+    return box(kind, box(b"data", struct.pack(">II", data_type, 0), value))
+
+def _ilst(rng, cover):
+    items = [
+        _ilst_item(b"\xa9nam", title(rng).encode()),
+        _ilst_item(b"\xa9ART", rng.choice(NAMES).encode()),
+        _ilst_item(b"\xa9wrt", rng.choice(NAMES).encode()),
+        _ilst_item(b"\xa9alb", title(rng).encode()),
+        _ilst_item(b"\xa9day", str(rng.randint(1990, 2025)).encode()),
+        _ilst_item(b"\xa9gen", b"Audiobook"),
+        _ilst_item(b"desc", " ".join(rng.choices(WORDS, k=rng.randint(10, 80))).encode()),
+    ]
+    if rng.random() < 0.5:
+        items.append(box(
+            b"----",
+            full_box(b"mean", 0, 0, b"com.apple.iTunes"),
+            full_box(b"name", 0, 0, b"ASIN"),
+            box(b"data", struct.pack(">II", 1, 0), f"B0{rng.randrange(10**8):08d}".encode()),
+        ))
+    if cover:
+        fmt, data = cover
+        items.append(_ilst_item(b"covr", data, 13 if fmt == "JPEG" else 14))
+    return box(b"ilst", *items)
+
+def _chpl(chapters):
+    entries = b"".join(
+        struct.pack(">QB", start_ms * 10000, len(name)) + name
+        for name, start_ms in ((n.encode()[:255], s) for n, s in chapters)
+    )
+    return full_box(b"chpl", 1, 0, bytes(4), bytes([len(chapters)]), entries)
+
+def _text_entry():
+    # QuickTime text sample description: display flags, justification,
+    # colours, text box, font and an empty font name.
+    return box(b"text", bytes(6), struct.pack(">H", 1), bytes(43), b"\x00")
+
+def _split(total, n):
+    return [total // n] * (n - 1) + [total - total // n * (n - 1)]
+
+def make_m4b(rng, index, audio_bytes, interleave=False):
+    """An M4B as parts: bytes, and ints standing for that many bytes of
+    audio filler (see write_m4b and m4b_bytes).
+
+    QuickTime chapter samples are stored together after the audio, unless
+    `interleave`: then the audio is split into one chunk per chapter and
+    each chapter's sample follows its chunk, as muxers that interleave
+    tracks by time write them. The same rng draws are made either way, so
+    both layouts of one seed hold the same book.
+    """
+    sample_rate = rng.choice(tuple(SAMPLE_RATES))
+    channels    = rng.choice((1, 2))
+    bitrate     = rng.choice((32000, 64000, 128000))
+    duration_ms = max(60_000, audio_bytes * 8 * 1000 // bitrate)
+    n_chapters  = rng.choice((0, 1, 5, 20, 60, 150))
+    chapter_fmt = rng.choice(("qt", "nero", "both")) if n_chapters else "none"
+    cover_fmt   = rng.choices(("JPEG", "PNG", None), weights=(6, 1, 2))[0]
+    moov_first  = rng.random() < 0.3
+
+    step = duration_ms // max(n_chapters, 1)
+    chapters = [(f"Chapter {i + 1}: {title(rng)}", i * step) for i in range(n_chapters)]
+    samples = [struct.pack(">H", len(t.encode())) + t.encode() for t, _ in chapters]
+    text_bytes = b"".join(samples)
+    cover = (cover_fmt, cover_image(rng, index, cover_fmt)) if cover_fmt else None
+    ilst = _ilst(rng, cover)
+
+    qt = chapter_fmt in ("qt", "both")
+    interleave = interleave and qt
+    audio_ticks = duration_ms * sample_rate // 1000
+    # mdat: audio then every chapter sample, or audio chunk and chapter
+    # sample in turn.
+    if interleave:
+        audio_sizes = _split(audio_bytes, n_chapters)
+        body = [part for pair in zip(audio_sizes, samples) for part in pair]
+    else:
+        audio_sizes = [audio_bytes]
+        body = [audio_bytes, text_bytes]
+
+    def moov(audio_offset):
+        offsets, pos = [], audio_offset
+        for part in body:
+            offsets.append(pos)
+            pos += part if isinstance(part, int) else len(part)
+        mp4a = box(
+            b"mp4a", bytes(6), struct.pack(">H", 1), bytes(8),
+            struct.pack(">HHHHI", channels, 16, 0, 0, sample_rate << 16),
+            _esds(sample_rate, channels, bitrate),
+        )
+        audio_stbl = _stbl(mp4a, audio_sizes, _split(audio_ticks, len(audio_sizes)), offsets[0::2])
+        traks = [_trak(
+            1, b"soun", sample_rate, audio_ticks,
+            full_box(b"smhd", 0, 0, bytes(4)), audio_stbl,
+            box(b"tref", box(b"chap", struct.pack(">I", 2))) if qt else b"",
+        )]
+        if qt:
+            deltas = [step] * (n_chapters - 1) + [duration_ms - step * (n_chapters - 1)]
+            text_stbl = _stbl(_text_entry(), [len(s) for s in samples], deltas, offsets[1::2])
+            traks.append(_trak(2, b"text", 1000, duration_ms, full_box(b"nmhd", 0, 0), text_stbl))
+        udta = [_chpl(chapters)] if chapter_fmt in ("nero", "both") else []
+        udta.append(full_box(
+            b"meta", 0, 0,
+            full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"mdir"), b"appl", bytes(8), b"\x00"),
+            ilst,
+        ))
+        mvhd = full_box(
+            b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, duration_ms),
+            struct.pack(">IH", 0x10000, 0x100), bytes(10), MATRIX, bytes(24),
+            struct.pack(">I", 3),
+        )
+        return box(b"moov", mvhd, *traks, box(b"udta", *udta))
+
+    ftyp = box(b"ftyp", b"M4B ", struct.pack(">I", 0), b"M4B mp42isom")
+    mdat_header = struct.pack(">I4s", 8 + audio_bytes + len(text_bytes), b"mdat")
+    # Sample offsets depend on where mdat lands, and stco entries are fixed
+    # width, so the moov size is known before its offsets are.
+    if moov_first:
+        offset = len(ftyp) + len(moov(0)) + len(mdat_header)
+        return (ftyp + moov(offset) + mdat_header, *body)
+    offset = len(ftyp) + len(mdat_header)
+    return (ftyp + mdat_header, *body[:-1], body[-1] + moov(offset))
+
+def write_m4b(path, parts, chunk=1024 * 1024):
+    """Write make_m4b's parts without holding the filler."""
+    filler = bytes(chunk)
+    with open(path, "wb") as f:
+        for part in parts:
+            if not isinstance(part, int):
+                f.write(part)
+                continue
+            while part > 0:
+                f.write(filler[:min(chunk, part)])
+                part -= chunk
+
+def m4b_bytes(parts):
+    """make_m4b's parts as one bytes object."""
+    return b"".join(bytes(part) if isinstance(part, int) else part for part in parts)
+
+# ── Main ──────────────────────────────────────────────────────────────────────
+
+def generate(out_dir, epubs=200, m4bs=20, seed=1, m4b_mb=(1, 64), interleave=False):
+    """Write the corpus to out_dir and return its corpus.json contents."""
+    out = Path(out_dir)
+    (out / "epub").mkdir(parents=True, exist_ok=True)
+    (out / "m4b").mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    totals = {"epub": [0, 0], "m4b": [0, 0]}
+
+    for i in range(epubs):
+        data = make_epub(rng, i)
+        (out / "epub" / f"book-{i:05d}.epub").write_bytes(data)
+        totals["epub"][0] += 1
+        totals["epub"][1] += len(data)
+    for i in range(m4bs):
+        audio = int(rng.uniform(*m4b_mb) * 1024 * 1024)
+        path = out / "m4b" / f"audiobook-{i:05d}.m4b"
+        write_m4b(path, make_m4b(rng, i, audio, interleave))
+        totals["m4b"][0] += 1
+        totals["m4b"][1] += path.stat().st_size
+
+    info = {
+        "seed": seed, "epubs": epubs, "m4bs": m4bs, "m4b_mb": list(m4b_mb),
+        "interleave_chapters": interleave,
+        "files": totals["epub"][0] + totals["m4b"][0],
+        "bytes": totals["epub"][1] + totals["m4b"][1],
+        "epub_bytes": totals["epub"][1], "m4b_bytes": totals["m4b"][1],
+    }
+    (out / "corpus.json").write_text(json.dumps(info, indent=2) + "\n")
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic EPUB/M4B corpus.")
+    parser.add_argument("out_dir", help="Directory to write the corpus to")
+    parser.add_argument("--epubs", type=int, default=200, help="Number of EPUBs (default: 200)")
+    parser.add_argument("--m4bs", type=int, default=20, help="Number of M4Bs (default: 20)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--m4b-mb", type=float, nargs=2, default=(1, 64), metavar=("MIN", "MAX"),
+                        help="Range of M4B audio payload sizes in MB (default: 1 64)")
+    parser.add_argument("--interleave-chapters", action="store_true",
+                        help="Store QuickTime chapter samples between the audio chunks")
+    args = parser.parse_args()
+
+    info = generate(
+        args.out_dir, args.epubs, args.m4bs, args.seed, tuple(args.m4b_mb), args.interleave_chapters,
+    )
+    print(
+        f"{info['files']} files, {info['bytes'] / 1e6:.1f} MB "
+        f"({info['epubs']} epubs, {info['m4bs']} m4bs, seed {info['seed']}) in {args.out_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
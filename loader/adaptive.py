@@ -0,0 +1,182 @@
+"""
+Adaptive download concurrency for the loader (ADAPTIVE_DOWNLOADS=true).
+
+A fixed DOWNLOAD_WORKERS suits only one mix of object sizes and link
+latency: too few slots leave the link idle on small EPUBs, too many
+oversubscribe it on multi-GB M4Bs. AIMD adjusts the number of download slots
+once per window of WINDOW seconds from what the window observed:
+
+  - any throttling response (SlowDown, 503, ...) or an error rate above
+    ERROR_RATE halves the limit (multiplicative decrease);
+  - if throughput rose by at least GAIN since the last window while every
+    slot was busy, the limit grows by one (additive increase), and after
+    PROBE_AFTER flat windows it grows by one anyway to probe for headroom;
+  - if the window right after an increase gained less than GAIN, that
+    increase is undone, so the limit settles where more slots stop paying.
+
+The limit stays within [minimum, maximum]. Slots (threads) and AsyncSlots
+(asyncio tasks) gate downloads on the current limit, so a stage can run
+`maximum` workers of which only `limit` download at once. Bytes are fed in
+through observe(); the loader does this from FetchStats.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from botocore.exceptions import ClientError
+
+WINDOW      = 5.0
+ERROR_RATE  = 0.1
+GAIN        = 0.05
+BACKOFF     = 0.5
+PROBE_AFTER = 3
+
+THROTTLE_CODES = {
+    "SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded",
+    "TooManyRequests", "ServiceUnavailable", "RequestTimeout", "503",
+}
+
+
+def is_throttle(error):
+    """True if `error` is the object store asking us to slow down."""
+    if isinstance(error, ClientError):
+        err = error.response.get("Error", {})
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return err.get("Code") in THROTTLE_CODES or status in (429, 503)
+    return False
+
+
+class AIMD:
+    """Thread-safe controller for the number of concurrent downloads.
+    `on_change(old, new, reason)` is called whenever the limit moves."""
+
+    def __init__(self, initial, minimum, maximum, window=WINDOW, on_change=None):
+        self.minimum   = max(1, minimum)
+        self.maximum   = max(self.minimum, maximum)
+        self.limit     = min(max(initial, self.minimum), self.maximum)
+        self.window    = window
+        self.on_change = on_change
+        self._lock     = threading.Lock()
+        self._last_rate = None
+        self._last_move = 0
+        self._flat      = 0
+        self.reset_window()
+
+    def reset_window(self):
+        """Start a fresh window, e.g. at the start of a pass after idling."""
+        with self._lock:
+            self._start     = time.monotonic()
+            self._bytes     = 0
+            self._done      = 0
+            self._errors    = 0
+            self._throttles = 0
+            self._busy      = False
+
+    def busy(self, active):
+        """Note that `active` slots are in use."""
+        if active >= self.limit:
+            self._busy = True
+
+    def observe(self, nbytes=0, done=False, error=None):
+        """Record bytes received, a finished download, or a failed one."""
+        with self._lock:
+            self._bytes += nbytes
+            if error is not None:
+                if is_throttle(error):
+                    self._throttles += 1
+                else:
+                    self._errors += 1
+            elif done:
+                self._done += 1
+            elapsed = time.monotonic() - self._start
+            if elapsed < self.window:
+                return
+            change = self._decide(elapsed)
+        if change and self.on_change is not None:
+            self.on_change(*change)
+
+    def _decide(self, elapsed):
+        """Close the window; returns (old, new, reason) if the limit moved."""
+        old, attempts = self.limit, self._done + self._errors + self._throttles
+        rate, last = self._bytes / elapsed, self._last_rate
+        reason = None
+        if not (attempts or self._bytes):
+            pass    # nothing finished: nothing to learn from
+        elif self._throttles or (attempts and self._errors / attempts > ERROR_RATE):
+            self.limit = max(self.minimum, int(self.limit * BACKOFF))
+            reason = f"{self._throttles} throttled, {self._errors} errors of {attempts}"
+        elif last and self._last_move > 0 and rate < last * (1 + GAIN):
+            self.limit = max(self.minimum, self.limit - 1)
+            reason = f"no gain from the last slot ({100 * (rate / last - 1):+.0f}%)"
+        elif self._busy and (not last or rate >= last * (1 + GAIN) or self._flat >= PROBE_AFTER):
+            self.limit = min(self.maximum, self.limit + 1)
+            reason = "probing" if last and rate < last * (1 + GAIN) else "throughput rising"
+        else:
+            self._flat += 1
+        if reason is not None:
+            self._flat = 0
+        self._last_move = self.limit - old
+        if attempts or self._bytes:
+            self._last_rate = rate
+        self._start     = time.monotonic()
+        self._bytes     = self._done = self._errors = self._throttles = 0
+        self._busy      = False
+        if self.limit != old:
+            return old, self.limit, f"{reason}; {rate / 1e6:.1f} MB/s"
+        return None
+
+
+class Slots:
+    """Threading gate: at most controller.limit holders of slot() at once."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.active     = 0
+        self._cond      = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.active < self.controller.limit)
+            self.active += 1
+            self.controller.busy(self.active)
+        try:
+            yield
+        except Exception as e:
+            self.controller.observe(error=e)
+            raise
+        else:
+            self.controller.observe(done=True)
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+
+class AsyncSlots:
+    """Slots for asyncio tasks on one event loop."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.active     = 0
+        self._cond      = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.controller.limit)
+            self.active += 1
+            self.controller.busy(self.active)
+        try:
+            yield
+        except Exception as e:
+            self.controller.observe(error=e)
+            raise
+        else:
+            self.controller.observe(done=True)
+        finally:
+            async with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
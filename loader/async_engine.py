@@ -0,0 +1,513 @@
+"""
+Asyncio engine for the loader (ENGINE=async).
+
+The thread engine holds one OS thread per concurrent download, so keeping a
+high-latency object store busy with hundreds of requests means hundreds of
+threads. This engine runs the same pass on a single event loop: downloads
+are aiobotocore requests, up to ASYNC_CONCURRENCY of them in flight at once,
+and catalog writes go through an asyncpg connection pool of PG_POOL_SIZE, so
+a batch can be written while the next one fills.
+
+Everything else is shared with the thread engine. Parsing runs the loader's
+parse_source in a spawn process pool, covers are saved by save_cover_item
+on COVER_WORKERS threads, and the manifest diff and upserts run the same SQL
+as catalog.py. Keys are listed and claimed as in the thread engine (see
+jobs.py), so both engines' replicas can share one bucket. A pass therefore
+loads the same rows as the thread engine.
+In range mode, M4B moov atoms are read by the parse processes instead of in
+the download stage, because the range reader is synchronous.
+
+run_once takes the loader module as an argument instead of importing it,
+because loader.py runs as a script and reads its configuration at import.
+"""
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import asyncpg
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from catalog import (
+    CATALOG_MARK_GONE, CATALOG_UNMARK_GONE, EPUB_UPSERT, LIVE_COUNTS, LISTING_TABLE,
+    M4B_UPSERT, MANIFEST_MARK_GONE, MANIFEST_TO_LOAD, MANIFEST_UPSERT, MARK_LOADED,
+    BatchWriter, child_params, record_params,
+)
+from jobs import (
+    CLAIM, FAIL, PENDING_COUNT, QUARANTINE_EXPIRED, RELEASE, STATE_COUNTS, LeaseKeeper,
+    describe_failure,
+)
+import metrics
+from adaptive import AsyncSlots
+from parsecache import Cached
+from pipeline import DONE, Failed
+from s3io import HashingWriter
+
+CHUNK_SIZE = 1024 * 1024   # streaming read size; each chunk is hashed as it arrives
+MAX_PARAMS = 32767         # Postgres bind parameter limit per statement
+
+# ── Catalog (asyncpg) ─────────────────────────────────────────────────────────
+
+def _numbered(sql):
+    """Rewrite psycopg2 %s placeholders as asyncpg's $1, $2, ..."""
+    parts = sql.split("%s")
+    return "".join(f"{part}${i}" for i, part in enumerate(parts[:-1], 1)) + parts[-1]
+
+async def sync_manifest(conn, listing):
+    """asyncpg version of catalog.sync_manifest; same statements, same result."""
+    async with conn.transaction():
+        await conn.execute(LISTING_TABLE)
+        await conn.copy_records_to_table("listing", records=listing)
+        await conn.execute("ANALYZE listing")
+        await conn.execute(MANIFEST_UPSERT)
+        gone = int((await conn.execute(MANIFEST_MARK_GONE)).split()[-1])
+        for table in ("epubs", "m4bs"):
+            await conn.execute(CATALOG_MARK_GONE.format(table=table))
+            await conn.execute(CATALOG_UNMARK_GONE.format(table=table))
+        to_load = [tuple(row) for row in await conn.fetch(MANIFEST_TO_LOAD)]
+    return to_load, gone
+
+async def claims(db, worker, batch, lease_seconds):
+    """asyncpg version of jobs.iter_claims: yields claimed (s3_key, size,
+    etag, known, reclaimed) rows, one batch at a time, until none are left."""
+    while True:
+        async with db.acquire() as conn, conn.transaction():
+            await conn.execute(QUARANTINE_EXPIRED)
+            rows = sorted(tuple(r) for r in await conn.fetch(
+                _numbered(CLAIM), worker, float(lease_seconds), batch,
+            ))
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+def _values(sql, rows):
+    """Expand the `VALUES %s` of a catalog statement into numbered
+    placeholders, as psycopg2's execute_values does. Yields (sql, args) per
+    chunk of rows that fits in one statement."""
+    width = len(rows[0])
+    per_statement = MAX_PARAMS // width
+    for i in range(0, len(rows), per_statement):
+        chunk = rows[i:i + per_statement]
+        values = ", ".join(
+            "(" + ", ".join(f"${r * width + c + 1}" for c in range(width)) + ")"
+            for r in range(len(chunk))
+        )
+        yield sql.replace("%s", values), [v for row in chunk for v in row]
+
+async def fail(conn, worker, s3_key, etag, error):
+    """asyncpg version of jobs.fail."""
+    row = await conn.fetchrow(_numbered(FAIL), etag, str(error)[:2000], s3_key, worker)
+    return tuple(row) if row else None
+
+async def _upsert(conn, sql, rows):
+    """Run a catalog upsert (`... RETURNING s3_key, id`) for rows.
+    Returns {s3_key: id}."""
+    ids = {}
+    for statement, args in _values(sql, rows):
+        ids.update((row["s3_key"], row["id"]) for row in await conn.fetch(statement, *args))
+    return ids
+
+# (kind, upsert, child table, child columns)
+_TABLES = (
+    ("epub", EPUB_UPSERT, "epub_authors", ("epub_id", "author", "role", "position")),
+    ("m4b",  M4B_UPSERT,  "m4b_chapters", ("m4b_id", "position", "title", "start_ms")),
+)
+
+async def write_records(conn, records):
+    """asyncpg version of catalog.write_records: upserts records, replaces
+    their child rows (with binary COPY) and marks them loaded in the
+    manifest, inside the caller's transaction. Returns {s3_key: record_id}."""
+    ids = {}
+    for kind, upsert, child_table, child_columns in _TABLES:
+        batch = {r[1]: r for r in records if r[0] == kind}
+        if not batch:
+            continue
+        kind_ids = await _upsert(
+            conn, upsert, [tuple(record_params(record).values()) for record in batch.values()],
+        )
+        ids.update(kind_ids)
+        await conn.execute(
+            f"DELETE FROM {child_table} WHERE {child_columns[0]} = ANY($1::int[])",
+            list(kind_ids.values()),
+        )
+        children = [
+            (kind_ids[key], *child)
+            for key, record in batch.items()
+            for child in child_params(record)
+        ]
+        if children:
+            await conn.copy_records_to_table(child_table, columns=child_columns, records=children)
+    loaded = [(r[1], r[2]) for r in records if r[2] is not None]
+    if loaded:
+        for statement, args in _values(MARK_LOADED, loaded):
+            await conn.execute(statement, *args)
+    return ids
+
+class AsyncBatchWriter(BatchWriter):
+    """BatchWriter that writes through an asyncpg pool. The loop takes a
+    batch with take() and may write() it while the next one fills; a failed
+    batch is retried one record at a time, as in BatchWriter.flush."""
+
+    def __init__(self, pool, max_records=100, max_delay_ms=1000):
+        super().__init__(None, max_records, max_delay_ms)
+        self.pool = pool
+
+    async def write(self, pending):
+        """Write [(record, extra)] from take(). Returns (written, failed) as
+        BatchWriter.flush does."""
+        if not pending:
+            return [], []
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    ids = await write_records(conn, [record for record, _ in pending])
+                return [(record, ids[record[1]], extra) for record, extra in pending], []
+            except Exception:
+                pass
+
+            written, failed = [], []
+            for record, extra in pending:
+                try:
+                    async with conn.transaction():
+                        ids = await write_records(conn, [record])
+                    written.append((record, ids[record[1]], extra))
+                except Exception as e:
+                    failed.append((record, e))
+            return written, failed
+
+# ── Pipeline ──────────────────────────────────────────────────────────────────
+
+def stage(name, fn, workers, inbox, outbox=None):
+    """asyncio counterpart of pipeline.Stage: `workers` tasks awaiting
+    fn(item) for items from `inbox` into `outbox`, with the same DONE and
+    Failed conventions. Returns the tasks."""
+    remaining = workers
+
+    async def run():
+        nonlocal remaining
+        while True:
+            item = await inbox.get()
+            if item is DONE:
+                await inbox.put(DONE)    # let sibling tasks see it too
+                break
+            if isinstance(item, Failed):
+                result = item
+            else:
+                try:
+                    result = await fn(item)
+                except Exception as e:
+                    result = Failed(name, item, e)
+            if result is None:
+                continue
+            if outbox is not None:
+                await outbox.put(result)
+            elif isinstance(result, Failed):
+                print(f"  ERROR in {result.stage} stage for {result.key}: {result.error}", flush=True)
+        remaining -= 1
+        if remaining == 0 and outbox is not None:
+            await outbox.put(DONE)
+
+    return [asyncio.create_task(run(), name=f"{name}-{i}") for i in range(workers)]
+
+async def feed(q, items):
+    """Put items from an async iterator then DONE on `q`; like pipeline.feed,
+    the pipeline still ends if the iterator raises."""
+    try:
+        async for item in items:
+            await q.put(item)
+    except Exception as e:
+        print(f"  ERROR feeding pipeline: {e}", flush=True)
+    finally:
+        await q.put(DONE)
+
+# ── Engine ────────────────────────────────────────────────────────────────────
+
+def make_s3(ld):
+    return get_session().create_client(
+        "s3",
+        endpoint_url=f"{ld.S3_SCHEME}://{ld.S3_ENDPOINT}",
+        aws_access_key_id=ld.S3_KEY,
+        aws_secret_access_key=ld.S3_SECRET,
+        region_name=ld.S3_REGION,
+        config=AioConfig(
+            signature_version="s3v4",
+            max_pool_connections=ld.ASYNC_CONCURRENCY,
+        ),
+    )
+
+class MemoryBudget:
+    """Bytes of downloaded objects held in memory at once. An object is
+    reserved under its key when it is fetched into memory and released once
+    it has been parsed; one that does not fit goes to a temp file instead of
+    waiting. All calls come from the event loop's thread."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used  = 0
+        self._held = {}
+
+    def reserve(self, key, size):
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        self._held[key] = self._held.get(key, 0) + size
+        return True
+
+    def release(self, key):
+        self.used -= self._held.pop(key, 0)
+
+async def fetch_object(ld, s3, budget, key, size):
+    """Download stage; returns the same (key, kind, source, size, prefetched,
+    digest) as the loader's fetch_object. Objects under INMEMORY_MAX_BYTES
+    are kept in memory while `budget` has room for them."""
+    kind = "epub" if key.lower().endswith(".epub") else "m4b"
+    if ld.FETCH_MODE == "range":
+        return (key, kind, None, size, (0, 0), None)
+
+    resp = await s3.get_object(Bucket=ld.S3_BUCKET, Key=key)
+    async with resp["Body"] as body:
+        if size is not None and size < ld.INMEMORY_MAX_BYTES and budget.reserve(key, size):
+            print(f"  [{kind}] fetching {Path(key).name} into memory...", flush=True)
+            try:
+                sink = HashingWriter()
+                while chunk := await body.read(CHUNK_SIZE):
+                    sink.write(chunk)
+            except BaseException:
+                budget.release(key)
+                raise
+            ld.FETCH_STATS.add(sink.size, size)
+            return (key, kind, sink.getvalue(), size, None, sink.digest())
+
+        print(f"  [{kind}] downloading {Path(key).name}...", flush=True)
+        fd, path = tempfile.mkstemp(suffix=f".{kind}")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                sink = HashingWriter(f)
+                while chunk := await body.read(CHUNK_SIZE):
+                    await asyncio.to_thread(sink.write, chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+    ld.FETCH_STATS.add(sink.size, size if size is not None else sink.size)
+    return (key, kind, path, size, None, sink.digest())
+
+async def run_once(ld, reconcile=True):
+    """One pass of the loader on the event loop; see loader.run_once."""
+    loop = asyncio.get_running_loop()
+    db = await asyncpg.create_pool(
+        host=ld.PG_HOST, port=ld.PG_PORT, database=ld.PG_DB,
+        user=ld.PG_USER, password=ld.PG_PASSWORD,
+        min_size=1, max_size=ld.PG_POOL_SIZE,
+    )
+    try:
+        async with make_s3(ld) as s3:
+            await _run(ld, loop, db, s3, reconcile)
+    finally:
+        await db.close()
+
+async def _run(ld, loop, db, s3, reconcile):
+    if not reconcile:
+        print(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Claiming pending keys (next full listing at the reconcile).",
+            flush=True,
+        )
+    elif await asyncio.to_thread(ld.LISTER.held):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Listing bucket...", flush=True)
+        async with db.acquire() as conn:
+            with metrics.timing("list"):
+                listing = [
+                    row
+                    async for page in s3.get_paginator("list_objects_v2").paginate(Bucket=ld.S3_BUCKET)
+                    for row in map(ld.listing_row, page.get("Contents", []))
+                    if row
+                ]
+                to_load, gone_count = await sync_manifest(conn, listing)
+            db_counts = tuple(await conn.fetchrow(LIVE_COUNTS))
+        ld.print_listing_summary(listing, to_load, gone_count, db_counts)
+    else:
+        print(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Another replica is listing the bucket; claiming pending keys only.",
+            flush=True,
+        )
+    ld.print_job_summary(dict(await db.fetch(STATE_COUNTS)))
+
+    new_count = await db.fetchval(PENDING_COUNT)
+    if not new_count:
+        return
+    etags, from_cache = {}, set()
+
+    # With ADAPTIVE_DOWNLOADS, ld.DOWNLOAD_LIMIT.limit of the
+    # ASYNC_CONCURRENCY download tasks hold a slot at a time.
+    slots = None
+    if ld.DOWNLOAD_LIMIT is not None:
+        ld.DOWNLOAD_LIMIT.reset_window()
+        slots = AsyncSlots(ld.DOWNLOAD_LIMIT)
+        concurrency = ld.download_concurrency()
+    else:
+        metrics.DOWNLOAD_CONCURRENCY.set(ld.ASYNC_CONCURRENCY)
+        concurrency = f"{ld.ASYNC_CONCURRENCY} concurrent downloads"
+    print(
+        f"Loading up to {new_count} files as {ld.LOADER_ID}: {concurrency}, "
+        f"{ld.PARSE_WORKERS} parse processes, {ld.COVER_WORKERS} cover threads, "
+        f"{ld.PG_POOL_SIZE} db connections, queue depth {ld.QUEUE_DEPTH} "
+        f"(fetch mode: {ld.FETCH_MODE}).",
+        flush=True,
+    )
+    ld.FETCH_STATS.reset()
+
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=ld.PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+    )
+    cover_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ld.COVER_WORKERS, thread_name_prefix="cover",
+    )
+
+    async def fetch(item):
+        fetched = await fetch_object(ld, s3, budget, *item)
+        if not ld.SKIP_DUPLICATES:
+            return fetched
+        try:
+            result = await asyncio.to_thread(ld.skip_duplicate, fetched)
+        except BaseException:
+            budget.release(fetched[0])
+            raise
+        if result[2] is not fetched[2]:
+            budget.release(fetched[0])    # swapped for its duplicate's copy
+        return result
+
+    timed_fetch = metrics.timed_async("download", fetch)
+
+    async def download(item):
+        if ld.PARSE_CACHE:
+            key, size = item
+            hit = await asyncio.to_thread(ld.cached_item, key, etags[key], size)
+            if hit is not None:
+                from_cache.add(key)
+                return hit
+        if slots is None:
+            return await timed_fetch(item)
+        async with slots.slot():
+            return await timed_fetch(item)
+
+    async def parse(item):
+        key, kind, source, size, prefetched, digest = item
+        if isinstance(source, Cached):
+            return (key, kind, *source.result)
+        try:
+            result, fetched = await loop.run_in_executor(
+                pool, ld.parse_source, key, kind, source, size,
+            )
+        except Exception as e:
+            ld.observe_parse_error(e)
+            raise
+        finally:
+            if isinstance(source, str):
+                os.unlink(source)
+            budget.release(key)
+        ld.account_fetch(kind, size, prefetched, fetched)
+        ld.stamp_digest(result, digest)
+        return (key, kind, *result)
+
+    async def save_cover(item):
+        await loop.run_in_executor(cover_pool, ld.save_cover_item, item)
+
+    # With hundreds of downloads in flight, the objects between download and
+    # parse could hold ASYNC_CONCURRENCY * INMEMORY_MAX_BYTES; past
+    # ASYNC_INMEMORY_BYTES of them, small objects are spooled like big ones.
+    budget = MemoryBudget(ld.ASYNC_INMEMORY_BYTES)
+    download_q = asyncio.Queue(ld.QUEUE_DEPTH)
+    parse_q    = asyncio.Queue(ld.QUEUE_DEPTH)
+    write_q    = asyncio.Queue(ld.QUEUE_DEPTH)
+    cover_q    = asyncio.Queue(ld.QUEUE_DEPTH)
+
+    async def claimed():
+        async for key, size, etag, _, reclaimed in claims(db, ld.LOADER_ID, ld.CLAIM_BATCH, ld.LEASE_SECONDS):
+            if reclaimed:
+                print(f"  reclaimed {key} from an expired lease", flush=True)
+            etags[key] = etag
+            yield key, size
+
+    metrics.watch_queues(download=download_q, parse=parse_q, write=write_q, cover=cover_q)
+    keeper = LeaseKeeper(ld.connect_db, ld.LOADER_ID, ld.LEASE_SECONDS).start()
+    tasks = [
+        *stage("download", download, ld.ASYNC_CONCURRENCY, download_q, parse_q),
+        *stage("parse", metrics.timed_async("parse", parse), ld.PARSE_WORKERS, parse_q, write_q),
+        *stage("cover", metrics.timed_async("cover", save_cover), ld.COVER_WORKERS, cover_q),
+        asyncio.create_task(feed(download_q, claimed())),
+    ]
+
+    counts = {"epub": 0, "m4b": 0, "error": 0}
+    writer = AsyncBatchWriter(db, ld.WRITE_BATCH_SIZE, ld.WRITE_BATCH_MS)
+    flushing = set()
+
+    async def flush(pending):
+        with metrics.timing("write"):
+            written, failed = await writer.write(pending)
+        print(f"  wrote {len(written)}/{len(pending)} records in one flush", flush=True)
+        for (kind, key, *_), record_id, cover in written:
+            if cover:
+                await cover_q.put((key, kind, record_id, *cover))
+            counts[kind] += 1
+            metrics.loaded(kind)
+        for (kind, key, etag, *_), e in failed:
+            print(f"  ERROR writing {key}: {e}", flush=True)
+            job = await fail(db, ld.LOADER_ID, key, etag, f"write: {e}")
+            print(f"  {describe_failure(job)}", flush=True)
+            counts["error"] += 1
+            metrics.failed(kind)
+
+    async def start_flush():
+        # One flush per pool connection at a time.
+        while len(flushing) >= ld.PG_POOL_SIZE:
+            done, _ = await asyncio.wait(flushing, return_when=asyncio.FIRST_COMPLETED)
+            flushing.difference_update(done)
+            for task in done:
+                task.result()
+        flushing.add(asyncio.create_task(flush(writer.take())))
+
+    completed = 0
+    while True:
+        try:
+            item = await asyncio.wait_for(write_q.get(), writer.time_left())
+        except asyncio.TimeoutError:
+            item = None
+        if item is DONE:
+            break
+        if item is not None:
+            completed += 1
+            if isinstance(item, Failed):
+                kind = "epub" if item.key.lower().endswith(".epub") else "m4b"
+                print(f"[{completed}/{new_count}] [{kind}] {item.key}", flush=True)
+                print(f"  ERROR in {item.stage}: {item.error}", flush=True)
+                job = await fail(db, ld.LOADER_ID, item.key, etags[item.key], f"{item.stage}: {item.error}")
+                print(f"  {describe_failure(job)}", flush=True)
+                counts["error"] += 1
+                metrics.failed(kind)
+            else:
+                key, kind = item[:2]
+                print(f"[{completed}/{new_count}] [{kind}] {key}", flush=True)
+                writer.add(*ld.result_record(item, etags[key]))
+                if ld.PARSE_CACHE and key not in from_cache:
+                    await asyncio.to_thread(ld.remember, item, etags[key])
+        if writer.due():
+            await start_flush()
+    if len(writer):
+        await start_flush()
+    for task in asyncio.as_completed(flushing):
+        await task
+    await cover_q.put(DONE)
+    await asyncio.gather(*tasks)
+    pool.shutdown()
+    cover_pool.shutdown()
+    await asyncio.to_thread(keeper.stop)
+    await db.execute(_numbered(RELEASE), ld.LOADER_ID)
+
+    ld.print_run_summary(counts)
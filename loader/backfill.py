@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Selective re-extraction over rows the loader has already written.
+
+The loader only parses an object when its etag changes, so when extraction
+improves, existing epubs and m4bs rows keep what the old code found. A
+backfill re-runs only the named extractors over those rows and writes
+back only the columns (and child rows or covers) they own:
+
+  epub-identifiers  asin, isbn, identifier
+  epub-metadata     title, publisher, published_date, language,
+                    description, subject, series, series_position
+  epub-authors      epub_authors rows and author_names
+  epub-cover        cover_path and the stored cover
+  m4b-tags          asin, title, artist, narrator, album, date,
+                    description, comment, genre, copyright
+  m4b-audio         duration_s, bitrate_kbps, sample_rate, channels
+  m4b-chapters      m4b_chapters rows
+  m4b-cover         has_cover and the stored cover
+  epub-hash         content_hash, content_size
+  m4b-hash          content_hash, content_size
+
+Objects are range-read, never downloaded: an EPUB costs its zip directory
+and OPF (plus the cover image for epub-cover), an M4B its moov atom (plus
+the chapter-track samples for m4b-chapters). The hash extractors are the
+exception: they stream the whole object through SHA-256, without keeping
+it, for rows loaded before the loader hashed downloads. WORKERS processes each read
+and parse one object at a time. Results are written one batch per
+transaction with one UPDATE per table.
+
+Progress is checkpointed in the backfills table in the same transaction
+as each batch. Stopping a backfill (Ctrl-C, SIGTERM, or `pause` from
+another shell) finishes the batch in hand, and running the same command
+again resumes after the last committed row. To stay out of the live
+loader's way, a backfill:
+
+  - skips rows whose load job is not done, since the loader will rewrite
+    them anyway with the current extractors;
+  - only updates a row if its manifest still says the etag that was read
+    is the one loaded, so it never overwrites a fresher load;
+  - waits between batches while the loader holds running leases, unless
+    --no-yield is given;
+  - can be held to --rate rows per second.
+
+Usage:
+
+  python backfill.py run EXTRACTOR... [--name NAME] [--workers N] [--batch N]
+                                      [--rate R] [--no-yield] [--restart]
+  python backfill.py pause NAME
+  python backfill.py status [NAME]
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import signal
+import time
+
+from psycopg2.extras import execute_values
+
+import loader as ld
+from catalog import epub_params, m4b_params
+from mp4atoms import read_moov
+from s3io import S3RangeFile
+
+Extractor = collections.namedtuple("Extractor", "kind columns children cover")
+
+EXTRACTORS = {
+    "epub-identifiers": Extractor("epub", ("asin", "isbn", "identifier"), False, False),
+    "epub-metadata":    Extractor("epub", (
+        "title", "publisher", "published_date", "language", "description", "subject",
+        "series", "series_position",
+    ), False, False),
+    "epub-authors":     Extractor("epub", ("author_names",), True, False),
+    "epub-cover":       Extractor("epub", ("cover_path",), False, True),
+    "m4b-tags":         Extractor("m4b", (
+        "asin", "title", "artist", "narrator", "album", "date", "description", "comment",
+        "genre", "copyright",
+    ), False, False),
+    "m4b-audio":        Extractor("m4b", ("duration_s", "bitrate_kbps", "sample_rate", "channels"), False, False),
+    "m4b-chapters":     Extractor("m4b", (), True, False),
+    "m4b-cover":        Extractor("m4b", ("has_cover",), False, True),
+    "epub-hash":        Extractor("epub", ("content_hash", "content_size"), False, False),
+    "m4b-hash":         Extractor("m4b", ("content_hash", "content_size"), False, False),
+}
+HASH_COLUMNS = {"content_hash", "content_size"}
+
+TABLES   = {"epub": "epubs", "m4b": "m4bs"}
+CHILDREN = {
+    "epub": ("epub_authors", "epub_id", ("author", "role", "position")),
+    "m4b":  ("m4b_chapters", "m4b_id", ("position", "title", "start_ms")),
+}
+# Casts for the VALUES list, whose NULLs Postgres cannot otherwise type.
+COLUMN_TYPES = {
+    "series_position": "numeric", "has_cover": "boolean", "duration_s": "int",
+    "bitrate_kbps": "int", "sample_rate": "int", "channels": "smallint",
+    "content_size": "bigint",
+}
+
+BACKFILL_LOCK = 0x76626266  # "vbbf"; second key is hashtext(name)
+YIELD_SECONDS = 10
+
+# Rows the loader has finished with at their current etag.
+NEXT_ROWS = """
+    SELECT t.id, t.s3_key, o.size, o.etag
+    FROM {table} t
+    JOIN s3_objects o ON o.s3_key = t.s3_key
+    WHERE t.id > %s AND t.gone_at IS NULL
+      AND o.state = 'done' AND o.loaded_etag = o.etag
+    ORDER BY t.id
+    LIMIT %s
+"""
+
+REMAINING = """
+    SELECT count(*) FROM {table} t
+    JOIN s3_objects o ON o.s3_key = t.s3_key
+    WHERE t.id > %s AND t.gone_at IS NULL
+      AND o.state = 'done' AND o.loaded_etag = o.etag
+"""
+
+# A row is only updated if the version that was read is still the one
+# loaded; otherwise the loader has replaced it meanwhile.
+UPDATE = """
+    UPDATE {table} t SET {assignments}updated_at = now()
+    FROM (VALUES %s) AS v(id, etag{columns})
+    WHERE t.id = v.id
+      AND EXISTS (
+          SELECT 1 FROM s3_objects o
+          WHERE o.s3_key = t.s3_key AND o.state = 'done' AND o.loaded_etag = v.etag
+      )
+    RETURNING t.id
+"""
+
+LOADER_BUSY = """
+    SELECT count(*) FROM s3_objects WHERE state = 'running' AND lease_until > now()
+"""
+
+START = """
+    INSERT INTO backfills (name, extractors) VALUES (%s, %s)
+    ON CONFLICT (name) DO NOTHING
+"""
+
+CHECKPOINTED = """
+    SELECT extractors, state, last_epub_id, last_m4b_id FROM backfills WHERE name = %s
+"""
+
+RESTART = """
+    UPDATE backfills SET
+        extractors = %s, state = 'running', last_epub_id = 0, last_m4b_id = 0,
+        updated_rows = 0, skipped_rows = 0, failed_rows = 0, bytes_fetched = 0,
+        started_at = now(), updated_at = now(), finished_at = NULL
+    WHERE name = %s
+"""
+
+CHECKPOINT = """
+    UPDATE backfills SET
+        last_{kind}_id = %s,
+        updated_rows   = updated_rows + %s,
+        skipped_rows   = skipped_rows + %s,
+        failed_rows    = failed_rows + %s,
+        bytes_fetched  = bytes_fetched + %s,
+        updated_at     = now()
+    WHERE name = %s
+    RETURNING state
+"""
+
+STATUS = """
+    SELECT name, array_to_string(extractors, ' '), state, last_epub_id, last_m4b_id,
+           updated_rows, skipped_rows, failed_rows, bytes_fetched, started_at, updated_at
+    FROM backfills {where} ORDER BY started_at
+"""
+
+# ── Extraction (worker processes) ─────────────────────────────────────────────
+
+def _ignore_sigint():
+    # Ctrl-C reaches the whole process group; let the parent stop cleanly.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def hash_object(key):
+    """(sha256 hex, size) of an object, streamed without keeping it."""
+    body = ld.shared_s3().get_object(Bucket=ld.S3_BUCKET, Key=key)["Body"]
+    sha256, size = hashlib.sha256(), 0
+    for chunk in body.iter_chunks(ld.HASH_CHUNK_SIZE):
+        sha256.update(chunk)
+        size += len(chunk)
+    return sha256.hexdigest(), size
+
+def extract(kind, key, size, names):
+    """Range-read one object and run the extractors in `names` over it.
+    Returns (values, children, cover, bytes_fetched) where values maps each
+    owned column to its new value, children is the child rows (or None if no
+    extractor owns them) and cover is (bytes, ext) or None. Raises on any
+    read or parse error, so a failure never blanks a row."""
+    wanted = [EXTRACTORS[name] for name in names]
+    children = any(e.children for e in wanted)
+    cover    = any(e.cover for e in wanted)
+    parse    = children or cover or any(set(e.columns) - HASH_COLUMNS for e in wanted)
+    meta, rows, cover_bytes, cover_ext, fetched = {}, None, None, None, 0
+    if parse:
+        with S3RangeFile(ld.shared_s3(), ld.S3_BUCKET, key, size, block_size=ld.RANGE_BLOCK_SIZE) as f:
+            if kind == "epub":
+                meta, rows, cover_bytes, cover_ext = ld.parse_epub(f, with_cover=cover, strict=True)
+            else:
+                header = read_moov(f)
+                meta, cover_bytes, cover_ext, rows = ld.parse_m4b(
+                    io.BytesIO(header), f, with_chapters=children, strict=True,
+                )
+        fetched = f.bytes_fetched
+    if any(HASH_COLUMNS & set(e.columns) for e in wanted):
+        meta["content_hash"], meta["content_size"] = hash_object(key)
+        fetched += meta["content_size"]
+    params = epub_params(key, meta, rows or ()) if kind == "epub" else m4b_params(key, meta)
+    values = {column: params[column] for e in wanted for column in e.columns}
+    return (
+        values,
+        rows if children else None,
+        (cover_bytes, cover_ext) if cover and cover_bytes else None,
+        fetched,
+    )
+
+# ── Writes ────────────────────────────────────────────────────────────────────
+
+def write_batch(conn, kind, columns, results):
+    """Apply one batch of results without committing. `results` is
+    [(record_id, etag, values, children)]. Returns the ids updated; the
+    others were reloaded by the loader since they were read."""
+    table = TABLES[kind]
+    sql = UPDATE.format(
+        table=table,
+        assignments="".join(f"{c} = v.{c}, " for c in columns),
+        columns="".join(f", {c}" for c in columns),
+    )
+    template = "(%s, %s" + "".join(f", %s::{COLUMN_TYPES.get(c, 'text')}" for c in columns) + ")"
+    with conn.cursor() as cur:
+        rows = execute_values(
+            cur, sql,
+            [(rid, etag, *(values[c] for c in columns)) for rid, etag, values, _ in results],
+            template=template, page_size=len(results), fetch=True,
+        )
+        updated = {rid for rid, in rows}
+        child_table, parent, child_columns = CHILDREN[kind]
+        replaced = [(rid, children) for rid, _, _, children in results
+                    if rid in updated and children is not None]
+        if replaced:
+            cur.execute(
+                f"DELETE FROM {child_table} WHERE {parent} = ANY(%s)", ([rid for rid, _ in replaced],),
+            )
+            execute_values(
+                cur,
+                f"INSERT INTO {child_table} ({parent}, {', '.join(child_columns)}) VALUES %s",
+                [(rid, *child) for rid, children in replaced for child in children],
+                page_size=1000,
+            )
+    return updated
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+class Backfill:
+    """One named backfill run by this process."""
+
+    def __init__(self, name, names, workers, batch, rate, yield_to_loader):
+        self.name     = name
+        self.names    = names
+        self.workers  = workers
+        self.batch    = batch
+        self.rate     = rate
+        self.yielding = yield_to_loader
+        self.stopping = False
+
+    def stop(self, *_):
+        if not self.stopping:
+            print(f"[backfill {self.name}] stopping after the current batch...", flush=True)
+        self.stopping = True
+
+    def wait_for_loader(self, conn):
+        """Sleep while the loader is working through jobs. Returns False if
+        asked to stop meanwhile."""
+        announced = False
+        while not self.stopping:
+            with conn.cursor() as cur:
+                cur.execute(LOADER_BUSY)
+                running = cur.fetchone()[0]
+            conn.commit()
+            if not running:
+                return True
+            if not announced:
+                print(f"[backfill {self.name}] loader has {running} jobs running; waiting...", flush=True)
+                announced = True
+            time.sleep(YIELD_SECONDS)
+        return False
+
+    def run_kind(self, conn, pool, kind, last_id):
+        """Work through one table from last_id. Returns False if stopped."""
+        table = TABLES[kind]
+        names = [n for n in self.names if EXTRACTORS[n].kind == kind]
+        columns = list(dict.fromkeys(c for n in names for c in EXTRACTORS[n].columns))
+        with conn.cursor() as cur:
+            cur.execute(REMAINING.format(table=table), (last_id,))
+            remaining = cur.fetchone()[0]
+        conn.commit()
+        print(f"[backfill {self.name}] {table}: {remaining} rows to go ({', '.join(names)})", flush=True)
+
+        done, start = 0, time.monotonic()
+        while not self.stopping:
+            if self.yielding and not self.wait_for_loader(conn):
+                break
+            batch_start = time.monotonic()
+            with conn.cursor() as cur:
+                cur.execute(NEXT_ROWS.format(table=table), (last_id, self.batch))
+                rows = cur.fetchall()
+            if not rows:
+                conn.commit()
+                return True
+
+            futures = [pool.submit(extract, kind, key, size, names) for _, key, size, _ in rows]
+            results, covers, failed, fetched = [], {}, 0, 0
+            for (rid, key, _, etag), future in zip(rows, futures):
+                try:
+                    values, children, cover, nbytes = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"  [{kind}] {key}: {e}", flush=True)
+                    continue
+                results.append((rid, etag, values, children))
+                fetched += nbytes
+                if cover is not None:
+                    covers[rid] = cover
+
+            updated = write_batch(conn, kind, columns, results) if results else set()
+            # Covers go in before the checkpoint commits, so a crash at worst
+            # stores a few of them twice.
+            for rid in updated & covers.keys():
+                ld.save_cover(covers[rid][0], kind, rid, covers[rid][1])
+            last_id = rows[-1][0]
+            with conn.cursor() as cur:
+                cur.execute(
+                    CHECKPOINT.format(kind=kind),
+                    (last_id, len(updated), len(results) - len(updated), failed, fetched, self.name),
+                )
+                state = cur.fetchone()[0]
+            conn.commit()
+
+            done += len(rows)
+            elapsed = time.monotonic() - start
+            print(
+                f"[backfill {self.name}] {table}: {done}/{remaining} rows, {len(updated)} updated, "
+                f"{len(results) - len(updated)} reloaded meanwhile, {failed} failed, "
+                f"{fetched / 1e6:.1f} MB read ({done / elapsed:.1f} rows/s, last id {last_id})",
+                flush=True,
+            )
+            if state == "paused":
+                print(f"[backfill {self.name}] paused.", flush=True)
+                self.stopping = True
+            elif self.rate:
+                time.sleep(max(0.0, len(rows) / self.rate - (time.monotonic() - batch_start)))
+        return False
+
+    def run(self, restart=False):
+        conn = ld.connect_db()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (BACKFILL_LOCK, self.name))
+            if not cur.fetchone()[0]:
+                raise SystemExit(f"Backfill {self.name} is already running elsewhere.")
+            if restart:
+                cur.execute(RESTART, (self.names, self.name))
+            cur.execute(START, (self.name, self.names))
+            cur.execute(CHECKPOINTED, (self.name,))
+            extractors, state, last_epub_id, last_m4b_id = cur.fetchone()
+            if sorted(extractors) != self.names:
+                raise SystemExit(
+                    f"Backfill {self.name} runs {' '.join(extractors)}; use another --name, "
+                    f"or --restart to start it over with these extractors."
+                )
+            if state == "done":
+                raise SystemExit(f"Backfill {self.name} already finished; --restart to run it again.")
+            cur.execute("UPDATE backfills SET state = 'running' WHERE name = %s", (self.name,))
+        conn.commit()
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        print(
+            f"[backfill {self.name}] {' '.join(self.names)}: {self.workers} workers, "
+            f"batches of {self.batch}" + (f", at most {self.rate} rows/s" if self.rate else "") + ".",
+            flush=True,
+        )
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_ignore_sigint,
+        )
+        try:
+            for kind, last_id in (("epub", last_epub_id), ("m4b", last_m4b_id)):
+                if not any(EXTRACTORS[n].kind == kind for n in self.names):
+                    continue
+                if not self.run_kind(conn, pool, kind, last_id):
+                    break
+            else:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE backfills SET state = 'done', finished_at = now() WHERE name = %s",
+                        (self.name,),
+                    )
+                conn.commit()
+                print(f"[backfill {self.name}] done.", flush=True)
+                return
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE backfills SET state = 'paused' WHERE name = %s AND state = 'running'",
+                    (self.name,),
+                )
+            conn.commit()
+            print(f"[backfill {self.name}] checkpointed; run the same command to resume.", flush=True)
+        finally:
+            pool.shutdown(cancel_futures=True)
+            conn.close()
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def pause(name):
+    conn = ld.connect_db()
+    with conn.cursor() as cur:
+        cur.execute("UPDATE backfills SET state = 'paused' WHERE name = %s AND state = 'running'", (name,))
+        paused = cur.rowcount
+    conn.commit()
+    conn.close()
+    print(f"Backfill {name} will stop after its current batch." if paused else f"Backfill {name} is not running.")
+
+def status(name=None):
+    conn = ld.connect_db()
+    with conn.cursor() as cur:
+        cur.execute(STATUS.format(where="WHERE name = %s" if name else ""), (name,) if name else ())
+        rows = cur.fetchall()
+    conn.close()
+    if not rows:
+        print("No backfills." if not name else f"No backfill {name}.")
+    for (name, extractors, state, last_epub_id, last_m4b_id,
+         updated, skipped, failed, fetched, started_at, updated_at) in rows:
+        print(
+            f"{name}: {state}, {extractors}\n"
+            f"  checkpoint: epubs id {last_epub_id}, m4bs id {last_m4b_id}\n"
+            f"  {updated} updated, {skipped} reloaded meanwhile, {failed} failed, "
+            f"{fetched / 1e6:.1f} MB read\n"
+            f"  started {started_at:%Y-%m-%d %H:%M:%S}, last batch {updated_at:%Y-%m-%d %H:%M:%S}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run extractors over loaded epubs/m4bs rows.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="Start or resume a backfill")
+    run_cmd.add_argument("extractors", nargs="+", choices=sorted(EXTRACTORS), metavar="EXTRACTOR",
+                         help=f"One or more of: {', '.join(EXTRACTORS)}")
+    run_cmd.add_argument("--name", help="Checkpoint name (default: the extractors joined by '+')")
+    run_cmd.add_argument("--workers", type=int, default=4, help="Extraction processes (default: 4)")
+    run_cmd.add_argument("--batch", type=int, default=100, help="Rows per transaction (default: 100)")
+    run_cmd.add_argument("--rate", type=float, default=0, help="At most this many rows per second")
+    run_cmd.add_argument("--no-yield", action="store_true",
+                         help="Keep going while the loader has jobs running")
+    run_cmd.add_argument("--restart", action="store_true", help="Discard the checkpoint and start over")
+    pause_cmd = sub.add_parser("pause", help="Stop a running backfill after its current batch")
+    pause_cmd.add_argument("name")
+    status_cmd = sub.add_parser("status", help="Show backfill progress")
+    status_cmd.add_argument("name", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "pause":
+        pause(args.name)
+    elif args.command == "status":
+        status(args.name)
+    else:
+        names = sorted(set(args.extractors))
+        Backfill(
+            args.name or "+".join(names), names, args.workers, args.batch, args.rate,
+            not args.no_yield,
+        ).run(restart=args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+"""
+Catalog writes for the loader: the s3_objects manifest diff, bucket
+notifications applied to the manifest, and the epubs/m4bs upserts.
+
+Records are written in batches: write_records upserts any mix of EPUB and
+M4B results with one multi-row statement per table, replaces their child
+rows (epub_authors, m4b_chapters) with bulk inserts, and marks them loaded
+in the manifest, all without committing. BatchWriter buffers records from
+the loader's consumer loop and flushes them with one commit every N records
+or T milliseconds. insert_epub/insert_m4b are the single-record wrappers.
+The SQL lives in module constants so async_engine.py's asyncpg versions of
+these functions run the same statements.
+
+A record is a tuple (kind, s3_key, etag, meta, children) where children is
+the authors list for an EPUB and the chapters list for an M4B.
+
+find_duplicate looks up a record holding the same bytes (by content_hash and
+content_size) under another key, for the loader's SKIP_DUPLICATES.
+"""
+
+import io
+import time
+from pathlib import Path
+
+from psycopg2.extras import execute_values
+
+# ── Manifest ──────────────────────────────────────────────────────────────────
+
+def _copy_text(value):
+    """Escape one value for COPY ... FROM STDIN text format."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+LISTING_TABLE = """
+    CREATE TEMP TABLE listing (
+        s3_key        TEXT PRIMARY KEY,
+        kind          TEXT,
+        etag          TEXT,
+        size          BIGINT,
+        last_modified TIMESTAMPTZ
+    ) ON COMMIT DROP
+"""
+
+# Keys loaded before the manifest existed count as loaded at their current
+# etag rather than being downloaded again. A new etag or size starts a fresh
+# load job (see jobs.py), lifting any backoff or quarantine; a job already
+# running keeps its lease and is superseded when its stale result is written.
+# A done job whose catalog row has been deleted (say, the catalog tables were
+# truncated to rebuild them) is pending again.
+MANIFEST_UPSERT = """
+    INSERT INTO s3_objects (s3_key, kind, etag, size, last_modified, loaded_etag, state)
+    SELECT l.s3_key, l.kind, l.etag, l.size, l.last_modified, loaded.etag,
+           CASE WHEN loaded.etag IS NULL THEN 'pending' ELSE 'done' END
+    FROM listing l
+    LEFT JOIN LATERAL (
+        SELECT l.etag
+        WHERE EXISTS (SELECT 1 FROM epubs e WHERE e.s3_key = l.s3_key)
+           OR EXISTS (SELECT 1 FROM m4bs m WHERE m.s3_key = l.s3_key)
+    ) loaded ON true
+    ON CONFLICT (s3_key) DO UPDATE SET
+        kind            = EXCLUDED.kind,
+        etag            = EXCLUDED.etag,
+        size            = EXCLUDED.size,
+        last_modified   = EXCLUDED.last_modified,
+        loaded_etag     = CASE WHEN s3_objects.etag = EXCLUDED.etag AND s3_objects.size = EXCLUDED.size
+                                    AND EXCLUDED.loaded_etag IS NOT NULL
+                               THEN s3_objects.loaded_etag END,
+        state           = CASE WHEN s3_objects.state = 'done' AND EXCLUDED.loaded_etag IS NULL
+                               THEN 'pending'
+                               WHEN s3_objects.etag = EXCLUDED.etag AND s3_objects.size = EXCLUDED.size
+                               THEN s3_objects.state
+                               WHEN s3_objects.state = 'running' THEN 'running'
+                               ELSE 'pending' END,
+        attempts        = CASE WHEN s3_objects.etag = EXCLUDED.etag AND s3_objects.size = EXCLUDED.size
+                               THEN s3_objects.attempts ELSE 0 END,
+        last_error      = CASE WHEN s3_objects.etag = EXCLUDED.etag AND s3_objects.size = EXCLUDED.size
+                               THEN s3_objects.last_error END,
+        next_attempt_at = CASE WHEN s3_objects.etag = EXCLUDED.etag AND s3_objects.size = EXCLUDED.size
+                               THEN s3_objects.next_attempt_at END,
+        gone_at         = NULL
+"""
+
+MANIFEST_MARK_GONE = """
+    UPDATE s3_objects o SET gone_at = now()
+    WHERE o.gone_at IS NULL
+      AND NOT EXISTS (SELECT 1 FROM listing l WHERE l.s3_key = o.s3_key)
+"""
+
+CATALOG_MARK_GONE = """
+    UPDATE {table} t SET gone_at = now()
+    WHERE t.gone_at IS NULL
+      AND NOT EXISTS (SELECT 1 FROM listing l WHERE l.s3_key = t.s3_key)
+"""
+
+CATALOG_UNMARK_GONE = """
+    UPDATE {table} t SET gone_at = NULL
+    FROM listing l
+    WHERE l.s3_key = t.s3_key AND t.gone_at IS NOT NULL
+"""
+
+MANIFEST_TO_LOAD = """
+    SELECT o.s3_key, o.size, o.etag,
+           EXISTS (SELECT 1 FROM epubs e WHERE e.s3_key = o.s3_key)
+           OR EXISTS (SELECT 1 FROM m4bs m WHERE m.s3_key = o.s3_key)
+    FROM s3_objects o
+    JOIN listing l ON l.s3_key = o.s3_key
+    WHERE o.state <> 'done'
+    ORDER BY o.s3_key
+"""
+
+# Event-driven counterparts of the reconcile statements (see notify.py): the
+# listing table then holds only the keys named in notifications.
+EVENTS_PENDING = """
+    SELECT o.s3_key FROM s3_objects o
+    JOIN listing l ON l.s3_key = o.s3_key
+    WHERE o.state = 'pending'
+    ORDER BY o.s3_key
+"""
+
+MANIFEST_REMOVE = """
+    UPDATE s3_objects SET gone_at = now()
+    WHERE gone_at IS NULL AND s3_key = ANY(%s)
+"""
+
+CATALOG_REMOVE = """
+    UPDATE {table} SET gone_at = now()
+    WHERE gone_at IS NULL AND s3_key = ANY(%s)
+"""
+
+LIVE_COUNTS = """
+    SELECT (SELECT count(*) FROM epubs WHERE gone_at IS NULL),
+           (SELECT count(*) FROM m4bs  WHERE gone_at IS NULL)
+"""
+
+def _copy_listing(cur, rows):
+    """Create the listing temp table and COPY `rows` into it."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_text(v) for v in row) + "\n")
+    buf.seek(0)
+    cur.execute(LISTING_TABLE)
+    cur.copy_expert("COPY listing FROM STDIN", buf)
+
+def sync_manifest(conn, listing):
+    """Diff a bucket listing against the s3_objects manifest.
+
+    `listing` is [(s3_key, kind, etag, size, last_modified)]. The listing is
+    COPYed into a temp table and reconciled with a fixed number of statements:
+    manifest rows are upserted (an etag or size change clears loaded_etag,
+    and so does a missing catalog row, which also reopens a done job), rows
+    for vanished keys are marked gone in the manifest and in epubs/m4bs, and
+    reappearing keys are un-marked. Returns (to_load, gone) where to_load
+    is [(s3_key, size, etag, known)] for objects that are new or changed
+    (`known` = a catalog row already exists) and gone is the number of
+    objects newly marked gone.
+    """
+    with conn.cursor() as cur:
+        _copy_listing(cur, listing)
+        cur.execute("ANALYZE listing")
+        cur.execute(MANIFEST_UPSERT)
+        cur.execute(MANIFEST_MARK_GONE)
+        gone = cur.rowcount
+        for table in ("epubs", "m4bs"):
+            cur.execute(CATALOG_MARK_GONE.format(table=table))
+            cur.execute(CATALOG_UNMARK_GONE.format(table=table))
+        cur.execute(MANIFEST_TO_LOAD)
+        to_load = cur.fetchall()
+    conn.commit()
+    return to_load, gone
+
+def apply_events(conn, created, removed):
+    """Apply bucket notifications to the manifest and commit.
+
+    `created` is listing rows for objects that were written and `removed` the
+    keys that were deleted. Created rows go through the same upsert as a
+    full listing; removed keys are marked gone in the manifest and in
+    epubs/m4bs. Nothing else is marked gone, since a notification does not
+    describe the whole bucket. Returns the created keys whose job is now
+    pending.
+    """
+    pending = []
+    with conn.cursor() as cur:
+        if created:
+            _copy_listing(cur, created)
+            cur.execute(MANIFEST_UPSERT)
+            for table in ("epubs", "m4bs"):
+                cur.execute(CATALOG_UNMARK_GONE.format(table=table))
+            cur.execute(EVENTS_PENDING)
+            pending = [row[0] for row in cur.fetchall()]
+        if removed:
+            cur.execute(MANIFEST_REMOVE, (list(removed),))
+            for table in ("epubs", "m4bs"):
+                cur.execute(CATALOG_REMOVE.format(table=table), (list(removed),))
+    conn.commit()
+    return pending
+
+# ── Upserts ───────────────────────────────────────────────────────────────────
+
+# The params dicts list columns in the same order as the upserts' INSERT
+# lists, so tuple(params.values()) is a positional row (see async_engine.py).
+
+def epub_params(s3_key, meta, authors=()):
+    return {
+        "s3_key":          s3_key,
+        "asin":            meta.get("asin"),
+        "isbn":            meta.get("isbn"),
+        "title":           meta.get("title") or Path(s3_key).stem,
+        "publisher":       meta.get("publisher"),
+        "published_date":  meta.get("published_date"),
+        "language":        meta.get("language"),
+        "description":     meta.get("description"),
+        "series":          meta.get("series"),
+        "series_position": meta.get("series_position"),
+        "identifier":      meta.get("identifier"),
+        "subject":         meta.get("subject"),
+        "cover_path":      meta.get("cover_path"),
+        "content_hash":    meta.get("content_hash"),
+        "content_size":    meta.get("content_size"),
+        "author_names":    "; ".join(name for name, _, _ in authors) or None,
+    }
+
+def m4b_params(s3_key, meta):
+    return {
+        "s3_key":       s3_key,
+        "asin":         meta.get("asin"),
+        "title":        meta.get("title") or Path(s3_key).stem,
+        "artist":       meta.get("artist"),
+        "narrator":     meta.get("narrator"),
+        "album":        meta.get("album"),
+        "date":         meta.get("date"),
+        "description":  meta.get("description"),
+        "comment":      meta.get("comment"),
+        "genre":        meta.get("genre"),
+        "copyright":    meta.get("copyright"),
+        "has_cover":    meta.get("has_cover", False),
+        "duration_s":   meta.get("duration_s"),
+        "bitrate_kbps": meta.get("bitrate_kbps"),
+        "sample_rate":  meta.get("sample_rate"),
+        "channels":     meta.get("channels"),
+        "content_hash": meta.get("content_hash"),
+        "content_size": meta.get("content_size"),
+    }
+
+def _no_nul(value):
+    # Postgres text cannot hold NUL, and metadata read from files sometimes
+    # does; psycopg2 refuses the whole statement over one.
+    return value.replace("\x00", "") if isinstance(value, str) else value
+
+def record_params(record):
+    """The upsert params of a record, for its kind."""
+    kind, s3_key, _, meta, children = record
+    params = epub_params(s3_key, meta, children) if kind == "epub" else m4b_params(s3_key, meta)
+    return {column: _no_nul(value) for column, value in params.items()}
+
+def child_params(record):
+    """The child rows of a record (authors or chapters), in their table's
+    column order after the record id."""
+    kind, _, _, _, children = record
+    if kind == "epub":
+        return [(_no_nul(name), _no_nul(role), position) for name, role, position in children]
+    return [(position, _no_nul(title), start_ms) for position, title, start_ms in children]
+
+EPUB_UPSERT = """
+    INSERT INTO epubs (
+        s3_key, asin, isbn, title, publisher, published_date,
+        language, description, series, series_position,
+        identifier, subject, cover_path, content_hash, content_size,
+        author_names
+    ) VALUES %s
+    ON CONFLICT (s3_key) DO UPDATE SET
+        asin            = EXCLUDED.asin,
+        isbn            = EXCLUDED.isbn,
+        title           = EXCLUDED.title,
+        publisher       = EXCLUDED.publisher,
+        published_date  = EXCLUDED.published_date,
+        language        = EXCLUDED.language,
+        description     = EXCLUDED.description,
+        series          = EXCLUDED.series,
+        series_position = EXCLUDED.series_position,
+        identifier      = EXCLUDED.identifier,
+        subject         = EXCLUDED.subject,
+        cover_path      = EXCLUDED.cover_path,
+        content_hash    = EXCLUDED.content_hash,
+        content_size    = EXCLUDED.content_size,
+        author_names    = EXCLUDED.author_names,
+        updated_at      = now(),
+        gone_at         = NULL
+    RETURNING s3_key, id
+"""
+
+EPUB_TEMPLATE = """(
+    %(s3_key)s, %(asin)s, %(isbn)s, %(title)s, %(publisher)s,
+    %(published_date)s, %(language)s, %(description)s,
+    %(series)s, %(series_position)s, %(identifier)s,
+    %(subject)s, %(cover_path)s, %(content_hash)s, %(content_size)s,
+    %(author_names)s
+)"""
+
+M4B_UPSERT = """
+    INSERT INTO m4bs (
+        s3_key, asin, title, artist, narrator, album, date,
+        description, comment, genre, copyright, has_cover,
+        duration_s, bitrate_kbps, sample_rate, channels,
+        content_hash, content_size
+    ) VALUES %s
+    ON CONFLICT (s3_key) DO UPDATE SET
+        asin         = EXCLUDED.asin,
+        title        = EXCLUDED.title,
+        artist       = EXCLUDED.artist,
+        narrator     = EXCLUDED.narrator,
+        album        = EXCLUDED.album,
+        date         = EXCLUDED.date,
+        description  = EXCLUDED.description,
+        comment      = EXCLUDED.comment,
+        genre        = EXCLUDED.genre,
+        copyright    = EXCLUDED.copyright,
+        has_cover    = EXCLUDED.has_cover,
+        duration_s   = EXCLUDED.duration_s,
+        bitrate_kbps = EXCLUDED.bitrate_kbps,
+        sample_rate  = EXCLUDED.sample_rate,
+        channels     = EXCLUDED.channels,
+        content_hash = EXCLUDED.content_hash,
+        content_size = EXCLUDED.content_size,
+        updated_at   = now(),
+        gone_at      = NULL
+    RETURNING s3_key, id
+"""
+
+M4B_TEMPLATE = """(
+    %(s3_key)s, %(asin)s, %(title)s, %(artist)s, %(narrator)s,
+    %(album)s, %(date)s, %(description)s, %(comment)s,
+    %(genre)s, %(copyright)s, %(has_cover)s,
+    %(duration_s)s, %(bitrate_kbps)s, %(sample_rate)s, %(channels)s,
+    %(content_hash)s, %(content_size)s
+)"""
+
+# Finishes the load jobs of written records. A record parsed from an etag the
+# manifest has since moved past leaves its job pending.
+MARK_LOADED = """
+    UPDATE s3_objects o SET
+        loaded_etag     = v.etag,
+        state           = CASE WHEN o.etag = v.etag THEN 'done' ELSE 'pending' END,
+        last_error      = NULL,
+        next_attempt_at = NULL,
+        claimed_by      = NULL,
+        lease_until     = NULL
+    FROM (VALUES %s) AS v(s3_key, etag)
+    WHERE o.s3_key = v.s3_key
+"""
+
+def write_records(conn, records):
+    """Upsert records and their child rows without committing. Records with
+    an etag finish their load job in the manifest (see jobs.py).
+
+    Returns {s3_key: record_id}. Later records win when a key repeats.
+    """
+    epubs = {r[1]: r for r in records if r[0] == "epub"}
+    m4bs  = {r[1]: r for r in records if r[0] == "m4b"}
+    ids = {}
+    with conn.cursor() as cur:
+        if epubs:
+            rows = execute_values(
+                cur, EPUB_UPSERT,
+                [record_params(record) for record in epubs.values()],
+                template=EPUB_TEMPLATE, page_size=len(epubs), fetch=True,
+            )
+            epub_ids = dict(rows)
+            ids.update(epub_ids)
+            cur.execute(
+                "DELETE FROM epub_authors WHERE epub_id = ANY(%s)", (list(epub_ids.values()),),
+            )
+            execute_values(
+                cur,
+                "INSERT INTO epub_authors (epub_id, author, role, position) VALUES %s",
+                [
+                    (epub_ids[key], *child)
+                    for key, record in epubs.items()
+                    for child in child_params(record)
+                ],
+                page_size=1000,
+            )
+        if m4bs:
+            rows = execute_values(
+                cur, M4B_UPSERT,
+                [record_params(record) for record in m4bs.values()],
+                template=M4B_TEMPLATE, page_size=len(m4bs), fetch=True,
+            )
+            m4b_ids = dict(rows)
+            ids.update(m4b_ids)
+            cur.execute(
+                "DELETE FROM m4b_chapters WHERE m4b_id = ANY(%s)", (list(m4b_ids.values()),),
+            )
+            execute_values(
+                cur,
+                "INSERT INTO m4b_chapters (m4b_id, position, title, start_ms) VALUES %s",
+                [
+                    (m4b_ids[key], *child)
+                    for key, record in m4bs.items()
+                    for child in child_params(record)
+                ],
+                page_size=1000,
+            )
+        loaded = [(r[1], r[2]) for r in (*epubs.values(), *m4bs.values()) if r[2] is not None]
+        if loaded:
+            execute_values(cur, MARK_LOADED, loaded, page_size=1000)
+    return ids
+
+# ── Duplicates ────────────────────────────────────────────────────────────────
+
+# A live record holding the same bytes under another key (see the loader's
+# SKIP_DUPLICATES), and its child rows in record order.
+DUPLICATE_OF = """
+    SELECT id, s3_key, {columns} FROM {table}
+    WHERE content_hash = %s AND content_size = %s AND s3_key <> %s AND gone_at IS NULL
+    ORDER BY id
+    LIMIT 1
+"""
+
+DUPLICATE_CHILDREN = {
+    "epub": "SELECT author, role, position FROM epub_authors WHERE epub_id = %s ORDER BY position, id",
+    "m4b":  "SELECT position, title, start_ms FROM m4b_chapters WHERE m4b_id = %s ORDER BY position, id",
+}
+
+def duplicate_query(kind):
+    """(DUPLICATE_OF for `kind`, the meta keys its columns after id and
+    s3_key hold)."""
+    params = epub_params if kind == "epub" else m4b_params
+    columns = [c for c in params("", {}) if c not in ("s3_key", "author_names")]
+    table = "epubs" if kind == "epub" else "m4bs"
+    return DUPLICATE_OF.format(columns=", ".join(columns), table=table), columns
+
+def duplicate_meta(columns, row):
+    """(record_id, s3_key, meta) from a DUPLICATE_OF row, with meta as the
+    parser would have returned it for the original."""
+    record_id, s3_key, *values = row
+    meta = dict(zip(columns, values))
+    if meta.get("series_position") is not None:
+        meta["series_position"] = float(meta["series_position"])
+    # The title epub_params/m4b_params fell back to, not one the file holds.
+    if meta.get("title") == Path(s3_key).stem:
+        meta["title"] = None
+    return record_id, s3_key, meta
+
+def find_duplicate(conn, kind, s3_key, digest):
+    """The live record with the same (content_hash, content_size) as
+    `digest` under a key other than s3_key, as (record_id, s3_key, meta,
+    children), or None."""
+    sql, columns = duplicate_query(kind)
+    with conn.cursor() as cur:
+        cur.execute(sql, (*digest, s3_key))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        record_id, original, meta = duplicate_meta(columns, row)
+        cur.execute(DUPLICATE_CHILDREN[kind], (record_id,))
+        children = [tuple(child) for child in cur.fetchall()]
+    return record_id, original, meta, children
+
+def insert_epub(conn, s3_key, meta, authors, etag=None):
+    epub_id = write_records(conn, [("epub", s3_key, etag, meta, authors)])[s3_key]
+    conn.commit()
+    return epub_id
+
+def insert_m4b(conn, s3_key, meta, chapters, etag=None):
+    m4b_id = write_records(conn, [("m4b", s3_key, etag, meta, chapters)])[s3_key]
+    conn.commit()
+    return m4b_id
+
+# ── Batching ──────────────────────────────────────────────────────────────────
+
+class BatchWriter:
+    """Buffers records and writes each batch in a single transaction.
+
+    add() queues a record together with an opaque `extra` value (the loader
+    passes cover bytes) that is handed back after the flush. A flush happens
+    when max_records are pending or the oldest pending record is older than
+    max_delay_ms; callers check due() and call flush(). If a batch fails, it
+    is rolled back and retried one record at a time so a single bad record
+    does not sink the rest; whatever a record fails with is returned with
+    it, for the caller to record on its job.
+    """
+
+    def __init__(self, conn, max_records=100, max_delay_ms=1000):
+        self.conn         = conn
+        self.max_records  = max_records
+        self.max_delay_ms = max_delay_ms
+        self._pending     = {}          # s3_key -> (record, extra)
+        self._oldest      = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, record, extra=None):
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending[record[1]] = (record, extra)
+
+    def time_left(self):
+        """Seconds until the pending batch is due by age, or None if empty."""
+        if not self._pending:
+            return None
+        return max(0.0, self._oldest + self.max_delay_ms / 1000 - time.monotonic())
+
+    def due(self):
+        return len(self._pending) >= self.max_records or self.time_left() == 0.0
+
+    def take(self):
+        """Remove and return the pending [(record, extra)]."""
+        pending = list(self._pending.values())
+        self._pending, self._oldest = {}, None
+        return pending
+
+    def flush(self):
+        """Write all pending records. Returns (written, failed) where written
+        is [(record, record_id, extra)] and failed is [(record, error)]."""
+        pending = self.take()
+        if not pending:
+            return [], []
+        try:
+            ids = write_records(self.conn, [record for record, _ in pending])
+            self.conn.commit()
+            return [(record, ids[record[1]], extra) for record, extra in pending], []
+        except Exception:
+            self.conn.rollback()
+
+        written, failed = [], []
+        for record, extra in pending:
+            try:
+                ids = write_records(self.conn, [record])
+                self.conn.commit()
+                written.append((record, ids[record[1]], extra))
+            except Exception as e:
+                self.conn.rollback()
+                failed.append((record, e))
+        return written, failed
@@ -0,0 +1,229 @@
+"""
+Chapter extraction for M4B audiobooks.
+
+read_chapters works on an in-memory moov atom (as returned by
+mp4atoms.read_moov) and understands both chapter formats found in the wild:
+
+  - QuickTime chapter tracks: a `text` track referenced from the audio
+    track's `tref/chap`, one sample per chapter holding its title. Titles
+    live in mdat, so a file object is needed to read those few samples;
+    nearby samples are read together, distant ones one by one.
+  - Nero `chpl` atoms under `moov/udta`: start times and titles inline.
+
+When both are present the QuickTime track wins, matching ffmpeg. Results use
+the loader's chapter tuple shape: (position, title, start_ms), 1-based.
+ffprobe_chapters is the subprocess fallback the loader used originally.
+"""
+
+import bisect
+import json
+import os
+import struct
+import subprocess
+
+from mp4atoms import AtomError, find_box, find_boxes, iter_boxes
+
+# Chapter samples at most this far apart are fetched in one read.
+SAMPLE_GAP = 64 * 1024
+
+
+def read_chapters(header, f=None):
+    """Return [(position, title, start_ms)] from ftyp + moov bytes.
+
+    `f` is a seekable file object over the original MP4, used to read
+    QuickTime chapter titles from mdat. Returns None if the file has a
+    chapter track but no `f` was given and there is no chpl to fall back
+    on; returns [] if the file simply has no chapters. Raises AtomError on
+    malformed boxes.
+    """
+    try:
+        moov = find_box(header, (b"moov",))
+        if moov is None:
+            raise AtomError("no moov atom")
+
+        track = _chapter_track(header, *moov)
+        if track is not None and f is not None:
+            chapters = _read_text_track(header, track, f)
+            if chapters:
+                return chapters
+
+        chpl = find_box(header, (b"udta", b"chpl"), *moov)
+        if chpl is not None:
+            return _parse_chpl(header[chpl[0]:chpl[1]])
+    except (struct.error, IndexError) as e:
+        raise AtomError(f"malformed chapter data: {e}") from e
+
+    return None if track is not None else []
+
+
+def ffprobe_chapters(path):
+    """Chapters via an ffprobe subprocess. File objects are piped on stdin."""
+    if isinstance(path, (str, os.PathLike)):
+        source, stdin_data = path, None
+    else:
+        path.seek(0)
+        source, stdin_data = "pipe:0", path.read()
+    result = subprocess.run(
+        ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_chapters", source],
+        input=stdin_data, capture_output=True,
+    )
+    chapters = []
+    if result.returncode == 0:
+        for i, ch in enumerate(json.loads(result.stdout).get("chapters", []), 1):
+            chapters.append((
+                i,
+                ch.get("tags", {}).get("title"),
+                int(float(ch["start_time"]) * 1000),
+            ))
+    return chapters
+
+# ── Nero chpl ─────────────────────────────────────────────────────────────────
+
+def _parse_chpl(data):
+    # version(1) flags(3) [reserved(4) if version 1] count(1), then per chapter:
+    # start in 100ns units (8), title length (1), UTF-8 title
+    if len(data) < 5:
+        raise AtomError("truncated chpl atom")
+    pos = 8 if data[0] == 1 else 4
+    count = data[pos]
+    pos += 1
+    chapters = []
+    for i in range(1, count + 1):
+        if pos + 9 > len(data):
+            raise AtomError("truncated chpl entry")
+        start = struct.unpack_from(">Q", data, pos)[0]
+        length = data[pos + 8]
+        title = data[pos + 9:pos + 9 + length].decode("utf-8", errors="replace")
+        pos += 9 + length
+        chapters.append((i, title, start // 10000))
+    return chapters
+
+# ── QuickTime chapter track ───────────────────────────────────────────────────
+
+def _full_box_field(buf, start, v0_offset, v1_offset):
+    """Read a uint32 from a version 0/1 full box (mvhd/tkhd/mdhd layout)."""
+    offset = v1_offset if buf[start] == 1 else v0_offset
+    return struct.unpack_from(">I", buf, start + offset)[0]
+
+
+def _chapter_track(buf, moov_start, moov_end):
+    """Return the (start, end) payload span of the chapter text trak, if any."""
+    traks, chap_ids = {}, set()
+    for t_start, t_end in find_boxes(buf, b"trak", moov_start, moov_end):
+        tkhd = find_box(buf, (b"tkhd",), t_start, t_end)
+        if tkhd is None:
+            continue
+        traks[_full_box_field(buf, tkhd[0], 12, 20)] = (t_start, t_end)
+        chap = find_box(buf, (b"tref", b"chap"), t_start, t_end)
+        if chap is not None:
+            for off in range(chap[0], chap[1] - 3, 4):
+                chap_ids.add(struct.unpack_from(">I", buf, off)[0])
+    for track_id in sorted(chap_ids):
+        if track_id in traks:
+            return traks[track_id]
+    return None
+
+
+def _sample_table(buf, stbl_start, stbl_end):
+    """Return [(offset, size, start_ticks)] for every sample in an stbl."""
+    boxes = {kind: (s, e) for kind, s, e in iter_boxes(buf, stbl_start, stbl_end)}
+    if b"stsz" not in boxes or b"stsc" not in boxes or b"stts" not in boxes:
+        raise AtomError("chapter track is missing sample tables")
+
+    s, _ = boxes[b"stsz"]
+    fixed_size, count = struct.unpack_from(">II", buf, s + 4)
+    sizes = (
+        [fixed_size] * count if fixed_size
+        else list(struct.unpack_from(f">{count}I", buf, s + 12))
+    )
+
+    if b"stco" in boxes:
+        s, _ = boxes[b"stco"]
+        n = struct.unpack_from(">I", buf, s + 4)[0]
+        chunk_offsets = struct.unpack_from(f">{n}I", buf, s + 8)
+    elif b"co64" in boxes:
+        s, _ = boxes[b"co64"]
+        n = struct.unpack_from(">I", buf, s + 4)[0]
+        chunk_offsets = struct.unpack_from(f">{n}Q", buf, s + 8)
+    else:
+        raise AtomError("chapter track has no chunk offsets")
+
+    s, _ = boxes[b"stsc"]
+    n = struct.unpack_from(">I", buf, s + 4)[0]
+    stsc = [struct.unpack_from(">III", buf, s + 8 + 12 * i)[:2] for i in range(n)]
+
+    offsets = []
+    for i, (first_chunk, per_chunk) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            pos = chunk_offsets[chunk - 1]
+            for _ in range(per_chunk):
+                if len(offsets) == count:
+                    break
+                offsets.append(pos)
+                pos += sizes[len(offsets) - 1]
+
+    s, _ = boxes[b"stts"]
+    n = struct.unpack_from(">I", buf, s + 4)[0]
+    starts, t = [], 0
+    for i in range(n):
+        sample_count, delta = struct.unpack_from(">II", buf, s + 8 + 8 * i)
+        for _ in range(sample_count):
+            starts.append(t)
+            t += delta
+
+    return list(zip(offsets, sizes, starts))
+
+
+def _decode_title(sample):
+    length = struct.unpack_from(">H", sample, 0)[0]
+    if length > len(sample) - 2:
+        return None
+    text = sample[2:2 + length]
+    if text[:2] == b"\xfe\xff":
+        return text[2:].decode("utf-16-be", errors="replace")
+    if text[:2] == b"\xff\xfe":
+        return text[2:].decode("utf-16-le", errors="replace")
+    return text.decode("utf-8", errors="replace")
+
+
+def _read_text_track(buf, track, f):
+    t_start, t_end = track
+    mdhd = find_box(buf, (b"mdia", b"mdhd"), t_start, t_end)
+    stbl = find_box(buf, (b"mdia", b"minf", b"stbl"), t_start, t_end)
+    if mdhd is None or stbl is None:
+        return []
+    timescale = _full_box_field(buf, mdhd[0], 12, 20)
+    if not timescale:
+        raise AtomError("chapter track has zero timescale")
+
+    samples = _sample_table(buf, *stbl)
+    if not samples:
+        return []
+
+    # Chapter samples are tiny. Most files store them together, but some
+    # interleave them with the audio, so only samples within SAMPLE_GAP of
+    # each other are read as one range.
+    spans = []
+    for off, size, _ in sorted(samples):
+        if spans and off - spans[-1][1] <= SAMPLE_GAP:
+            spans[-1][1] = max(spans[-1][1], off + size)
+        else:
+            spans.append([off, off + size])
+    blocks = []
+    for lo, hi in spans:
+        f.seek(lo)
+        blocks.append(f.read(hi - lo))
+    span_starts = [lo for lo, _ in spans]
+
+    chapters = []
+    for off, size, start in samples:
+        i = bisect.bisect_right(span_starts, off) - 1
+        sample = blocks[i][off - span_starts[i]:off - span_starts[i] + size]
+        if len(sample) < 2:
+            continue
+        title = _decode_title(sample)
+        if title is None:
+            continue
+        chapters.append((len(chapters) + 1, title, start * 1000 // timescale))
+    return chapters
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cover store and cover derivatives.
+
+Cover images are stored once per distinct content, named by SHA-256:
+
+  {COVERS_DIR}/blobs/{h[:2]}/{h}.{ext}              original bytes
+  {COVERS_DIR}/derived/{h[:2]}/{h}/{size}.webp      thumbnails and variants
+  {COVERS_DIR}/derived/{h[:2]}/{h}/{size}.jpg
+  {COVERS_DIR}/derived/{h[:2]}/{h}/manifest.json    dimensions and byte sizes
+
+Records reference them through relative symlinks at the paths clients
+already use, so an EPUB and M4B of the same book, box sets and re-uploads
+share one copy:
+
+  {COVERS_DIR}/{kind}/{id}.{ext} -> ../blobs/{h[:2]}/{h}.{ext}
+  {COVERS_DIR}/{kind}/{id}       -> ../derived/{h[:2]}/{h}
+
+Every write is atomic (temp file or directory + rename), and nothing is
+rewritten when a record already points at the same content, so re-loads of
+unchanged images cost a hash and a readlink.
+
+Run this module directly to backfill: plain files left by older loaders are
+moved into the store, missing derivatives are built, and --gc removes blobs
+no record links to:
+
+  python covers.py [--covers-dir DIR] [--workers N] [--force] [--gc]
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+COVERS_DIR    = os.environ.get("COVERS_DIR", "/covers")
+COVER_SIZES   = tuple(int(s) for s in os.environ.get("COVER_SIZES", "160,320,640").split(","))
+WEBP_QUALITY  = int(os.environ.get("COVER_WEBP_QUALITY", "80"))
+JPEG_QUALITY  = int(os.environ.get("COVER_JPEG_QUALITY", "85"))
+KINDS         = ("epub", "m4b")
+ORIGINAL_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+# ── Store ─────────────────────────────────────────────────────────────────────
+
+def blob_path(covers_dir, digest, ext):
+    return Path(covers_dir) / "blobs" / digest[:2] / f"{digest}.{ext}"
+
+
+def derived_path(covers_dir, digest):
+    return Path(covers_dir) / "derived" / digest[:2] / digest
+
+
+def _atomic_write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _atomic_symlink(target, link):
+    """Point `link` at `target` (relative), replacing any existing link.
+    Returns False if it already pointed there."""
+    target = os.path.relpath(target, link.parent)
+    if link.is_symlink():
+        if os.readlink(link) == target:
+            return False
+    elif link.is_dir():
+        shutil.rmtree(link)       # derivative dir from before the store existed
+    tmp = link.parent / f".tmp-{link.name}-{os.getpid()}"
+    if tmp.is_symlink():
+        tmp.unlink()
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+    return True
+
+
+def store_blob(covers_dir, data, ext):
+    """Store bytes under their hash. Returns (digest, path, written)."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(covers_dir, digest, ext)
+    if path.exists():
+        return digest, path, False
+    _atomic_write(path, data)
+    return digest, path, True
+
+
+def save_record_cover(kind, record_id, data, ext, covers_dir=COVERS_DIR, derivatives=True):
+    """Store a record's cover and link {kind}/{id}.{ext} (and its derivative
+    directory) to it. Returns (digest, status) where status is "new" (blob
+    written), "linked" (existing blob, link changed) or "unchanged"."""
+    digest, blob, written = store_blob(covers_dir, data, ext)
+    kind_dir = Path(covers_dir) / kind
+    kind_dir.mkdir(parents=True, exist_ok=True)
+
+    # A record's cover may change format between loads; drop stale links.
+    for old in kind_dir.glob(f"{record_id}.*"):
+        if old.suffix != f".{ext}" and not old.name.startswith(".tmp-"):
+            old.unlink()
+    relinked = _atomic_symlink(blob, kind_dir / f"{record_id}.{ext}")
+
+    if derivatives:
+        derived = ensure_derivatives(covers_dir, digest, blob)
+        relinked = _atomic_symlink(derived, kind_dir / str(record_id)) or relinked
+
+    return digest, "new" if written else "linked" if relinked else "unchanged"
+
+def record_cover(kind, record_id, covers_dir=COVERS_DIR):
+    """(bytes, ext) of the cover linked to a record, or None."""
+    for link in (Path(covers_dir) / kind).glob(f"{record_id}.*"):
+        if link.suffix.lower() in ORIGINAL_EXTS and not link.name.startswith(".tmp-") and link.exists():
+            return link.read_bytes(), link.suffix.lstrip(".")
+    return None
+
+# ── Derivatives ───────────────────────────────────────────────────────────────
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == "webp":
+        img.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        if img.mode == "RGBA":
+            flat = Image.new("RGB", img.size, (255, 255, 255))
+            flat.paste(img, mask=img.getchannel("A"))
+            img = flat
+        img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def make_derivatives(src, out_dir, sizes=COVER_SIZES):
+    """Write the variants and manifest for one original into out_dir, for
+    every size in `sizes` (target widths; never upscaled). Returns the
+    manifest."""
+    src, out_dir = Path(src), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        width, height = img.size
+
+        variants = []
+        for size in sorted(set(sizes)):
+            if size < width:
+                thumb = img.resize((size, max(1, round(height * size / width))), Image.LANCZOS)
+            else:
+                thumb = img
+            for fmt, ext in (("webp", "webp"), ("jpeg", "jpg")):
+                data = _encode(thumb, fmt)
+                (out_dir / f"{size}.{ext}").write_bytes(data)
+                variants.append({
+                    "file":   f"{size}.{ext}",
+                    "format": fmt,
+                    "size":   size,
+                    "width":  thumb.width,
+                    "height": thumb.height,
+                    "bytes":  len(data),
+                })
+
+    manifest = {
+        "source":   src.name,
+        "width":    width,
+        "height":   height,
+        "bytes":    src.stat().st_size,
+        "sizes":    sorted(set(sizes)),
+        "variants": variants,
+    }
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def _current(dest):
+    """True if `dest` holds a complete derivative set for COVER_SIZES."""
+    try:
+        manifest = json.loads((dest / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return False
+    return manifest.get("sizes") == sorted(set(COVER_SIZES))
+
+
+def ensure_derivatives(covers_dir, digest, blob, force=False):
+    """Build derivatives for a blob unless they already exist. Blobs are
+    immutable, so an existing manifest for the current sizes is current.
+
+    The directory is built under a temp name and renamed into place. If
+    another worker put one there meanwhile, it wins and this build is
+    discarded; a stale one is renamed aside, never deleted in place, so a
+    directory another worker has just finished is not removed from under
+    it.
+    """
+    dest = derived_path(covers_dir, digest)
+    if not force and _current(dest):
+        return dest
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=dest.parent, prefix=f".tmp-{digest[:8]}-"))
+    old = None
+    try:
+        make_derivatives(blob, tmp)
+        try:
+            os.rename(tmp, dest)
+            return dest
+        except OSError:
+            pass                  # dest exists
+        if not force and _current(dest):
+            return dest           # another worker finished the same blob first
+        old = Path(tempfile.mkdtemp(dir=dest.parent, prefix=f".tmp-{digest[:8]}-old-"))
+        try:
+            os.rename(dest, old)
+        except FileNotFoundError:
+            pass                  # another worker moved it aside first
+        try:
+            os.rename(tmp, dest)
+        except OSError:
+            pass                  # and put its build in place first
+    finally:
+        for path in (tmp, old):
+            if path is not None and path.exists():
+                shutil.rmtree(path)
+    return dest
+
+# ── Backfill ──────────────────────────────────────────────────────────────────
+
+def iter_originals(covers_dir):
+    """Yield every {kind}/{id}.{ext} cover, linked or (legacy) plain file."""
+    for kind in KINDS:
+        kind_dir = Path(covers_dir) / kind
+        if not kind_dir.is_dir():
+            continue
+        for path in sorted(kind_dir.iterdir()):
+            if path.name.startswith(".tmp-") or path.suffix.lower() not in ORIGINAL_EXTS:
+                continue
+            if path.is_symlink() or path.is_file():
+                yield path
+
+
+def backfill_one(path, covers_dir=COVERS_DIR, force=False):
+    """Move a legacy cover file into the store, or make sure a linked one
+    has derivatives. Returns (path, status, error)."""
+    path = Path(path)
+    try:
+        kind, record_id, ext = path.parent.name, path.stem, path.suffix.lstrip(".")
+        if not path.is_symlink():
+            _, status = save_record_cover(kind, record_id, path.read_bytes(), ext, covers_dir)
+            return path, f"migrated ({status})", None
+        blob = path.resolve()
+        digest = blob.stem
+        derived = ensure_derivatives(covers_dir, digest, blob, force=force)
+        _atomic_symlink(derived, path.parent / record_id)
+        return path, "ok", None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def gc(covers_dir):
+    """Remove blobs and derivative directories no record links to."""
+    covers_dir = Path(covers_dir)
+    live = set()
+    for kind in KINDS:
+        kind_dir = covers_dir / kind
+        if kind_dir.is_dir():
+            for link in kind_dir.iterdir():
+                if link.is_symlink():
+                    live.add(Path(link).resolve().name.split(".")[0])
+    removed = 0
+    for root in (covers_dir / "blobs", covers_dir / "derived"):
+        if not root.is_dir():
+            continue
+        for entry in root.glob("*/*"):
+            if entry.name.startswith(".tmp-") or entry.name.split(".")[0] in live:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the content-addressed cover store.")
+    parser.add_argument("--covers-dir", default=COVERS_DIR,
+                        help=f"Covers directory (default: {COVERS_DIR})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="Parallel worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild derivatives even when they are up to date")
+    parser.add_argument("--gc", action="store_true",
+                        help="Afterwards, remove blobs no record links to")
+    args = parser.parse_args()
+
+    todo = list(iter_originals(args.covers_dir))
+    print(f"{len(todo)} covers to check.", flush=True)
+
+    done = errors = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(backfill_one, p, args.covers_dir, args.force) for p in todo]
+        for future in concurrent.futures.as_completed(futures):
+            path, status, error = future.result()
+            if error:
+                errors += 1
+                print(f"  ERROR {path}: {error}", flush=True)
+            else:
+                done += 1
+            if (done + errors) % 500 == 0:
+                print(f"  {done + errors}/{len(todo)}", flush=True)
+
+    print(f"Done: {done} covers processed, {errors} errors.")
+    if args.gc:
+        print(f"Removed {gc(args.covers_dir)} unreferenced blobs and derivative dirs.")
+
+
+if __name__ == "__main__":
+    main()
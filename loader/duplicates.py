@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Report byte-identical objects stored under more than one key.
+
+In download mode the loader hashes every object (SHA-256) as it streams in
+and stores content_hash and content_size on its epubs/m4bs row. Rows that
+share both hold the same bytes, whatever their keys, so this report lists
+each such group with its keys and the bytes the extra copies take up.
+Rows loaded in range mode, or before hashing was added, have no hash and
+are not compared; `python backfill.py run epub-hash m4b-hash` fills them in.
+
+Usage:
+
+  python duplicates.py [--kind epub|m4b] [--min-copies N] [--summary]
+"""
+
+import argparse
+
+import loader as ld
+
+# Groups of live rows with the same bytes, largest waste first.
+GROUPS = """
+    SELECT content_hash, content_size, count(*),
+           array_agg(s3_key ORDER BY id), array_agg(id ORDER BY id)
+    FROM {table}
+    WHERE content_hash IS NOT NULL AND gone_at IS NULL
+    GROUP BY content_hash, content_size
+    HAVING count(*) >= %s
+    ORDER BY (count(*) - 1) * content_size DESC, content_hash
+"""
+
+COVERAGE = """
+    SELECT count(*), count(content_hash) FROM {table} WHERE gone_at IS NULL
+"""
+
+TABLES = {"epub": "epubs", "m4b": "m4bs"}
+
+
+def report(conn, kind, min_copies=2, summary=False):
+    """Print the duplicate groups of one table. Returns (groups, redundant
+    bytes)."""
+    table = TABLES[kind]
+    with conn.cursor() as cur:
+        cur.execute(COVERAGE.format(table=table))
+        rows, hashed = cur.fetchone()
+        cur.execute(GROUPS.format(table=table), (min_copies,))
+        groups = cur.fetchall()
+
+    redundant = 0
+    for content_hash, size, copies, keys, ids in groups:
+        redundant += (copies - 1) * size
+        if summary:
+            continue
+        print(f"{kind} {content_hash[:16]}  {copies} copies of {size / 1e6:.1f} MB")
+        for key, record_id in zip(keys, ids):
+            print(f"  {record_id:>8}  {key}")
+    print(
+        f"{table}: {len(groups)} groups of duplicates, {redundant / 1e6:.1f} MB redundant "
+        f"({hashed} of {rows} live rows hashed)"
+    )
+    return len(groups), redundant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report objects stored under more than one key.")
+    parser.add_argument("--kind", choices=sorted(TABLES), help="Only this kind (default: both)")
+    parser.add_argument("--min-copies", type=int, default=2,
+                        help="Only groups with at least this many copies (default: 2)")
+    parser.add_argument("--summary", action="store_true", help="Totals only, no groups")
+    args = parser.parse_args()
+
+    conn = ld.connect_db()
+    try:
+        for kind in [args.kind] if args.kind else TABLES:
+            report(conn, kind, args.min_copies, args.summary)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Durable load jobs and work claiming for loader replicas.
+
+Any number of loaders can share one bucket and database. Each poll, the
+replica holding the LISTER_LOCK advisory lock lists the bucket and syncs the
+s3_objects manifest (see catalog.sync_manifest); the others skip listing.
+Every replica, the lister included, then claims pending manifest rows in
+small batches with FOR UPDATE SKIP LOCKED, so no two replicas download the
+same key.
+
+Each manifest row is the load job for its current etag, and the job state
+lives in the database, so progress survives restarts:
+
+  pending  --claim-->  running  --write-->  done
+                          |
+                          +--error-->  failed  --backoff-->  (claimable again)
+                          |
+                          +--error, QUARANTINE_AFTER attempts-->  quarantined
+
+A claim is a lease: claimed_by, lease_until, attempts + 1 and attempted_at.
+A LeaseKeeper thread extends the replica's leases while it works. Writing a
+record finishes its job (catalog.MARK_LOADED); a failure records last_error.
+A running job whose lease has expired, because its replica crashed, is
+claimable like a pending one, and on start a replica releases the jobs a
+previous process with its LOADER_ID left running, so it resumes them at
+once instead of waiting out their leases.
+
+Failed jobs are retried after RETRY_BASE_SECONDS, doubling per attempt up to
+RETRY_MAX_SECONDS, so a corrupt object is not downloaded again every poll.
+After QUARANTINE_AFTER attempts at the same etag the job is quarantined and
+only runs again when the object's etag changes or an operator requeues it.
+A job whose process keeps dying (its lease expires) counts the same way.
+
+Run this module directly to inspect or requeue jobs:
+
+  python jobs.py report [--all]
+  python jobs.py requeue KEY... | --quarantined | --failed | --done
+
+Requeueing done jobs reloads their objects without any catalog change, e.g.
+to fill columns a migration added; with the loader's PARSE_CACHE enabled
+the reload is served from the cache instead of the bucket.
+"""
+
+import argparse
+import os
+import threading
+
+import psycopg2
+
+PG_HOST     = os.environ.get("POSTGRES_HOST", "db")
+PG_PORT     = int(os.environ.get("POSTGRES_PORT", "5432"))
+PG_DB       = os.environ.get("POSTGRES_DB", "vibelib")
+PG_USER     = os.environ.get("POSTGRES_USER", "vibelib")
+PG_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+
+RETRY_BASE_SECONDS = int(os.environ.get("RETRY_BASE_SECONDS", "300"))
+RETRY_MAX_SECONDS  = int(os.environ.get("RETRY_MAX_SECONDS", str(24 * 3600)))
+QUARANTINE_AFTER   = int(os.environ.get("QUARANTINE_AFTER", "5"))
+
+# Session advisory lock held by the replica that lists the bucket.
+LISTER_LOCK = 0x7669626C  # "vibl"
+
+# Jobs a replica may claim: pending, failed and past their backoff, or
+# running under an expired lease.
+CLAIMABLE = """
+    gone_at IS NULL
+    AND (state = 'pending'
+         OR (state = 'failed' AND (next_attempt_at IS NULL OR next_attempt_at <= now()))
+         OR (state = 'running' AND lease_until < now()))
+"""
+
+# Expired leases on jobs that have used up their attempts: the process
+# loading them keeps dying, most likely because of the object.
+QUARANTINE_EXPIRED = f"""
+    UPDATE s3_objects SET
+        state       = 'quarantined',
+        last_error  = coalesce(last_error, 'lease expired ' || attempts || ' times'),
+        claimed_by  = NULL,
+        lease_until = NULL
+    WHERE state = 'running' AND lease_until < now() AND attempts >= {QUARANTINE_AFTER}
+"""
+
+# Returns (s3_key, size, etag, known, reclaimed); reclaimed = the job was
+# taken over from an expired lease.
+CLAIM = f"""
+    UPDATE s3_objects o SET
+        state        = 'running',
+        attempts     = o.attempts + 1,
+        attempted_at = now(),
+        claimed_by   = %s,
+        lease_until  = now() + make_interval(secs => %s)
+    FROM (
+        SELECT s3_key, state FROM s3_objects
+        WHERE {CLAIMABLE}
+        ORDER BY s3_key
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) c
+    WHERE o.s3_key = c.s3_key
+    RETURNING o.s3_key, o.size, o.etag,
+              EXISTS (SELECT 1 FROM epubs e WHERE e.s3_key = o.s3_key)
+              OR EXISTS (SELECT 1 FROM m4bs m WHERE m.s3_key = o.s3_key),
+              c.state = 'running'
+"""
+
+RENEW = """
+    UPDATE s3_objects SET lease_until = now() + make_interval(secs => %s)
+    WHERE claimed_by = %s AND state = 'running'
+"""
+
+# Record a failed attempt (etag, error, s3_key, worker), unless another
+# replica has taken the job over: back off exponentially, or quarantine after
+# QUARANTINE_AFTER attempts. An error against an etag the manifest has moved
+# past is dropped.
+FAIL = f"""
+    UPDATE s3_objects o SET
+        state           = CASE WHEN o.etag <> p.etag THEN 'pending'
+                               WHEN o.attempts >= {QUARANTINE_AFTER} THEN 'quarantined'
+                               ELSE 'failed' END,
+        last_error      = CASE WHEN o.etag = p.etag THEN p.error END,
+        next_attempt_at = CASE WHEN o.etag = p.etag THEN now() + make_interval(
+                              secs => least({RETRY_BASE_SECONDS} * 2 ^ (o.attempts - 1), {RETRY_MAX_SECONDS})
+                          ) END,
+        claimed_by      = NULL,
+        lease_until     = NULL
+    FROM (VALUES (%s, %s)) AS p(etag, error)
+    WHERE o.s3_key = %s AND o.claimed_by = %s AND o.state = 'running'
+    RETURNING o.state, o.attempts, o.next_attempt_at
+"""
+
+# Hand back a replica's unfinished jobs. The attempt still counts: a process
+# that died mid-job may have died because of the object.
+RELEASE = f"""
+    UPDATE s3_objects SET
+        state       = CASE WHEN attempts >= {QUARANTINE_AFTER} THEN 'quarantined'
+                           WHEN last_error IS NULL THEN 'pending'
+                           ELSE 'failed' END,
+        claimed_by  = NULL,
+        lease_until = NULL
+    WHERE claimed_by = %s AND state = 'running'
+"""
+
+# Give jobs a fresh start: no attempts, backoff or quarantine. Running jobs
+# are left to their holders.
+REQUEUE = """
+    UPDATE s3_objects SET
+        state           = 'pending',
+        attempts        = 0,
+        last_error      = NULL,
+        next_attempt_at = NULL
+    WHERE state = ANY(%s) AND state <> 'running' AND {where}
+    RETURNING s3_key
+"""
+
+REPORT = """
+    SELECT s3_key, state, attempts, size, etag, attempted_at, next_attempt_at, last_error
+    FROM s3_objects
+    WHERE gone_at IS NULL AND state IN %s
+    ORDER BY array_position(ARRAY['quarantined', 'failed', 'running', 'pending'], state),
+             attempted_at DESC NULLS LAST, s3_key
+"""
+
+PENDING_COUNT = f"SELECT count(*) FROM s3_objects WHERE {CLAIMABLE}"
+
+STATE_COUNTS = """
+    SELECT state, count(*) FROM s3_objects WHERE gone_at IS NULL GROUP BY state
+"""
+
+# ── Listing ───────────────────────────────────────────────────────────────────
+
+class ListerLock:
+    """Holds LISTER_LOCK on a dedicated connection for the life of the
+    process, so one replica lists until it exits or loses its connection,
+    and then another takes over on its next poll."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._conn    = None
+
+    def held(self):
+        """True if this process holds the lock, trying to take it if not."""
+        try:
+            if self._conn is not None and not self._conn.closed:
+                with self._conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                return True
+        except psycopg2.Error:
+            self._conn.close()
+        self._conn = self._connect()
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (LISTER_LOCK,))
+            if cur.fetchone()[0]:
+                return True
+        self._conn.close()
+        self._conn = None
+        return False
+
+# ── Claims ────────────────────────────────────────────────────────────────────
+
+def claim(conn, worker, limit, lease_seconds):
+    """Lease up to `limit` claimable jobs to `worker` and commit. Returns
+    [(s3_key, size, etag, known, reclaimed)]. Crash-looping jobs are
+    quarantined first rather than reclaimed."""
+    with conn.cursor() as cur:
+        cur.execute(QUARANTINE_EXPIRED)
+        cur.execute(CLAIM, (worker, lease_seconds, limit))
+        rows = cur.fetchall()
+    conn.commit()
+    return sorted(rows)
+
+def iter_claims(conn, worker, batch, lease_seconds):
+    """Yield claimed rows batch by batch until nothing is left to claim.
+    Claims are made lazily, as the consumer (the download queue) has room."""
+    while True:
+        rows = claim(conn, worker, batch, lease_seconds)
+        if not rows:
+            return
+        yield from rows
+
+def fail(conn, worker, s3_key, etag, error):
+    """Record a failed attempt at (s3_key, etag) by `worker` and commit.
+    Returns (state, attempts, next_attempt_at), or None if the job is no
+    longer this worker's."""
+    with conn.cursor() as cur:
+        cur.execute(FAIL, (etag, str(error)[:2000], s3_key, worker))
+        row = cur.fetchone()
+    conn.commit()
+    return row
+
+def describe_failure(row):
+    """One line for the log about a job after fail()."""
+    if row is None:
+        return "job was taken over by another replica"
+    state, attempts, next_attempt_at = row
+    if state == "quarantined":
+        return f"quarantined after {attempts} attempts (requeue with jobs.py)"
+    if state == "failed":
+        return f"attempt {attempts} failed, retrying after {next_attempt_at:%Y-%m-%d %H:%M:%S}"
+    return "object changed since the attempt; will load the new version"
+
+def release(conn, worker):
+    """Hand back `worker`'s unfinished jobs and commit. Returns how many.
+    Called at the end of a run, and on start to resume the jobs a previous
+    process with the same LOADER_ID left running."""
+    with conn.cursor() as cur:
+        cur.execute(RELEASE, (worker,))
+        released = cur.rowcount
+    conn.commit()
+    return released
+
+def requeue(conn, keys=None, states=("failed", "quarantined")):
+    """Reset the jobs in `states` for `keys` (or every job in `states`) to
+    pending and commit. Returns the requeued keys."""
+    with conn.cursor() as cur:
+        if keys:
+            cur.execute(REQUEUE.format(where="s3_key = ANY(%s)"), (list(states), list(keys)))
+        else:
+            cur.execute(REQUEUE.format(where="true"), (list(states),))
+        requeued = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return requeued
+
+def state_counts(conn):
+    """{state: jobs} over objects still in the bucket."""
+    with conn.cursor() as cur:
+        cur.execute(STATE_COUNTS)
+        return dict(cur.fetchall())
+
+def pending_count(conn):
+    with conn.cursor() as cur:
+        cur.execute(PENDING_COUNT)
+        return cur.fetchone()[0]
+
+class LeaseKeeper:
+    """Thread that extends `worker`'s leases every lease_seconds / 3, so
+    objects that take longer than one lease to load are not claimed twice."""
+
+    def __init__(self, connect, worker, lease_seconds):
+        self._connect      = connect
+        self.worker        = worker
+        self.lease_seconds = lease_seconds
+        self._stop         = threading.Event()
+        self._thread       = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(RENEW, (self.lease_seconds, self.worker))
+                    conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    print(f"  WARNING: lease renewal failed: {e}", flush=True)
+        finally:
+            conn.close()
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def report(conn, states):
+    with conn.cursor() as cur:
+        cur.execute(REPORT, (tuple(states),))
+        rows = cur.fetchall()
+    for key, state, attempts, size, etag, attempted_at, next_attempt_at, error in rows:
+        when = f"next try {next_attempt_at:%Y-%m-%d %H:%M}" if state == "failed" and next_attempt_at else ""
+        last = f"{attempted_at:%Y-%m-%d %H:%M}" if attempted_at else "never"
+        print(f"{state:<12} {attempts:>3} attempts  last {last}  {when}")
+        print(f"  {key}  ({size} bytes, etag {etag})")
+        if error:
+            print(f"  {error.splitlines()[0][:200]}")
+    counts = state_counts(conn)
+    print(f"\n{len(rows)} listed. " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and requeue loader jobs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report_cmd = sub.add_parser("report", help="List quarantined and failed jobs")
+    report_cmd.add_argument("--all", action="store_true",
+                     help="Also list pending and running jobs")
+
+    requeue_cmd = sub.add_parser("requeue", help="Retry failed or quarantined jobs on the next poll")
+    requeue_cmd.add_argument("keys", nargs="*", metavar="KEY",
+                             help="S3 keys to requeue (failed or quarantined, unless states are given)")
+    requeue_cmd.add_argument("--quarantined", action="store_true", help="Requeue every quarantined job")
+    requeue_cmd.add_argument("--failed", action="store_true", help="Requeue every failed job")
+    requeue_cmd.add_argument("--done", action="store_true",
+                             help="Requeue every done job, reloading its object")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(host=PG_HOST, port=PG_PORT, dbname=PG_DB,
+                            user=PG_USER, password=PG_PASSWORD)
+    if args.command == "report":
+        states = ["quarantined", "failed"] + (["running", "pending"] if args.all else [])
+        report(conn, states)
+    else:
+        states = [
+            s for s, on in
+            (("quarantined", args.quarantined), ("failed", args.failed), ("done", args.done)) if on
+        ]
+        if not args.keys and not states:
+            parser.error("give keys, --quarantined, --failed or --done")
+        requeued = requeue(conn, args.keys, states or ("failed", "quarantined"))
+        for key in requeued:
+            print(f"requeued {key}")
+        print(f"{len(requeued)} jobs requeued.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
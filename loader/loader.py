@@ -1,25 +1,56 @@
 #!/usr/bin/env python3
 """
 Loader: iterates all EPUBs and M4Bs in S3, extracts metadata and cover images,
-and writes everything to PostgreSQL. Downloads and parses files concurrently,
-then writes results to the database serially from the main thread.
+and writes everything to PostgreSQL. Each run is a staged pipeline
+(list -> download -> parse -> write -> cover save) joined by bounded queues,
+so memory stays flat however large the backlog is (see pipeline.py). Each
+stage has its own worker count; the write stage runs on the main thread and
+commits in batches (see catalog.py). ENGINE=async runs the same pass on an
+asyncio event loop instead (see async_engine.py). With NOTIFY_PORT set, bucket
+notifications queue new keys as they arrive and the full listing becomes a
+slow reconcile (see notify.py). Per-stage metrics are served on METRICS_PORT
+(see metrics.py). Downloads are hashed as they stream in, so byte-identical
+copies under different keys can be reported (see duplicates.py) and, with
+SKIP_DUPLICATES, loaded without parsing.
 """
 
 import concurrent.futures
-import json
+import io
+import multiprocessing
 import os
-import subprocess
+import queue
+import socket
+import sys
 import tempfile
+import threading
 import time
 import zipfile
-import xml.etree.ElementTree as ET
 from pathlib import Path
 
 import boto3
 import psycopg2
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from mutagen.mp4 import MP4, MP4Cover
 
+from adaptive import AIMD, Slots, is_throttle
+from catalog import LIVE_COUNTS, BatchWriter, find_duplicate, sync_manifest
+from chapters import ffprobe_chapters, read_chapters
+from covers import record_cover, save_record_cover
+import metrics
+from jobs import (
+    LeaseKeeper, ListerLock, describe_failure, fail, iter_claims, pending_count, release,
+    state_counts,
+)
+from migrate import migrate
+from mp4atoms import AtomError, read_moov
+from notify import Receiver
+from opf import find_opf_path, opf_base, read_opf
+from parsecache import Cached, ParseCache
+from pipeline import DONE, Failed, Stage, bounded, feed
+from s3io import FetchStats, HashingWriter, S3RangeFile, connection_stats
+
 # ── Configuration ────────────────────────────────────────────────────────────
 
 S3_ENDPOINT = os.environ["OBJECT_STORE_BUCKET_ENDPOINT"]
@@ -27,6 +58,7 @@ S3_KEY      = os.environ["OBJECT_STORE_ACCESS_KEY_ID"]
 S3_SECRET   = os.environ["OBJECT_STORE_SECRET_ACCESS_KEY"]
 S3_BUCKET   = os.environ["OBJECT_STORE_BUCKET_NAME"]
 S3_REGION   = os.environ["OBJECT_STORE_BUCKET_REGION"]
+S3_SCHEME   = os.environ.get("OBJECT_STORE_SCHEME", "https")  # http for a local stand-in
 
 PG_HOST     = os.environ.get("POSTGRES_HOST", "db")
 PG_PORT     = int(os.environ.get("POSTGRES_PORT", "5432"))
@@ -35,23 +67,137 @@ PG_USER     = os.environ.get("POSTGRES_USER", "vibelib")
 PG_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
 
 COVERS_DIR       = os.environ.get("COVERS_DIR", "/covers")
-SCHEMA_FILE      = "/app/schema.sql"
+SCHEMA_FILE      = os.environ.get("SCHEMA_FILE", "/app/schema.sql")
+MIGRATIONS_DIR   = os.environ.get("MIGRATIONS_DIR", "/app/migrations")
 DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "8"))
+PARSE_WORKERS    = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 2)))  # processes
+COVER_WORKERS    = int(os.environ.get("COVER_WORKERS", "2"))
+# Build thumbnails/WebP variants in the cover stage (see covers.py)
+COVER_DERIVATIVES = os.environ.get("COVER_DERIVATIVES", "true").lower() in ("1", "true", "yes")
+QUEUE_DEPTH      = int(os.environ.get("QUEUE_DEPTH", "16"))  # max items between stages
 POLL_INTERVAL    = int(os.environ.get("POLL_INTERVAL", "300"))
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_MS   = int(os.environ.get("WRITE_BATCH_MS", "1000"))
+# On start the loader creates or migrates the schema (see migrate.py);
+# SKIP_SCHEMA=true leaves that to a separate `python migrate.py`.
 SKIP_SCHEMA      = os.environ.get("SKIP_SCHEMA", "").lower() in ("1", "true", "yes")
 
+# FETCH_MODE=download pulls each object to a temp file before parsing;
+# FETCH_MODE=range reads EPUBs in place and pulls only the moov atom of M4Bs,
+# both with S3 Range GETs (see s3io.py and mp4atoms.py).
+FETCH_MODE       = os.environ.get("FETCH_MODE", "download").lower()
+RANGE_BLOCK_SIZE = int(os.environ.get("RANGE_BLOCK_SIZE", str(64 * 1024)))
+
+# In download mode, objects smaller than this are fetched straight into memory
+# and parsed from a BytesIO; larger ones are spooled to a temp file in TMPDIR.
+INMEMORY_MAX_BYTES = int(os.environ.get("INMEMORY_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# ENGINE=thread runs the threaded pipeline below; ENGINE=async runs the
+# asyncio engine in async_engine.py, which keeps up to ASYNC_CONCURRENCY
+# downloads in flight on one event loop and writes through a pool of
+# PG_POOL_SIZE asyncpg connections. It holds at most ASYNC_INMEMORY_BYTES of
+# objects in memory between download and parse and spools the rest.
+ENGINE               = os.environ.get("ENGINE", "thread").lower()
+ASYNC_CONCURRENCY    = int(os.environ.get("ASYNC_CONCURRENCY", "256"))
+ASYNC_INMEMORY_BYTES = int(os.environ.get("ASYNC_INMEMORY_BYTES", str(256 * 1024 * 1024)))
+PG_POOL_SIZE         = int(os.environ.get("PG_POOL_SIZE", "4"))
+
+# Replicas: whichever holds the lister lock lists the bucket; every replica
+# claims pending keys CLAIM_BATCH at a time under LEASE_SECONDS leases
+# (see jobs.py). LOADER_ID must be unique per replica and stable across its
+# restarts, so a restarted replica can resume its own unfinished jobs.
+LOADER_ID     = os.environ.get("LOADER_ID", socket.gethostname())
+CLAIM_BATCH   = int(os.environ.get("CLAIM_BATCH", "32"))
+LEASE_SECONDS = int(os.environ.get("LEASE_SECONDS", "300"))
+
+# Bucket notifications: with NOTIFY_PORT set, an HTTP receiver queues keys as
+# the object store reports them, and the full listing runs only every
+# RECONCILE_INTERVAL seconds to catch missed events. In between, each
+# POLL_INTERVAL still claims pending jobs (retries, keys queued by another
+# replica's receiver) without listing. NOTIFY_TOKEN, if set, is the bearer
+# token the object store's webhook must send.
+NOTIFY_PORT        = int(os.environ.get("NOTIFY_PORT", "0"))
+NOTIFY_TOKEN       = os.environ.get("NOTIFY_TOKEN") or None
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "3600"))
+
+# Prometheus metrics endpoint (see metrics.py); 0 disables it.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "8000"))
+
+# ADAPTIVE_DOWNLOADS=true starts at DOWNLOAD_WORKERS concurrent downloads and
+# lets an AIMD controller move that between DOWNLOAD_WORKERS_MIN and
+# DOWNLOAD_WORKERS_MAX (ASYNC_CONCURRENCY in the async engine) from observed
+# throughput and throttling, every ADAPT_WINDOW seconds (see adaptive.py).
+ADAPTIVE_DOWNLOADS   = os.environ.get("ADAPTIVE_DOWNLOADS", "").lower() in ("1", "true", "yes")
+DOWNLOAD_WORKERS_MIN = int(os.environ.get("DOWNLOAD_WORKERS_MIN", "2"))
+DOWNLOAD_WORKERS_MAX = int(os.environ.get("DOWNLOAD_WORKERS_MAX", "64"))
+ADAPT_WINDOW         = float(os.environ.get("ADAPT_WINDOW", "5"))
+
+def _concurrency_changed(old, new, reason):
+    print(f"  download concurrency {old} -> {new} ({reason})", flush=True)
+    metrics.DOWNLOAD_CONCURRENCY.set(new)
+
+DOWNLOAD_LIMIT = AIMD(
+    DOWNLOAD_WORKERS, DOWNLOAD_WORKERS_MIN,
+    ASYNC_CONCURRENCY if ENGINE == "async" else DOWNLOAD_WORKERS_MAX,
+    window=ADAPT_WINDOW, on_change=_concurrency_changed,
+) if ADAPTIVE_DOWNLOADS else None
+
+def _fetched(nbytes):
+    metrics.downloaded(nbytes)
+    if DOWNLOAD_LIMIT is not None:
+        DOWNLOAD_LIMIT.observe(nbytes)
+
+FETCH_STATS = FetchStats(on_add=_fetched)
+
+# Parse cache (see parsecache.py): with PARSE_CACHE set to a file path, parse
+# results are kept there, up to PARSE_CACHE_MB, and objects whose etag is
+# cached are loaded without downloading them.
+PARSE_CACHE    = os.environ.get("PARSE_CACHE", "")
+PARSE_CACHE_MB = int(os.environ.get("PARSE_CACHE_MB", "4096"))
+
+# Download mode hashes every object (SHA-256) as it streams in and stores the
+# hash on its row. With SKIP_DUPLICATES, an object whose bytes are already
+# loaded under another key is not parsed: its row is copied from that one.
+SKIP_DUPLICATES = os.environ.get("SKIP_DUPLICATES", "").lower() in ("1", "true", "yes")
+HASH_CHUNK_SIZE = 1024 * 1024   # read size for objects fetched into memory
+
 # ── S3 ────────────────────────────────────────────────────────────────────────
 
-def make_s3():
+def make_s3(max_pool_connections=10):
     return boto3.client(
         "s3",
-        endpoint_url=f"https://{S3_ENDPOINT}",
+        endpoint_url=f"{S3_SCHEME}://{S3_ENDPOINT}",
         aws_access_key_id=S3_KEY,
         aws_secret_access_key=S3_SECRET,
         region_name=S3_REGION,
-        config=Config(signature_version="s3v4"),
+        config=Config(
+            signature_version="s3v4",
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+        ),
     )
 
+# One connection per download: concurrency comes from DOWNLOAD_WORKERS (or the
+# adaptive limit), so a download never needs more than its share of the
+# shared connection pool.
+TRANSFER_CONFIG = TransferConfig(use_threads=False)
+
+_shared_s3      = None
+_shared_s3_pid  = None
+_shared_s3_lock = threading.Lock()
+
+def shared_s3():
+    """The process-wide S3 client. boto3 clients are thread-safe, so every
+    worker thread shares one client and its keep-alive connection pool, sized
+    to the most concurrent downloads. Each parse process builds its own on
+    first use."""
+    global _shared_s3, _shared_s3_pid
+    with _shared_s3_lock:
+        if _shared_s3 is None or _shared_s3_pid != os.getpid():
+            _shared_s3 = make_s3(max_pool_connections=max(download_ceiling(), 10))
+            _shared_s3_pid = os.getpid()
+        return _shared_s3
+
 # ── Database ──────────────────────────────────────────────────────────────────
 
 def wait_for_db():
@@ -75,55 +221,45 @@ def connect_db():
         user=PG_USER, password=PG_PASSWORD,
     )
 
+LISTER = ListerLock(connect_db)
+
 def apply_schema(conn):
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM information_schema.tables WHERE table_name = 'epubs'
-            )
-        """)
-        if cur.fetchone()[0]:
-            print("Schema already applied.", flush=True)
-            return
-        print("Applying schema...", flush=True)
-        with open(SCHEMA_FILE) as f:
-            cur.execute(f.read())
-    conn.commit()
-    print("Schema applied.", flush=True)
+    # Creates the schema in an empty database, or applies the migrations the
+    # database has not had yet; a no-op once it is current (see migrate.py).
+    applied = migrate(conn, SCHEMA_FILE, MIGRATIONS_DIR)
+    if applied:
+        print(f"Schema migrated: {', '.join(applied)}.", flush=True)
+    else:
+        print("Schema is up to date.", flush=True)
 
 # ── EPUB parsing ──────────────────────────────────────────────────────────────
 
-OPF_NS = {
-    "opf": "http://www.idpf.org/2007/opf",
-    "dc":  "http://purl.org/dc/elements/1.1/",
-}
-IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
-
-def find_opf_path(zf):
-    try:
-        root = ET.fromstring(zf.read("META-INF/container.xml").decode("utf-8", errors="replace"))
-        for el in root.iter():
-            if el.tag.endswith("rootfile"):
-                return el.attrib.get("full-path")
-    except Exception:
-        pass
-    return next((n for n in zf.namelist() if n.endswith(".opf")), None)
-
-def opf_base(opf_path):
-    parts = opf_path.split("/")
-    return "/".join(parts[:-1]) + "/" if len(parts) > 1 else ""
+# Bump whenever parse_epub or parse_m4b would return something different for
+# the same file, so that parse cache entries from the old parsers stop matching.
+PARSER_VERSION = 1
 
-def resolve_href(base, href):
-    return base + href if not href.startswith("/") else href.lstrip("/")
-
-def dc_text(md, tag):
-    el = md.find(f"dc:{tag}", OPF_NS)
-    if el is None:
-        el = md.find(f"{{{OPF_NS['dc']}}}{tag}")
-    return el.text.strip() if el is not None and el.text else None
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 
-def parse_epub(path):
-    """Returns (meta, authors, cover_bytes, cover_ext)."""
+# Errors reading an object, as opposed to errors in its contents. The parsers
+# always raise these, so the job fails and is retried after a backoff instead
+# of being loaded as an empty record.
+READ_ERRORS = (BotoCoreError, ClientError, OSError)
+
+def read_error(error):
+    """The READ_ERRORS instance `error` is or was raised while handling
+    (mutagen wraps I/O errors in its own), or None."""
+    while error is not None:
+        if isinstance(error, READ_ERRORS):
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+def parse_epub(path, with_cover=True, strict=False):
+    """Returns (meta, authors, cover_bytes, cover_ext). `path` may also be a
+    seekable file object such as an S3RangeFile. Without `with_cover` the
+    cover is located but not read. Errors are logged and yield whatever was
+    extracted so far, or raised if `strict`; read errors are always raised
+    (see READ_ERRORS)."""
     meta, authors, cover_bytes, cover_ext = {}, [], None, None
     try:
         with zipfile.ZipFile(path) as zf:
@@ -131,91 +267,15 @@ def parse_epub(path):
             if not opf_path:
                 return meta, authors, None, None
 
-            base = opf_base(opf_path)
-            root = ET.fromstring(zf.read(opf_path).decode("utf-8", errors="replace"))
-            md = root.find("opf:metadata", OPF_NS)
-            if md is None:
-                md = root.find("metadata")
-            if md is None:
+            opf = read_opf(zf.read(opf_path), opf_base(opf_path))
+            if opf is None:
                 return meta, authors, None, None
-
-            meta["title"]          = dc_text(md, "title")
-            meta["publisher"]      = dc_text(md, "publisher")
-            meta["published_date"] = dc_text(md, "date")
-            meta["language"]       = dc_text(md, "language")
-            meta["description"]    = dc_text(md, "description")
-            meta["subject"]        = dc_text(md, "subject")
-
-            # Authors — repeated dc:creator elements
-            creators = (
-                md.findall("dc:creator", OPF_NS) or
-                md.findall(f"{{{OPF_NS['dc']}}}creator")
-            )
-            for i, el in enumerate(creators, 1):
-                name = el.text.strip() if el.text else None
-                role = el.attrib.get(f"{{{OPF_NS['opf']}}}role", "author")
-                if name:
-                    authors.append((name, role, i))
-
-            # Series from Calibre meta tags
-            for el in list(md.findall("opf:meta", OPF_NS)) + list(md.findall("meta")):
-                name = el.attrib.get("name", "")
-                if name == "calibre:series":
-                    meta["series"] = el.attrib.get("content")
-                elif name == "calibre:series_index":
-                    try:
-                        meta["series_position"] = float(el.attrib.get("content", ""))
-                    except ValueError:
-                        pass
-
-            # Identifiers
-            all_ids = (
-                md.findall("dc:identifier", OPF_NS) +
-                md.findall(f"{{{OPF_NS['dc']}}}identifier")
-            )
-            for el in all_ids:
-                scheme = (
-                    el.attrib.get("scheme") or
-                    el.attrib.get(f"{{{OPF_NS['opf']}}}scheme", "")
-                ).lower()
-                val = el.text.strip() if el.text else ""
-                if not val:
-                    continue
-                if "asin" in scheme or "asin" in val.lower():
-                    meta.setdefault("asin", val.split(":")[-1])
-                elif "isbn" in scheme:
-                    meta.setdefault("isbn", val)
-                else:
-                    meta.setdefault("identifier", val)
-
-            # Cover image — build manifest then find cover
-            manifest = {}
-            for item in root.iter():
-                if item.tag.endswith("}item") or item.tag == "item":
-                    manifest[item.attrib.get("id", "")] = {
-                        "href":       resolve_href(base, item.attrib.get("href", "")),
-                        "properties": item.attrib.get("properties", ""),
-                    }
-
-            cover_path = None
-            # EPUB3: properties=cover-image
-            for item in manifest.values():
-                if "cover-image" in item["properties"]:
-                    cover_path = item["href"]
-                    break
-            # EPUB2: meta name=cover -> manifest id
-            if not cover_path:
-                for el in md:
-                    if el.attrib.get("name") == "cover":
-                        item = manifest.get(el.attrib.get("content", ""))
-                        if item:
-                            cover_path = item["href"]
-                            break
+            meta, authors, cover_path = opf
 
             if cover_path:
                 meta["cover_path"] = cover_path
                 ext = Path(cover_path).suffix.lower()
-                if ext in IMAGE_EXTS:
+                if with_cover and ext in IMAGE_EXTS:
                     try:
                         cover_bytes = zf.read(cover_path)
                         cover_ext = "jpg" if ext in (".jpg", ".jpeg") else ext.lstrip(".")
@@ -223,14 +283,40 @@ def parse_epub(path):
                         pass
 
     except Exception as e:
+        if strict:
+            raise
+        if read_error(e) is not None:
+            raise read_error(e) from None
         print(f"  EPUB parse error: {e}", flush=True)
 
     return meta, authors, cover_bytes, cover_ext
 
 # ── M4B parsing ───────────────────────────────────────────────────────────────
 
-def parse_m4b(path):
-    """Returns (meta, cover_bytes, cover_ext, chapters)."""
+def m4b_chapters(path, source=None):
+    """Chapters from the moov atom, falling back to ffprobe only when the
+    native reader cannot decode them. When `path` is an in-memory moov buffer,
+    `source` must be a file object over the original M4B (for chapter-track
+    titles, which live in mdat)."""
+    try:
+        if isinstance(path, (str, os.PathLike)):
+            with open(path, "rb") as f:
+                chapters = read_chapters(read_moov(f), f)
+        else:
+            path.seek(0)
+            chapters = read_chapters(read_moov(path), source if source is not None else path)
+        if chapters is not None:
+            return chapters
+    except AtomError as e:
+        print(f"  native chapter read failed ({e}), falling back to ffprobe", flush=True)
+    return ffprobe_chapters(path)
+
+def parse_m4b(path, source=None, with_chapters=True, strict=False):
+    """Returns (meta, cover_bytes, cover_ext, chapters). `path` may also be a
+    seekable file object, e.g. a BytesIO holding the output of read_moov, in
+    which case `source` is the original file (see m4b_chapters). Without
+    `with_chapters` chapters are not read and come back empty. Errors are
+    handled as in parse_epub."""
     meta, cover_bytes, cover_ext, chapters = {}, None, None, []
     try:
         audio = MP4(path)
@@ -280,268 +366,542 @@ def parse_m4b(path):
             cover_bytes = bytes(img)
             cover_ext = "jpg" if img.imageformat == MP4Cover.FORMAT_JPEG else "png"
 
-        # Chapters via ffprobe
-        result = subprocess.run(
-            ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_chapters", path],
-            capture_output=True, text=True,
-        )
-        if result.returncode == 0:
-            for i, ch in enumerate(json.loads(result.stdout).get("chapters", []), 1):
-                chapters.append((
-                    i,
-                    ch.get("tags", {}).get("title"),
-                    int(float(ch["start_time"]) * 1000),
-                ))
+        if with_chapters:
+            chapters = m4b_chapters(path, source)
 
     except Exception as e:
+        if strict:
+            raise
+        if read_error(e) is not None:
+            raise read_error(e) from None
         print(f"  M4B parse error: {e}", flush=True)
 
     return meta, cover_bytes, cover_ext, chapters
 
-# ── Database inserts ──────────────────────────────────────────────────────────
-
-def insert_epub(conn, s3_key, meta, authors):
-    params = {
-        "s3_key":          s3_key,
-        "asin":            meta.get("asin"),
-        "isbn":            meta.get("isbn"),
-        "title":           meta.get("title") or Path(s3_key).stem,
-        "publisher":       meta.get("publisher"),
-        "published_date":  meta.get("published_date"),
-        "language":        meta.get("language"),
-        "description":     meta.get("description"),
-        "series":          meta.get("series"),
-        "series_position": meta.get("series_position"),
-        "identifier":      meta.get("identifier"),
-        "subject":         meta.get("subject"),
-        "cover_path":      meta.get("cover_path"),
-    }
-    with conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO epubs (
-                s3_key, asin, isbn, title, publisher, published_date,
-                language, description, series, series_position,
-                identifier, subject, cover_path
-            ) VALUES (
-                %(s3_key)s, %(asin)s, %(isbn)s, %(title)s, %(publisher)s,
-                %(published_date)s, %(language)s, %(description)s,
-                %(series)s, %(series_position)s, %(identifier)s,
-                %(subject)s, %(cover_path)s
-            )
-            ON CONFLICT (s3_key) DO UPDATE SET
-                asin            = EXCLUDED.asin,
-                isbn            = EXCLUDED.isbn,
-                title           = EXCLUDED.title,
-                publisher       = EXCLUDED.publisher,
-                published_date  = EXCLUDED.published_date,
-                language        = EXCLUDED.language,
-                description     = EXCLUDED.description,
-                series          = EXCLUDED.series,
-                series_position = EXCLUDED.series_position,
-                identifier      = EXCLUDED.identifier,
-                subject         = EXCLUDED.subject,
-                cover_path      = EXCLUDED.cover_path,
-                updated_at      = now()
-            RETURNING id
-        """, params)
-        epub_id = cur.fetchone()[0]
-        cur.execute("DELETE FROM epub_authors WHERE epub_id = %s", (epub_id,))
-        for name, role, position in authors:
-            cur.execute(
-                "INSERT INTO epub_authors (epub_id, author, role, position) VALUES (%s, %s, %s, %s)",
-                (epub_id, name, role, position),
-            )
-    conn.commit()
-    return epub_id
-
-def insert_m4b(conn, s3_key, meta, chapters):
-    params = {
-        "s3_key":       s3_key,
-        "asin":         meta.get("asin"),
-        "title":        meta.get("title") or Path(s3_key).stem,
-        "artist":       meta.get("artist"),
-        "narrator":     meta.get("narrator"),
-        "album":        meta.get("album"),
-        "date":         meta.get("date"),
-        "description":  meta.get("description"),
-        "comment":      meta.get("comment"),
-        "genre":        meta.get("genre"),
-        "copyright":    meta.get("copyright"),
-        "has_cover":    meta.get("has_cover", False),
-        "duration_s":   meta.get("duration_s"),
-        "bitrate_kbps": meta.get("bitrate_kbps"),
-        "sample_rate":  meta.get("sample_rate"),
-        "channels":     meta.get("channels"),
-    }
-    with conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO m4bs (
-                s3_key, asin, title, artist, narrator, album, date,
-                description, comment, genre, copyright, has_cover,
-                duration_s, bitrate_kbps, sample_rate, channels
-            ) VALUES (
-                %(s3_key)s, %(asin)s, %(title)s, %(artist)s, %(narrator)s,
-                %(album)s, %(date)s, %(description)s, %(comment)s,
-                %(genre)s, %(copyright)s, %(has_cover)s,
-                %(duration_s)s, %(bitrate_kbps)s, %(sample_rate)s, %(channels)s
-            )
-            ON CONFLICT (s3_key) DO UPDATE SET
-                asin         = EXCLUDED.asin,
-                title        = EXCLUDED.title,
-                artist       = EXCLUDED.artist,
-                narrator     = EXCLUDED.narrator,
-                album        = EXCLUDED.album,
-                date         = EXCLUDED.date,
-                description  = EXCLUDED.description,
-                comment      = EXCLUDED.comment,
-                genre        = EXCLUDED.genre,
-                copyright    = EXCLUDED.copyright,
-                has_cover    = EXCLUDED.has_cover,
-                duration_s   = EXCLUDED.duration_s,
-                bitrate_kbps = EXCLUDED.bitrate_kbps,
-                sample_rate  = EXCLUDED.sample_rate,
-                channels     = EXCLUDED.channels,
-                updated_at   = now()
-            RETURNING id
-        """, params)
-        m4b_id = cur.fetchone()[0]
-        cur.execute("DELETE FROM m4b_chapters WHERE m4b_id = %s", (m4b_id,))
-        for position, title, start_ms in chapters:
-            cur.execute(
-                "INSERT INTO m4b_chapters (m4b_id, position, title, start_ms) VALUES (%s, %s, %s, %s)",
-                (m4b_id, position, title, start_ms),
-            )
-    conn.commit()
-    return m4b_id
-
 # ── Cover images ──────────────────────────────────────────────────────────────
 
 def save_cover(data, kind, record_id, ext):
-    dest_dir = Path(COVERS_DIR) / kind
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    (dest_dir / f"{record_id}.{ext}").write_bytes(data)
+    """Store a cover in the content-addressed store and link it to the record
+    (see covers.py). Returns (digest, status)."""
+    return save_record_cover(
+        kind, record_id, data, ext, covers_dir=COVERS_DIR, derivatives=COVER_DERIVATIVES,
+    )
 
 # ── Worker ────────────────────────────────────────────────────────────────────
 
-def process_key(key):
-    """Download and parse one file. Each call creates its own S3 client so
-    this function is safe to run concurrently from multiple threads."""
-    s3   = make_s3()
+def download_ceiling():
+    """The most downloads that can run at once."""
+    return DOWNLOAD_LIMIT.maximum if DOWNLOAD_LIMIT is not None else DOWNLOAD_WORKERS
+
+def download_concurrency():
+    """Describe download concurrency for the start-of-run log line, and
+    export the current limit."""
+    if DOWNLOAD_LIMIT is None:
+        metrics.DOWNLOAD_CONCURRENCY.set(DOWNLOAD_WORKERS)
+        return f"{DOWNLOAD_WORKERS} download threads"
+    metrics.DOWNLOAD_CONCURRENCY.set(DOWNLOAD_LIMIT.limit)
+    return (
+        f"{DOWNLOAD_LIMIT.limit} adaptive downloads "
+        f"({DOWNLOAD_LIMIT.minimum}-{DOWNLOAD_LIMIT.maximum})"
+    )
+
+def gated(slots, fn):
+    """Run fn(item) inside one of `slots`' download slots."""
+    def run(item):
+        with slots.slot():
+            return fn(item)
+    return run
+
+def fetch_object(key, size=None):
+    """Download stage. Returns (key, kind, source, size, prefetched, digest)
+    for parse_fetched.
+
+    In download mode `source` is the object's bytes if its listed size is
+    under INMEMORY_MAX_BYTES, otherwise a temp file path; `prefetched` is
+    None and `digest` is (sha256 hex, size) of the bytes as they streamed
+    in. In range mode nothing touches local disk: `source` is None for EPUBs
+    (the parse process range-reads them itself) or the ftyp + moov bytes for
+    M4Bs, `prefetched` is (bytes_fetched, requests) spent here, and `digest`
+    is None since the whole object is never read. Safe to run from multiple
+    threads; they share one pooled S3 client.
+    """
+    s3   = shared_s3()
     kind = "epub" if key.lower().endswith(".epub") else "m4b"
+    if FETCH_MODE == "range":
+        if kind == "epub":
+            return (key, kind, None, size, (0, 0), None)
+        print(f"  [{kind}] reading moov of {Path(key).name}...", flush=True)
+        with S3RangeFile(s3, S3_BUCKET, key, size, block_size=RANGE_BLOCK_SIZE) as f:
+            header = read_moov(f)
+        return (key, kind, header, f.size, (f.bytes_fetched, f.requests), None)
+
+    if size is not None and size < INMEMORY_MAX_BYTES:
+        print(f"  [{kind}] fetching {Path(key).name} into memory...", flush=True)
+        sink = HashingWriter()
+        for chunk in s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].iter_chunks(HASH_CHUNK_SIZE):
+            sink.write(chunk)
+        FETCH_STATS.add(sink.size, size)
+        return (key, kind, sink.getvalue(), size, None, sink.digest())
+
     print(f"  [{kind}] downloading {Path(key).name}...", flush=True)
-    with tempfile.NamedTemporaryFile(suffix=f".{kind}", delete=True) as tmp:
-        s3.download_file(S3_BUCKET, key, tmp.name)
-        print(f"  [{kind}] parsing {Path(key).name}...", flush=True)
+    fd, path = tempfile.mkstemp(suffix=f".{kind}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            sink = HashingWriter(f)
+            s3.download_fileobj(S3_BUCKET, key, sink, Config=TRANSFER_CONFIG)
+    except Exception:
+        os.unlink(path)
+        raise
+    FETCH_STATS.add(sink.size, size if size is not None else sink.size)
+    return (key, kind, path, size, None, sink.digest())
+
+def parse_source(key, kind, source, size=None):
+    """Parse one fetched object; runs inside a parse process.
+
+    Takes only picklable inputs (a path or bytes) and returns only the compact
+    parse result plus (bytes_fetched, requests) for any range reads made
+    here, or None when nothing was fetched.
+    """
+    print(f"  [{kind}] parsing {Path(key).name}...", flush=True)
+    if FETCH_MODE != "range":
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        result = parse_epub(source) if kind == "epub" else parse_m4b(source)
+        return result, None
+    # Range mode: EPUBs are read in place; M4B chapter-track titles are read
+    # from mdat through the same lazily-fetching file. The moov atom is read
+    # here too when the download stage did not already fetch it.
+    with S3RangeFile(shared_s3(), S3_BUCKET, key, size, block_size=RANGE_BLOCK_SIZE) as f:
         if kind == "epub":
-            meta, authors, cover_bytes, cover_ext = parse_epub(tmp.name)
-            return (key, kind, meta, authors, cover_bytes, cover_ext)
+            result = parse_epub(f)
+        else:
+            result = parse_m4b(io.BytesIO(source if source is not None else read_moov(f)), f)
+    return result, (f.bytes_fetched, f.requests)
+
+def parse_fetched(key, kind, source, size=None, prefetched=None, digest=None, pool=None):
+    """Parse stage. Runs parse_source in `pool` (a ProcessPoolExecutor) or
+    inline, releases the temp file, and returns (key, kind, *parse result)
+    with the download's digest, if any, in the result's meta. A source
+    served from the parse cache or copied from a duplicate is passed through
+    unparsed."""
+    if isinstance(source, Cached):
+        return (key, kind, *source.result)
+    try:
+        if pool is not None:
+            result, fetched = pool.submit(parse_source, key, kind, source, size).result()
         else:
-            meta, cover_bytes, cover_ext, chapters = parse_m4b(tmp.name)
-            return (key, kind, meta, cover_bytes, cover_ext, chapters)
+            result, fetched = parse_source(key, kind, source, size)
+    except Exception as e:
+        observe_parse_error(e)
+        raise
+    finally:
+        if isinstance(source, str):
+            os.unlink(source)
+    account_fetch(kind, size, prefetched, fetched)
+    stamp_digest(result, digest)
+    return (key, kind, *result)
+
+def observe_parse_error(error):
+    """Range mode reads EPUBs and M4B chapter text in the parse stage, outside
+    the download slots, so throttling seen there is reported to the adaptive
+    download limit here."""
+    if DOWNLOAD_LIMIT is not None and is_throttle(error):
+        DOWNLOAD_LIMIT.observe(error=error)
+
+def stamp_digest(result, digest):
+    """Record a download's (sha256 hex, size) in a parse result's meta."""
+    if digest is not None:
+        meta = result[0]   # first for both parse_epub and parse_m4b
+        meta["content_hash"], meta["content_size"] = digest
+
+def account_fetch(kind, size, prefetched, fetched):
+    """Add a range-mode object's transfer to FETCH_STATS. `prefetched` and
+    `fetched` are (bytes, requests) spent in the download and parse stages;
+    prefetched is None in download mode, which accounts in fetch_object."""
+    if prefetched is None:
+        return
+    total = prefetched[0] + (fetched[0] if fetched else 0)
+    reqs  = prefetched[1] + (fetched[1] if fetched else 0)
+    FETCH_STATS.add(total, size, reqs)
+    pct = 100.0 * total / size if size else 0.0
+    print(
+        f"  [{kind}] fetched {total} of {size} bytes ({pct:.2f}%) in {reqs} requests",
+        flush=True,
+    )
 
-# ── Main ──────────────────────────────────────────────────────────────────────
+_parse_cache      = None
+_parse_cache_lock = threading.Lock()
+
+def parse_cache():
+    """The process's ParseCache, or None if PARSE_CACHE is not set. Opened
+    on first use so that parse processes never open it."""
+    global _parse_cache
+    if not PARSE_CACHE:
+        return None
+    with _parse_cache_lock:
+        if _parse_cache is None:
+            _parse_cache = ParseCache(PARSE_CACHE, PARSE_CACHE_MB * 1024 * 1024, PARSER_VERSION)
+        return _parse_cache
+
+def cached_item(key, etag, size=None):
+    """Download stage for a parse cache hit: (key, kind, Cached, size, None,
+    None) in place of fetch_object's result, or None on a miss."""
+    cache = parse_cache()
+    if cache is None:
+        return None
+    result = cache.get(key, etag)
+    metrics.PARSE_CACHE.labels("hit" if result is not None else "miss").inc()
+    if result is None:
+        return None
+    kind = "epub" if key.lower().endswith(".epub") else "m4b"
+    print(f"  [{kind}] {Path(key).name} served from parse cache", flush=True)
+    return (key, kind, Cached(result), size, None, None)
+
+def remember(item, etag):
+    """Keep a parse-stage result in the parse cache, if there is one."""
+    cache = parse_cache()
+    if cache is not None:
+        key, kind, *result = item
+        cache.put(key, etag, kind, result)
+
+def duplicate_result(kind, found):
+    """A parse result for an object byte-identical to the record `found`
+    ((record_id, s3_key, meta, children) from catalog.find_duplicate): the
+    original's meta and child rows, and its stored cover."""
+    record_id, _, meta, children = found
+    cover_bytes, cover_ext = record_cover(kind, record_id, COVERS_DIR) or (None, None)
+    if kind == "epub":
+        return (meta, children, cover_bytes, cover_ext)
+    return (meta, cover_bytes, cover_ext, children)
+
+_duplicate_conn      = None
+_duplicate_conn_lock = threading.Lock()
+
+def duplicate_of(key, kind, digest):
+    """With SKIP_DUPLICATES, Cached(parse result) copied from a live record
+    with the same bytes under another key, or None. Download threads share
+    one connection; a failed lookup just means the object is parsed."""
+    global _duplicate_conn
+    if not SKIP_DUPLICATES or digest is None:
+        return None
+    with _duplicate_conn_lock:
+        try:
+            if _duplicate_conn is None:
+                _duplicate_conn = connect_db()
+                _duplicate_conn.autocommit = True
+            found = find_duplicate(_duplicate_conn, kind, key, digest)
+        except psycopg2.Error as e:
+            print(f"  duplicate lookup failed for {key}: {e}", flush=True)
+            if _duplicate_conn is not None:
+                _duplicate_conn.close()
+                _duplicate_conn = None
+            return None
+    if found is None:
+        metrics.DUPLICATES.labels("unique").inc()
+        return None
+    metrics.DUPLICATES.labels("copied").inc()
+    print(f"  [{kind}] {Path(key).name} is a copy of {found[1]}; not parsing it", flush=True)
+    return Cached(duplicate_result(kind, found))
+
+def skip_duplicate(item):
+    """Download stage: swap a fetched object for its duplicate_of copy, if
+    it has one, releasing the temp file."""
+    key, kind, source, size, prefetched, digest = item
+    copied = duplicate_of(key, kind, digest)
+    if copied is None:
+        return item
+    if isinstance(source, str):
+        os.unlink(source)
+    return (key, kind, copied, size, prefetched, digest)
+
+def save_cover_item(item):
+    """Cover stage: item is (key, kind, record_id, cover_bytes, cover_ext).
+    Runs on the cover threads, off the main DB thread; Pillow releases the
+    GIL while resizing and encoding, so the threads work in parallel."""
+    _, kind, record_id, cover_bytes, cover_ext = item
+    digest, status = save_cover(cover_bytes, kind, record_id, cover_ext)
+    print(f"  cover {status} -> {kind}/{record_id}.{cover_ext} ({digest[:12]})", flush=True)
+
+def result_record(item, etag):
+    """Turn a parse-stage result into (record, cover) for the batch writer;
+    cover is (cover_bytes, cover_ext) or None."""
+    key, kind, *rest = item
+    if kind == "epub":
+        meta, authors, cover_bytes, cover_ext = rest
+        record = (kind, key, etag, meta, authors)
+    else:
+        meta, cover_bytes, cover_ext, chapters = rest
+        record = (kind, key, etag, meta, chapters)
+    return record, (cover_bytes, cover_ext) if cover_bytes else None
+
+def flush_writer(writer, counts, cover_q):
+    """Flush the batch writer, hand covers for the written records to the
+    cover stage and record failed writes on their jobs."""
+    batch = len(writer)
+    if batch:
+        with metrics.timing("write"):
+            written, failed = writer.flush()
+    else:
+        written, failed = [], []
+    if batch:
+        print(f"  wrote {len(written)}/{batch} records in one flush", flush=True)
+    for (kind, key, *_), record_id, cover in written:
+        if cover:
+            cover_q.put((key, kind, record_id, *cover))
+        counts[kind] += 1
+        metrics.loaded(kind)
+    for (kind, key, etag, *_), e in failed:
+        print(f"  ERROR writing {key}: {e}", flush=True)
+        print(f"  {describe_failure(fail(writer.conn, LOADER_ID, key, etag, f'write: {e}'))}", flush=True)
+        counts["error"] += 1
+        metrics.failed(kind)
+
+def print_job_summary(jobs):
+    """Print {state: count} from jobs.state_counts."""
+    print(
+        "  jobs: " + ", ".join(
+            f"{jobs.get(state, 0)} {state}"
+            for state in ("pending", "running", "failed", "quarantined", "done")
+        ),
+        flush=True,
+    )
 
-def run_once():
-    conn = connect_db()
-    s3 = make_s3()
+# ── Main ──────────────────────────────────────────────────────────────────────
 
+def listing_row(obj):
+    """(key, kind, etag, size, last_modified) for a list_objects_v2 entry,
+    or None if it is not an EPUB or M4B."""
+    key = obj["Key"]
+    lower = key.lower()
+    if not (lower.endswith(".epub") or lower.endswith(".m4b")):
+        return None
+    kind = "epub" if lower.endswith(".epub") else "m4b"
+    return (key, kind, obj["ETag"].strip('"'), obj["Size"], obj["LastModified"])
+
+def list_bucket(s3):
     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Listing bucket...", flush=True)
     paginator = s3.get_paginator("list_objects_v2")
-    objects = []
-    for page in paginator.paginate(Bucket=S3_BUCKET):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-            lower = key.lower()
-            if lower.endswith(".epub") or lower.endswith(".m4b"):
-                objects.append(key)
-
-    epub_total = sum(1 for k in objects if k.lower().endswith(".epub"))
-    m4b_total  = sum(1 for k in objects if k.lower().endswith(".m4b"))
-    total = len(objects)
-
-    with conn.cursor() as cur:
-        cur.execute("SELECT count(*) FROM epubs")
-        db_epubs = cur.fetchone()[0]
-        cur.execute("SELECT count(*) FROM m4bs")
-        db_m4bs = cur.fetchone()[0]
-
-    # Pre-filter already-loaded keys in the main thread before spawning workers
-    keys_to_process = []
-    for key in objects:
-        kind  = "epub" if key.lower().endswith(".epub") else "m4b"
-        table = "epubs" if kind == "epub" else "m4bs"
-        with conn.cursor() as cur:
-            cur.execute(f"SELECT 1 FROM {table} WHERE s3_key = %s", (key,))
-            if not cur.fetchone():
-                keys_to_process.append(key)
-
-    new_count = len(keys_to_process)
+    return [
+        row
+        for page in paginator.paginate(Bucket=S3_BUCKET)
+        for row in map(listing_row, page.get("Contents", []))
+        if row
+    ]
+
+def print_listing_summary(listing, to_load, gone_count, db_counts):
+    epub_total = sum(1 for row in listing if row[1] == "epub")
+    m4b_total  = sum(1 for row in listing if row[1] == "m4b")
+    changed_count = sum(1 for *_, known in to_load if known)
+    db_epubs, db_m4bs = db_counts
     print(
         f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
-        f"Bucket: {total} objects ({epub_total} epubs, {m4b_total} m4bs). "
+        f"Bucket: {len(listing)} objects ({epub_total} epubs, {m4b_total} m4bs). "
         f"DB: {db_epubs} epubs, {db_m4bs} m4bs. "
-        f"{new_count} new.",
+        f"{len(to_load) - changed_count} new, {changed_count} changed, {gone_count} gone.",
         flush=True,
     )
 
+def print_run_summary(counts):
+    print(
+        f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+        f"Run complete: {counts['epub']} epubs, {counts['m4b']} m4bs, "
+        f"{counts['error']} errors.",
+        flush=True,
+    )
+    print(f"  transfer: {FETCH_STATS.summary()}", flush=True)
+
+def head_object(key):
+    """(etag, size) of an object, for notifications that omit them."""
+    head = shared_s3().head_object(Bucket=S3_BUCKET, Key=key)
+    return head["ETag"].strip('"'), head["ContentLength"]
+
+def run_once(reconcile=True):
+    """One pass: list the bucket and sync the manifest if `reconcile` and
+    this replica is the lister, then load every claimable job."""
+    conn = connect_db()
+    s3 = shared_s3()
+    connections_before = connection_stats(s3)
+
+    if not reconcile:
+        print(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Claiming pending keys (next full listing at the reconcile).",
+            flush=True,
+        )
+    elif LISTER.held():
+        with metrics.timing("list"):
+            listing = list_bucket(s3)
+            to_load, gone_count = sync_manifest(conn, listing)
+        with conn.cursor() as cur:
+            cur.execute(LIVE_COUNTS)
+            db_counts = cur.fetchone()
+        print_listing_summary(listing, to_load, gone_count, db_counts)
+    else:
+        print(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Another replica is listing the bucket; claiming pending keys only.",
+            flush=True,
+        )
+    print_job_summary(state_counts(conn))
+
+    new_count = pending_count(conn)
     if not new_count:
         conn.close()
         return
 
-    print(f"Downloading {new_count} files with {DOWNLOAD_WORKERS} workers.", flush=True)
-
-    epub_count = m4b_count = error_count = 0
+    print(
+        f"Loading up to {new_count} files as {LOADER_ID}: {download_concurrency()}, "
+        f"{PARSE_WORKERS} parse processes, {COVER_WORKERS} cover threads, queue depth {QUEUE_DEPTH} "
+        f"(fetch mode: {FETCH_MODE}).",
+        flush=True,
+    )
+    FETCH_STATS.reset()
+
+    # list -> download -> parse -> write (this thread) -> cover save.
+    # Parsing is CPU-bound, so it runs in a process pool; each parse-stage
+    # thread just dispatches one item at a time to it. Workers are spawned
+    # rather than forked because this process already runs stage threads.
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+    )
+    # In adaptive mode the stage runs download_ceiling() threads, of which
+    # DOWNLOAD_LIMIT.limit hold a download slot at a time.
+    download = metrics.timed("download", lambda item: skip_duplicate(fetch_object(*item)))
+    if DOWNLOAD_LIMIT is not None:
+        DOWNLOAD_LIMIT.reset_window()
+        download = gated(Slots(DOWNLOAD_LIMIT), download)
+    # Parse cache hits skip the download (and its slot) altogether.
+    etags, from_cache = {}, set()
+    fetch = download
+    def download(item):
+        key, size = item
+        hit = cached_item(key, etags[key], size)
+        if hit is None:
+            return fetch(item)
+        from_cache.add(key)
+        return hit
+    download_q = bounded(QUEUE_DEPTH)
+    parse_q    = bounded(QUEUE_DEPTH)
+    write_q    = bounded(QUEUE_DEPTH)
+    cover_q    = bounded(QUEUE_DEPTH)
+    stages = [
+        Stage("download", download, download_ceiling(), download_q, parse_q),
+        Stage("parse", metrics.timed("parse", lambda item: parse_fetched(*item, pool=pool)),
+              PARSE_WORKERS, parse_q, write_q),
+        Stage("cover", metrics.timed("cover", save_cover_item), COVER_WORKERS, cover_q),
+    ]
+    metrics.watch_queues(download=download_q, parse=parse_q, write=write_q, cover=cover_q)
+    # Keys are claimed lazily, CLAIM_BATCH at a time, as the download queue
+    # has room; other replicas claim the rest.
+    claim_conn = connect_db()
+    def claimed():
+        for key, size, etag, _, reclaimed in iter_claims(claim_conn, LOADER_ID, CLAIM_BATCH, LEASE_SECONDS):
+            if reclaimed:
+                print(f"  reclaimed {key} from an expired lease", flush=True)
+            etags[key] = etag
+            yield key, size
+    keeper = LeaseKeeper(connect_db, LOADER_ID, LEASE_SECONDS).start()
+
+    for stage in stages:
+        stage.start()
+    feed(download_q, claimed())
+
+    counts = {"epub": 0, "m4b": 0, "error": 0}
     completed = 0
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
-        future_to_key = {executor.submit(process_key, key): key for key in keys_to_process}
-        for future in concurrent.futures.as_completed(future_to_key):
-            key = future_to_key[future]
+    writer = BatchWriter(conn, WRITE_BATCH_SIZE, WRITE_BATCH_MS)
+    while True:
+        try:
+            item = write_q.get(timeout=writer.time_left())
+        except queue.Empty:
+            item = None
+        if item is DONE:
+            break
+        if item is not None:
             completed += 1
-            kind = "epub" if key.lower().endswith(".epub") else "m4b"
-            print(f"[{completed}/{new_count}] [{kind}] {key}", flush=True)
-            try:
-                result = future.result()
-                _, kind, *rest = result
-                if kind == "epub":
-                    meta, authors, cover_bytes, cover_ext = rest
-                    record_id = insert_epub(conn, key, meta, authors)
-                    if cover_bytes:
-                        save_cover(cover_bytes, "epub", record_id, cover_ext)
-                        print(f"  cover saved -> epub/{record_id}.{cover_ext}", flush=True)
-                    epub_count += 1
-                else:
-                    meta, cover_bytes, cover_ext, chapters = rest
-                    record_id = insert_m4b(conn, key, meta, chapters)
-                    if cover_bytes:
-                        save_cover(cover_bytes, "m4b", record_id, cover_ext)
-                        print(f"  cover saved -> m4b/{record_id}.{cover_ext}", flush=True)
-                    m4b_count += 1
-                print(f"  done -> id={record_id}", flush=True)
-            except Exception as e:
-                print(f"  ERROR: {e}", flush=True)
-                error_count += 1
-                conn.rollback()
+            if isinstance(item, Failed):
+                kind = "epub" if item.key.lower().endswith(".epub") else "m4b"
+                print(f"[{completed}/{new_count}] [{kind}] {item.key}", flush=True)
+                print(f"  ERROR in {item.stage}: {item.error}", flush=True)
+                job = fail(conn, LOADER_ID, item.key, etags[item.key], f"{item.stage}: {item.error}")
+                print(f"  {describe_failure(job)}", flush=True)
+                counts["error"] += 1
+                metrics.failed(kind)
+            else:
+                key, kind = item[:2]
+                print(f"[{completed}/{new_count}] [{kind}] {key}", flush=True)
+                writer.add(*result_record(item, etags[key]))
+                if key not in from_cache:
+                    remember(item, etags[key])
+        if writer.due():
+            flush_writer(writer, counts, cover_q)
+    flush_writer(writer, counts, cover_q)
+    cover_q.put(DONE)
+    for stage in stages:
+        stage.join()
+    pool.shutdown()
+    keeper.stop()
+    release(conn, LOADER_ID)
+    claim_conn.close()
 
     conn.close()
+    print_run_summary(counts)
+    opened, requests = (a - b for a, b in zip(connection_stats(s3), connections_before))
     print(
-        f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] "
-        f"Run complete: {epub_count} epubs, {m4b_count} m4bs, {error_count} errors.",
+        f"  s3 connections: {opened} opened, {max(requests - opened, 0)} reused "
+        f"over {requests} requests",
         flush=True,
     )
 
 
 def main():
     wait_for_db()
+    conn = connect_db()
     if not SKIP_SCHEMA:
-        conn = connect_db()
         apply_schema(conn)
-        conn.close()
+    resumed = release(conn, LOADER_ID)
+    if resumed:
+        print(f"Resuming {resumed} unfinished jobs left by a previous {LOADER_ID}.", flush=True)
+    conn.close()
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        print(f"Serving metrics on port {METRICS_PORT}.", flush=True)
+
+    if ENGINE == "async":
+        import asyncio
+        import async_engine
+        run_pass = lambda reconcile: asyncio.run(
+            async_engine.run_once(sys.modules[__name__], reconcile)
+        )
+    else:
+        run_pass = run_once
 
-    print(f"Polling every {POLL_INTERVAL}s. Set POLL_INTERVAL to change.", flush=True)
+    def run(reconcile):
+        with metrics.POLL_SECONDS.time():
+            run_pass(reconcile)
+
+    if not NOTIFY_PORT:
+        print(f"Polling every {POLL_INTERVAL}s ({ENGINE} engine). Set POLL_INTERVAL to change.", flush=True)
+        while True:
+            run(True)
+            time.sleep(POLL_INTERVAL)
+
+    receiver = Receiver(NOTIFY_PORT, connect_db, head_object, S3_BUCKET, NOTIFY_TOKEN).start()
+    print(
+        f"Receiving bucket notifications on port {receiver.port}; claiming every "
+        f"{POLL_INTERVAL}s, reconciling every {RECONCILE_INTERVAL}s ({ENGINE} engine).",
+        flush=True,
+    )
+    # Notifications arriving during a pass set `wake` again, so the next pass
+    # starts as soon as this one ends.
+    next_reconcile = time.monotonic()
     while True:
-        run_once()
-        time.sleep(POLL_INTERVAL)
+        reconcile = time.monotonic() >= next_reconcile
+        if reconcile:
+            next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+        receiver.wake.clear()
+        run(reconcile)
+        receiver.wake.wait(max(0.0, min(POLL_INTERVAL, next_reconcile - time.monotonic())))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+"""
+Prometheus metrics for the loader.
+
+With METRICS_PORT set (the default), the loader serves these at
+http://<host>:METRICS_PORT/metrics in the Prometheus text format (under
+docker compose, port 8000 in the container, published on METRICS_HOST_PORT):
+
+  vibelib_loader_stage_seconds{stage}       histogram: time per item (per
+                                            batch for write, per pass for
+                                            list) in list, download, parse,
+                                            write and cover
+  vibelib_loader_stage_in_flight{stage}     gauge: items a stage is working
+                                            on right now
+  vibelib_loader_queue_depth{queue}         gauge: items waiting between stages
+  vibelib_loader_download_concurrency       gauge: downloads allowed at once
+                                            (moves with ADAPTIVE_DOWNLOADS)
+  vibelib_loader_downloaded_bytes_total     counter: bytes fetched from S3
+  vibelib_loader_objects_total{kind,result} counter: loaded and error objects
+  vibelib_loader_parse_cache_total{result}  counter: parse cache hits and misses
+  vibelib_loader_duplicates_total{result}   counter: SKIP_DUPLICATES lookups,
+                                            copied or unique
+  vibelib_loader_poll_seconds               histogram: duration of whole passes
+
+Comparing stage times and in-flight counts shows where a run is bound: a
+download stage with every worker in flight and a full download queue is
+waiting on S3, a busy parse stage on CPU, and slow write batches on Postgres.
+
+Parse times are measured in the thread or task that hands work to the
+process pool, so they include time waiting for a free process.
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+STAGE_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+POLL_BUCKETS  = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+STAGE_SECONDS = Histogram(
+    "vibelib_loader_stage_seconds", "Time spent per item in each loader stage",
+    ["stage"], buckets=STAGE_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "vibelib_loader_stage_in_flight", "Items a loader stage is working on", ["stage"],
+)
+QUEUE_DEPTH = Gauge(
+    "vibelib_loader_queue_depth", "Items waiting in a queue between loader stages", ["queue"],
+)
+DOWNLOAD_CONCURRENCY = Gauge(
+    "vibelib_loader_download_concurrency", "Downloads the loader allows at once",
+)
+DOWNLOADED_BYTES = Counter(
+    "vibelib_loader_downloaded_bytes", "Bytes fetched from S3",
+)
+OBJECTS = Counter(
+    "vibelib_loader_objects", "Objects processed by the loader", ["kind", "result"],
+)
+PARSE_CACHE = Counter(
+    "vibelib_loader_parse_cache", "Parse cache lookups", ["result"],
+)
+DUPLICATES = Counter(
+    "vibelib_loader_duplicates", "Lookups of objects already loaded under another key", ["result"],
+)
+POLL_SECONDS = Histogram(
+    "vibelib_loader_poll_seconds", "Duration of a loader pass", buckets=POLL_BUCKETS,
+)
+
+
+def serve(port):
+    """Start the metrics HTTP server on a daemon thread."""
+    start_http_server(port)
+
+
+@contextmanager
+def timing(stage):
+    """Count one item in flight in `stage` and observe its duration."""
+    IN_FLIGHT.labels(stage).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+        IN_FLIGHT.labels(stage).dec()
+
+
+def timed(stage, fn):
+    """Wrap a stage function so each call is measured by timing()."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timing(stage):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def timed_async(stage, fn):
+    """timed() for a coroutine function."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with timing(stage):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+def watch_queues(**queues):
+    """Report the depth of each named queue (queue.Queue or asyncio.Queue)
+    on every scrape. Called once per pass with that pass's queues."""
+    for name, q in queues.items():
+        QUEUE_DEPTH.labels(name).set_function(q.qsize)
+
+
+def downloaded(nbytes):
+    DOWNLOADED_BYTES.inc(nbytes)
+
+
+def loaded(kind):
+    OBJECTS.labels(kind, "loaded").inc()
+
+
+def failed(kind):
+    OBJECTS.labels(kind, "error").inc()
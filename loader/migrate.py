@@ -0,0 +1,146 @@
+"""
+Versioned schema migrations.
+
+An empty database gets the current schema from schema.sql in one go. A
+database created earlier is brought up to date by the numbered files in
+MIGRATIONS_DIR (NNN_name.sql), each applied once, in order, in its own
+transaction that also records it in schema_version. The one-off steps
+(column backfills, NOT NULL changes, index swaps) therefore run once per
+database, not on every start of every replica.
+
+A database whose catalog tables predate schema_version gets every
+migration; they are written to be harmless on a schema that already has
+some of their changes. Replicas starting together serialise on
+MIGRATE_LOCK, so only the first applies anything; the others find the
+database current and return at once.
+
+The loader migrates on start unless SKIP_SCHEMA is set. To migrate ahead of
+a deploy, or check what is applied:
+
+  python migrate.py [--status]
+"""
+
+import argparse
+import os
+import re
+from pathlib import Path
+
+import psycopg2
+
+PG_HOST     = os.environ.get("POSTGRES_HOST", "db")
+PG_PORT     = int(os.environ.get("POSTGRES_PORT", "5432"))
+PG_DB       = os.environ.get("POSTGRES_DB", "vibelib")
+PG_USER     = os.environ.get("POSTGRES_USER", "vibelib")
+PG_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+
+SCHEMA_FILE    = os.environ.get("SCHEMA_FILE", "/app/schema.sql")
+MIGRATIONS_DIR = os.environ.get("MIGRATIONS_DIR", "/app/migrations")
+
+# Session advisory lock held while migrating.
+MIGRATE_LOCK = 0x76696D67  # "vimg"
+
+MIGRATION_FILE = re.compile(r"(\d+)_(\w+)\.sql")
+
+VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version     INT         PRIMARY KEY,
+        name        TEXT        NOT NULL,
+        applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+CATALOG_EXISTS = "SELECT to_regclass('epubs') IS NOT NULL"
+
+APPLIED = "SELECT version FROM schema_version"
+
+RECORD = "INSERT INTO schema_version (version, name) VALUES (%s, %s)"
+
+
+def migrations(migrations_dir=MIGRATIONS_DIR):
+    """[(version, name, path)] of the migration files, in version order."""
+    found = []
+    for path in Path(migrations_dir).iterdir():
+        match = MIGRATION_FILE.fullmatch(path.name)
+        if match:
+            found.append((int(match[1]), match[2], path))
+    found.sort()
+    versions = [version for version, _, _ in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions in {migrations_dir}")
+    return found
+
+
+def applied_versions(conn):
+    """The migration versions recorded in schema_version (empty if it does
+    not exist yet)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return set()
+        cur.execute(APPLIED)
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def migrate(conn, schema_file=SCHEMA_FILE, migrations_dir=MIGRATIONS_DIR):
+    """Bring the database up to date. Returns the names of the migrations
+    applied ("schema" for a fresh schema.sql), empty if it was current."""
+    pending = migrations(migrations_dir)
+    done = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATE_LOCK,))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(VERSION_TABLE)
+            cur.execute(APPLIED)
+            applied = {row[0] for row in cur.fetchall()}
+            cur.execute(CATALOG_EXISTS)
+            fresh = not applied and not cur.fetchone()[0]
+            if fresh:
+                # schema.sql already holds every migration's changes.
+                cur.execute(Path(schema_file).read_text())
+                for version, name, _ in pending:
+                    cur.execute(RECORD, (version, name))
+                done.append("schema")
+        conn.commit()
+        for version, name, path in pending:
+            if fresh or version in applied:
+                continue
+            with conn.cursor() as cur:
+                cur.execute(path.read_text())
+                cur.execute(RECORD, (version, name))
+            conn.commit()
+            done.append(f"{version:03d}_{name}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATE_LOCK,))
+        conn.commit()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument("--status", action="store_true", help="List migrations without applying any")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASSWORD,
+    )
+    try:
+        if args.status:
+            applied = applied_versions(conn)
+            for version, name, _ in migrations():
+                print(f"{version:03d}_{name}: {'applied' if version in applied else 'pending'}")
+            return
+        done = migrate(conn)
+    finally:
+        conn.close()
+    print(f"Applied: {', '.join(done)}." if done else "Schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
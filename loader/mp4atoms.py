@@ -0,0 +1,112 @@
+"""
+Minimal MP4/M4B atom (box) reader.
+
+Walks the top-level atoms of a seekable file object reading only their
+headers, so that against an S3RangeFile the whole walk costs a handful of
+small Range GETs no matter how large the `mdat` payload is. read_moov then
+pulls just the `moov` atom, which carries the tags, cover art, stream info
+and chapter index.
+"""
+
+import struct
+
+# Top-level atoms a parser needs alongside moov to recognise the file.
+_KEEP_WITH_MOOV = (b"ftyp",)
+
+
+class AtomError(Exception):
+    pass
+
+
+def iter_atoms(f, start=0, end=None):
+    """Yield (type, offset, size, header_size) for each atom in [start, end).
+
+    Only the 8- or 16-byte headers are read; payloads are skipped by seeking.
+    A size of 0 means the atom runs to `end`.
+    """
+    if end is None:
+        end = f.seek(0, 2)
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            ext = f.read(8)
+            if len(ext) < 8:
+                raise AtomError(f"truncated 64-bit atom header at {pos}")
+            size = struct.unpack(">Q", ext)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise AtomError(f"invalid atom size {size} for {kind!r} at {pos}")
+        yield kind, pos, size, header_size
+        pos += size
+
+
+def read_moov(f):
+    """Return the raw bytes of ftyp + moov from a seekable MP4 file object.
+
+    moov is found wherever it sits, including after mdat. The result is a
+    well-formed MP4 header that mutagen can parse from a BytesIO; sample
+    offsets inside it still refer to the original file.
+    """
+    kept, moov = [], None
+    for kind, offset, size, _ in iter_atoms(f):
+        if kind == b"moov":
+            f.seek(offset)
+            moov = f.read(size)
+            if len(moov) < size:
+                raise AtomError("truncated moov atom")
+            break
+        if kind in _KEEP_WITH_MOOV:
+            f.seek(offset)
+            kept.append(f.read(size))
+    if moov is None:
+        raise AtomError("no moov atom found")
+    return b"".join(kept) + moov
+
+
+# ── In-memory box access ──────────────────────────────────────────────────────
+
+def iter_boxes(buf, start=0, end=None):
+    """Yield (type, payload_start, payload_end) for each box in buf[start:end]."""
+    if end is None:
+        end = len(buf)
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise AtomError(f"truncated 64-bit box header at {pos}")
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise AtomError(f"invalid box size {size} for {kind!r} at {pos}")
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+
+def find_box(buf, path, start=0, end=None):
+    """Return (payload_start, payload_end) of the first box along `path`
+    (a sequence of types such as (b"moov", b"udta", b"chpl")), or None."""
+    for kind, p_start, p_end in iter_boxes(buf, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return p_start, p_end
+            found = find_box(buf, path[1:], p_start, p_end)
+            if found:
+                return found
+    return None
+
+
+def find_boxes(buf, kind, start=0, end=None):
+    """Return (payload_start, payload_end) for every `kind` box in buf[start:end]."""
+    return [(s, e) for k, s, e in iter_boxes(buf, start, end) if k == kind]
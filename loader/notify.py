@@ -0,0 +1,226 @@
+"""
+Bucket event notifications for the loader.
+
+Without notifications the loader lists the whole bucket every POLL_INTERVAL,
+so a new upload waits up to one interval and every poll costs a full
+listing. With NOTIFY_PORT set, the loader also runs a Receiver: a small HTTP
+server that accepts S3-style event notifications (as posted by a MinIO
+webhook target, or relayed from SQS/SNS) and applies each event to the
+s3_objects manifest at once (see catalog.apply_events). ObjectCreated events
+make the key's job pending; ObjectRemoved events mark it gone. The receiver
+then wakes the main loop, which claims and loads pending jobs without
+listing. Between notifications the loader still claims every POLL_INTERVAL,
+which costs a query rather than a listing, and a full listing runs every
+RECONCILE_INTERVAL as a safety net for dropped, reordered or unsent events.
+
+A notification body is JSON with a "Records" list:
+
+  {"Records": [{"eventName": "s3:ObjectCreated:Put",
+                "eventTime": "2026-01-01T00:00:00.000Z",
+                "s3": {"bucket": {"name": "books"},
+                       "object": {"key": "a%20book.epub", "size": 1234,
+                                  "eTag": "d41d8cd98f00b204e9800998ecf8427e"}}}]}
+
+Keys arrive URL-encoded. Records for other buckets or for files that are
+not EPUBs or M4Bs are ignored.
+
+docker-compose.yml leaves the receiver off. docker-compose.notify.yml turns
+it on, on port 8080, and publishes it on NOTIFY_HOST_PORT (default 8080):
+
+  docker compose -f docker-compose.yml -f docker-compose.notify.yml up
+
+Run this module directly to post a notification, standing in for the
+object store when testing a receiver:
+
+  python notify.py post URL KEY [--size N] [--etag E] [--removed] [--token T]
+"""
+
+import argparse
+import json
+import os
+import threading
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote_plus
+
+import psycopg2
+
+from catalog import apply_events
+
+# ── Payloads ──────────────────────────────────────────────────────────────────
+
+def _event_time(value):
+    if not value:
+        return datetime.now(timezone.utc)
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return datetime.now(timezone.utc)
+
+def parse_events(payload, bucket=None):
+    """Turn a notification body into (created, removed).
+
+    created is {s3_key: (s3_key, kind, etag, size, last_modified)}, in the
+    shape of a listing row; etag and size are None when the record lacks
+    them. removed is a set of keys. When a key has several records, the
+    last one wins. Records for buckets other than `bucket` are skipped.
+    """
+    created, removed = {}, set()
+    for record in payload.get("Records") or []:
+        name = record.get("eventName", "")
+        s3 = record.get("s3") or {}
+        if bucket and (s3.get("bucket") or {}).get("name") not in (None, bucket):
+            continue
+        obj = s3.get("object") or {}
+        key = unquote_plus(obj.get("key", ""))
+        lower = key.lower()
+        if not (lower.endswith(".epub") or lower.endswith(".m4b")):
+            continue
+        kind = "epub" if lower.endswith(".epub") else "m4b"
+        if "ObjectRemoved" in name:
+            created.pop(key, None)
+            removed.add(key)
+        elif "ObjectCreated" in name:
+            removed.discard(key)
+            etag = (obj.get("eTag") or obj.get("etag") or "").strip('"') or None
+            created[key] = (key, kind, etag, obj.get("size"), _event_time(record.get("eventTime")))
+    return created, removed
+
+def payload(key, etag=None, size=None, removed=False, bucket=None):
+    """A one-record notification body, as an object store would post it."""
+    obj = {"key": quote(key)}
+    if not removed:
+        obj.update({"eTag": etag, "size": size})
+    return {"Records": [{
+        "eventName": "s3:ObjectRemoved:Delete" if removed else "s3:ObjectCreated:Put",
+        "eventTime": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "s3": {"bucket": {"name": bucket} if bucket else {}, "object": obj},
+    }]}
+
+# ── Receiver ──────────────────────────────────────────────────────────────────
+
+class Receiver:
+    """HTTP server on `port` that applies bucket notifications to the
+    manifest and sets `wake` so the main loop loads them without waiting for
+    its next poll.
+
+    `connect` opens a database connection (one per request). `head(key)`
+    returns (etag, size) for created records that lack them. If `token` is
+    set, requests must carry "Authorization: Bearer <token>", which is how a
+    MinIO webhook target authenticates.
+    """
+
+    def __init__(self, port, connect, head, bucket, token=None):
+        self.connect = connect
+        self.head    = head
+        self.bucket  = bucket
+        self.token   = token
+        self.wake    = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # Liveness check.
+                self._reply(200, b"ok\n")
+
+            def do_POST(self):
+                if receiver.token and self.headers.get("Authorization") != f"Bearer {receiver.token}":
+                    self._reply(401, b"unauthorized\n")
+                    return
+                try:
+                    body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                    loaded = receiver.receive(json.loads(body or b"{}"))
+                except (ValueError, AttributeError) as e:
+                    self._reply(400, f"bad notification: {e}\n".encode())
+                    return
+                except Exception as e:
+                    # Non-2xx makes the sender retry; the reconcile covers the rest.
+                    print(f"  ERROR applying notification: {e}", flush=True)
+                    self._reply(503, b"error\n")
+                    return
+                self._reply(200, f"{loaded} keys queued\n".encode())
+
+            def _reply(self, status, body):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="notify", daemon=True,
+        )
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def receive(self, body):
+        """Apply one notification body. Returns how many keys were made
+        pending; wakes the main loop if any were."""
+        created, removed = parse_events(body, self.bucket)
+        if not created and not removed:
+            return 0
+        rows = []
+        for key, kind, etag, size, last_modified in created.values():
+            if etag is None or size is None:
+                etag, size = self.head(key)
+            rows.append((key, kind, etag, size, last_modified))
+        conn = self.connect()
+        try:
+            pending = apply_events(conn, rows, removed)
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        for key in sorted(removed):
+            print(f"  notification: {key} removed", flush=True)
+        for key in pending:
+            print(f"  notification: {key} queued", flush=True)
+        if pending:
+            self.wake.set()
+        return len(pending)
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Post a bucket notification to a loader.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    post = sub.add_parser("post", help="Post an ObjectCreated or ObjectRemoved event")
+    post.add_argument("url", help="Receiver URL, e.g. http://localhost:8080/")
+    post.add_argument("key", help="S3 key of the object")
+    post.add_argument("--etag", help="Object ETag (the receiver HEADs the object if omitted)")
+    post.add_argument("--size", type=int, help="Object size in bytes")
+    post.add_argument("--removed", action="store_true", help="Post an ObjectRemoved event")
+    post.add_argument("--bucket", default=os.environ.get("OBJECT_STORE_BUCKET_NAME"),
+                      help="Bucket name in the event")
+    post.add_argument("--token", help="Bearer token the receiver expects")
+    args = parser.parse_args()
+
+    body = json.dumps(payload(args.key, args.etag, args.size, args.removed, args.bucket)).encode()
+    request = urllib.request.Request(args.url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    if args.token:
+        request.add_header("Authorization", f"Bearer {args.token}")
+    with urllib.request.urlopen(request) as response:
+        print(response.status, response.read().decode().strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+OPF package document extraction for EPUBs.
+
+read_opf makes one event-driven pass over the raw OPF bytes with expat (no
+decode to str, no element tree) and collects everything parse_epub needs as
+it goes: the first dc:title/publisher/date/language/description/subject,
+every dc:creator and dc:identifier, Calibre series metas, the manifest and
+the EPUB2 cover meta. Character data is only collected inside the elements
+that are kept, so the whitespace between manifest items costs nothing, and
+once the metadata element closes only manifest items are looked at.
+
+It returns exactly what the ElementTree walk the loader used originally
+returns, including its quirks:
+
+  - metadata is the first opf:metadata child of the package, else the first
+    un-namespaced metadata child; other elements named metadata are ignored;
+  - an element's text is what comes before its first child element (comments
+    and processing instructions do not end it), and stripped text may be "";
+  - opf:meta series tags are applied before un-namespaced meta tags, so the
+    latter win;
+  - manifest items are collected from anywhere in the document;
+  - the OPF is parsed as UTF-8 whatever its XML declaration says, and one
+    that is not valid UTF-8 is parsed with the bad bytes replaced.
+
+read_opf_tree is that original walk, kept as the reference bench/bench_opf.py
+checks read_opf against. Both return (meta, authors, cover_path), or None if
+the package has no metadata, and raise on malformed XML.
+"""
+
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+OPF_NS = {
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc":  "http://purl.org/dc/elements/1.1/",
+}
+
+# Element and attribute names as expat reports them with "}" as the
+# namespace separator: "<uri>}<local name>".
+DC  = OPF_NS["dc"] + "}"
+OPF = OPF_NS["opf"] + "}"
+
+DC_FIELDS = {
+    DC + "title":       "title",
+    DC + "publisher":   "publisher",
+    DC + "date":        "published_date",
+    DC + "language":    "language",
+    DC + "description": "description",
+    DC + "subject":     "subject",
+}
+OPF_METADATA  = OPF + "metadata"
+OPF_META      = OPF + "meta"
+OPF_ROLE      = OPF + "role"
+OPF_SCHEME    = OPF + "scheme"
+DC_CREATOR    = DC + "creator"
+DC_IDENTIFIER = DC + "identifier"
+SERIES_NAMES  = ("calibre:series", "calibre:series_index")
+
+
+def find_opf_path(zf):
+    """The package document's path in an open EPUB zip, or None."""
+    try:
+        root = ET.fromstring(zf.read("META-INF/container.xml").decode("utf-8", errors="replace"))
+        for el in root.iter():
+            if el.tag.endswith("rootfile"):
+                return el.attrib.get("full-path")
+    except Exception:
+        pass
+    return next((n for n in zf.namelist() if n.endswith(".opf")), None)
+
+def opf_base(opf_path):
+    parts = opf_path.split("/")
+    return "/".join(parts[:-1]) + "/" if len(parts) > 1 else ""
+
+def resolve_href(base, href):
+    return base + href if not href.startswith("/") else href.lstrip("/")
+
+
+# ── Streaming extractor ───────────────────────────────────────────────────────
+
+class _Metadata:
+    """What one metadata element holds, as raw attribute values and text."""
+
+    def __init__(self):
+        self.fields      = {}        # meta key -> text of the first such dc element
+        self.creators    = []        # (text, role)
+        self.identifiers = []        # (scheme, text)
+        self.opf_series  = []        # (name, content) from opf:meta
+        self.series      = []        # (name, content) from un-namespaced meta
+        self.covers      = []        # content of children with name="cover"
+
+    def child(self, tag, attrs):
+        """Note a child element; returns a callback for its text if the text
+        is needed, else None."""
+        name = attrs.get("name")
+        if name == "cover":
+            self.covers.append(attrs.get("content", ""))
+        if tag == OPF_META:
+            if name in SERIES_NAMES:
+                self.opf_series.append((name, attrs.get("content")))
+        elif tag == "meta":
+            if name in SERIES_NAMES:
+                self.series.append((name, attrs.get("content")))
+        elif tag in DC_FIELDS:
+            key = DC_FIELDS[tag]
+            if key not in self.fields:
+                self.fields[key] = None
+                return lambda text: self.fields.__setitem__(key, text)
+        elif tag == DC_CREATOR:
+            role = attrs.get(OPF_ROLE, "author")
+            return lambda text: self.creators.append((text, role))
+        elif tag == DC_IDENTIFIER:
+            scheme = attrs.get("scheme") or attrs.get(OPF_SCHEME, "")
+            return lambda text: self.identifiers.append((scheme, text))
+        return None
+
+
+def _skipped_entity(name, is_parameter_entity):
+    # expat skips references to entities it cannot see (e.g. &nbsp; in a
+    # document with an external DTD); ElementTree rejects them.
+    if not is_parameter_entity:
+        raise expat.ExpatError(f"undefined entity &{name};")
+
+
+class _Scan:
+    """One pass of expat over an OPF document."""
+
+    def __init__(self):
+        self.depth    = 0            # of the current element; the package is 1
+        self.md       = None         # _Metadata of the first opf:metadata child
+        self.plain_md = None         # ... and of the first un-namespaced one
+        self.current  = None         # the one being read, if either
+        self.manifest = {}           # id -> (href, properties)
+        self.on_text  = None         # callback for the text being collected
+        self.parts    = []
+        parser = self.parser = expat.ParserCreate("utf-8", "}")
+        parser.buffer_text           = True
+        parser.StartElementHandler   = self.start
+        parser.EndElementHandler     = self.end
+        parser.SkippedEntityHandler  = _skipped_entity
+
+    def parse(self, data):
+        self.parser.Parse(data, True)
+        return self
+
+    def start(self, tag, attrs):
+        if self.on_text is not None:
+            self.flush()
+        self.depth += 1
+        if tag == "item" or tag.endswith("}item"):
+            self.manifest[attrs.get("id", "")] = (attrs.get("href", ""), attrs.get("properties", ""))
+        if self.depth == 2:
+            if tag == OPF_METADATA and self.md is None:
+                self.current = self.md = _Metadata()
+            elif tag == "metadata" and self.plain_md is None:
+                self.current = self.plain_md = _Metadata()
+        elif self.depth == 3 and self.current is not None:
+            on_text = self.current.child(tag, attrs)
+            if on_text is not None:
+                self.on_text, self.parts = on_text, []
+                self.parser.CharacterDataHandler = self.parts.append
+
+    def end(self, tag):
+        if self.on_text is not None:
+            self.flush()
+        if self.depth == 2:
+            if self.current is not None and self.current is self.md:
+                # Nothing after the opf:metadata element matters but manifest
+                # items, so stop tracking depth from here on.
+                self.parser.StartElementHandler = self.item
+                self.parser.EndElementHandler   = None
+            self.current = None
+        self.depth -= 1
+
+    def item(self, tag, attrs):
+        if tag == "item" or tag.endswith("}item"):
+            self.manifest[attrs.get("id", "")] = (attrs.get("href", ""), attrs.get("properties", ""))
+
+    def flush(self):
+        """End the text being collected: the element closed or a child began."""
+        self.on_text("".join(self.parts) if self.parts else None)
+        self.on_text = None
+        self.parser.CharacterDataHandler = None
+
+    def result(self, base):
+        md = self.md if self.md is not None else self.plain_md
+        if md is None:
+            return None
+
+        meta, authors = {}, []
+        for key in DC_FIELDS.values():
+            text = md.fields.get(key)
+            meta[key] = text.strip() if text else None
+
+        for i, (text, role) in enumerate(md.creators, 1):
+            name = text.strip() if text else None
+            if name:
+                authors.append((name, role, i))
+
+        for name, content in md.opf_series + md.series:
+            if name == "calibre:series":
+                meta["series"] = content
+            else:
+                try:
+                    meta["series_position"] = float(content or "")
+                except ValueError:
+                    pass
+
+        for scheme, text in md.identifiers:
+            scheme, val = scheme.lower(), text.strip() if text else ""
+            if not val:
+                continue
+            if "asin" in scheme or "asin" in val.lower():
+                meta.setdefault("asin", val.split(":")[-1])
+            elif "isbn" in scheme:
+                meta.setdefault("isbn", val)
+            else:
+                meta.setdefault("identifier", val)
+
+        cover_path = None
+        # EPUB3: properties=cover-image
+        for href, properties in self.manifest.values():
+            if "cover-image" in properties:
+                cover_path = resolve_href(base, href)
+                break
+        # EPUB2: meta name=cover -> manifest id
+        if not cover_path:
+            for content in md.covers:
+                item = self.manifest.get(content)
+                if item:
+                    cover_path = resolve_href(base, item[0])
+                    break
+
+        return meta, authors, cover_path
+
+
+def read_opf(data, base=""):
+    """(meta, authors, cover_path) from OPF bytes, or None if the package
+    has no metadata. Manifest hrefs are resolved against `base` (see
+    opf_base). Raises expat.ExpatError on malformed XML."""
+    try:
+        return _Scan().parse(data).result(base)
+    except expat.ExpatError:
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            return _Scan().parse(data.decode("utf-8", errors="replace")).result(base)
+        raise
+
+
+# ── ElementTree reference ─────────────────────────────────────────────────────
+
+def dc_text(md, tag):
+    el = md.find(f"dc:{tag}", OPF_NS)
+    if el is None:
+        el = md.find(f"{{{OPF_NS['dc']}}}{tag}")
+    return el.text.strip() if el is not None and el.text else None
+
+def read_opf_tree(data, base=""):
+    """read_opf by building an ElementTree and walking it, as parse_epub did
+    before read_opf. Slower; kept as the reference for bench_opf.py."""
+    root = ET.fromstring(data.decode("utf-8", errors="replace"))
+    md = root.find("opf:metadata", OPF_NS)
+    if md is None:
+        md = root.find("metadata")
+    if md is None:
+        return None
+
+    meta, authors = {}, []
+    meta["title"]          = dc_text(md, "title")
+    meta["publisher"]      = dc_text(md, "publisher")
+    meta["published_date"] = dc_text(md, "date")
+    meta["language"]       = dc_text(md, "language")
+    meta["description"]    = dc_text(md, "description")
+    meta["subject"]        = dc_text(md, "subject")
+
+    # Authors — repeated dc:creator elements
+    creators = (
+        md.findall("dc:creator", OPF_NS) or
+        md.findall(f"{{{OPF_NS['dc']}}}creator")
+    )
+    for i, el in enumerate(creators, 1):
+        name = el.text.strip() if el.text else None
+        role = el.attrib.get(f"{{{OPF_NS['opf']}}}role", "author")
+        if name:
+            authors.append((name, role, i))
+
+    # Series from Calibre meta tags
+    for el in list(md.findall("opf:meta", OPF_NS)) + list(md.findall("meta")):
+        name = el.attrib.get("name", "")
+        if name == "calibre:series":
+            meta["series"] = el.attrib.get("content")
+        elif name == "calibre:series_index":
+            try:
+                meta["series_position"] = float(el.attrib.get("content", ""))
+            except ValueError:
+                pass
+
+    # Identifiers
+    all_ids = (
+        md.findall("dc:identifier", OPF_NS) +
+        md.findall(f"{{{OPF_NS['dc']}}}identifier")
+    )
+    for el in all_ids:
+        scheme = (
+            el.attrib.get("scheme") or
+            el.attrib.get(f"{{{OPF_NS['opf']}}}scheme", "")
+        ).lower()
+        val = el.text.strip() if el.text else ""
+        if not val:
+            continue
+        if "asin" in scheme or "asin" in val.lower():
+            meta.setdefault("asin", val.split(":")[-1])
+        elif "isbn" in scheme:
+            meta.setdefault("isbn", val)
+        else:
+            meta.setdefault("identifier", val)
+
+    # Cover image — build manifest then find cover
+    manifest = {}
+    for item in root.iter():
+        if item.tag.endswith("}item") or item.tag == "item":
+            manifest[item.attrib.get("id", "")] = {
+                "href":       resolve_href(base, item.attrib.get("href", "")),
+                "properties": item.attrib.get("properties", ""),
+            }
+
+    cover_path = None
+    # EPUB3: properties=cover-image
+    for item in manifest.values():
+        if "cover-image" in item["properties"]:
+            cover_path = item["href"]
+            break
+    # EPUB2: meta name=cover -> manifest id
+    if not cover_path:
+        for el in md:
+            if el.attrib.get("name") == "cover":
+                item = manifest.get(el.attrib.get("content", ""))
+                if item:
+                    cover_path = item["href"]
+                    break
+
+    return meta, authors, cover_path
@@ -0,0 +1,208 @@
+"""
+On-disk cache of parse results, keyed by (s3_key, etag, parser_version).
+
+With PARSE_CACHE set to a file path, the loader stores what parse_epub and
+parse_m4b returned for every object it loads: the metadata, the authors or
+chapters, and the cover bytes. Before downloading a claimed key, it looks up
+the key's current etag. On a hit the download and parse are skipped
+entirely, so reloading the catalog costs a bucket listing but no object
+downloads. To rebuild it from scratch, keep the schema and empty the tables:
+
+  TRUNCATE epubs, m4bs CASCADE;
+
+CASCADE also empties book_epubs, book_m4bs and m4b_narrators, which the
+loader does not recreate. The next listing finds the done jobs that lost
+their catalog row and makes them pending (see catalog.sync_manifest), and
+the loader reloads them. To reload in place, say after a migration adds
+columns, requeue the done jobs with `python jobs.py requeue --done`.
+Dropping the tables instead does not work: migrate.py has already recorded
+their migrations as applied and will not recreate them.
+
+Entries carry the loader's PARSER_VERSION. Bump it whenever parse_epub or
+parse_m4b would return something different for the same file, and the old
+entries stop matching and age out.
+
+The cache is one SQLite file. Metadata and children are stored as
+zlib-compressed JSON; covers are stored as-is, since they are already
+compressed images. Every hit refreshes an entry's last-used time, and once
+the cache grows past its size cap the least recently used entries are
+evicted down to 90% of the cap. Each thread uses its own connection, so
+download threads can look entries up concurrently.
+
+Run this module directly to inspect or shrink a cache:
+
+  python parsecache.py stats PATH
+  python parsecache.py prune PATH [--max-mb N] [--parser-version V]
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        s3_key         TEXT    NOT NULL,
+        etag           TEXT    NOT NULL,
+        parser_version INTEGER NOT NULL,
+        kind           TEXT    NOT NULL,
+        result         BLOB    NOT NULL,   -- zlib(JSON [meta, children])
+        cover          BLOB,
+        cover_ext      TEXT,
+        size           INTEGER NOT NULL,   -- bytes stored for this entry
+        used_at        REAL    NOT NULL,
+        PRIMARY KEY (s3_key, etag, parser_version)
+    );
+    CREATE INDEX IF NOT EXISTS entries_used_at ON entries(used_at);
+
+    -- Running total of entry sizes, so the cap check is one row read.
+    CREATE TABLE IF NOT EXISTS totals (bytes INTEGER NOT NULL);
+    INSERT INTO totals SELECT coalesce(sum(size), 0) FROM entries
+        WHERE NOT EXISTS (SELECT 1 FROM totals);
+    CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+        BEGIN UPDATE totals SET bytes = bytes + new.size; END;
+    CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+        BEGIN UPDATE totals SET bytes = bytes - old.size; END;
+"""
+
+EVICT_BATCH = 256
+
+
+class Cached:
+    """A parse result served from the cache, in place of a downloaded
+    source: parse_fetched passes `result` through without parsing."""
+
+    def __init__(self, result):
+        self.result = result
+
+
+def _encode(kind, result):
+    """Split a parse result into (blob, cover, cover_ext)."""
+    if kind == "epub":
+        meta, children, cover, cover_ext = result
+    else:
+        meta, cover, cover_ext, children = result
+    blob = zlib.compress(json.dumps([meta, children], separators=(",", ":")).encode(), 6)
+    return blob, cover, cover_ext
+
+def _decode(kind, blob, cover, cover_ext):
+    """Rebuild the parse result tuple that _encode split up."""
+    meta, children = json.loads(zlib.decompress(blob))
+    children = [tuple(child) for child in children]
+    if kind == "epub":
+        return meta, children, cover, cover_ext
+    return meta, cover, cover_ext, children
+
+
+class ParseCache:
+    """SQLite-backed LRU cache of parse results, capped at max_bytes."""
+
+    def __init__(self, path, max_bytes, parser_version):
+        self.path           = path
+        self.max_bytes      = max_bytes
+        self.parser_version = parser_version
+        self._local         = threading.local()
+        self._evict_lock    = threading.Lock()
+        self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        """This thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, s3_key, etag):
+        """The cached parse result for this version of the object, or None."""
+        conn = self.conn()
+        row = conn.execute(
+            "SELECT kind, result, cover, cover_ext FROM entries "
+            "WHERE s3_key = ? AND etag = ? AND parser_version = ?",
+            (s3_key, etag, self.parser_version),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE entries SET used_at = ? WHERE s3_key = ? AND etag = ? AND parser_version = ?",
+            (time.time(), s3_key, etag, self.parser_version),
+        )
+        return _decode(*row)
+
+    def put(self, s3_key, etag, kind, result):
+        """Store a parse result unless it is already cached, then evict
+        least recently used entries if the cache is over its cap."""
+        blob, cover, cover_ext = _encode(kind, result)
+        conn = self.conn()
+        conn.execute(
+            "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (s3_key, etag, self.parser_version, kind, blob, cover, cover_ext,
+             len(blob) + len(cover or b""), time.time()),
+        )
+        if self.total() > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def total(self):
+        return self.conn().execute("SELECT bytes FROM totals").fetchone()[0]
+
+    def evict(self, target):
+        """Delete least recently used entries until at most `target` bytes
+        remain. Returns the number of entries deleted."""
+        deleted = 0
+        with self._evict_lock:
+            conn = self.conn()
+            while self.total() > target:
+                cur = conn.execute(
+                    "DELETE FROM entries WHERE rowid IN "
+                    "(SELECT rowid FROM entries ORDER BY used_at LIMIT ?)",
+                    (EVICT_BATCH,),
+                )
+                if not cur.rowcount:
+                    break
+                deleted += cur.rowcount
+        return deleted
+
+    def drop_versions(self, keep):
+        """Delete entries from parser versions other than `keep`."""
+        cur = self.conn().execute("DELETE FROM entries WHERE parser_version <> ?", (keep,))
+        return cur.rowcount
+
+    def stats(self):
+        """[(parser_version, kind, entries, bytes)]."""
+        return self.conn().execute(
+            "SELECT parser_version, kind, count(*), sum(size) FROM entries "
+            "GROUP BY parser_version, kind ORDER BY parser_version, kind"
+        ).fetchall()
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the loader's parse cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats_cmd = sub.add_parser("stats", help="Entries and size by parser version and kind")
+    stats_cmd.add_argument("path", help="Cache file (PARSE_CACHE)")
+    prune_cmd = sub.add_parser("prune", help="Evict entries")
+    prune_cmd.add_argument("path", help="Cache file (PARSE_CACHE)")
+    prune_cmd.add_argument("--max-mb", type=float, help="Evict least recently used entries down to this size")
+    prune_cmd.add_argument("--parser-version", type=int,
+                           help="Delete entries from every other parser version")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.path, max_bytes=float("inf"), parser_version=None)
+    if args.command == "prune":
+        if args.parser_version is not None:
+            print(f"{cache.drop_versions(args.parser_version)} entries from other parser versions deleted.")
+        if args.max_mb is not None:
+            print(f"{cache.evict(int(args.max_mb * 1024 * 1024))} least recently used entries evicted.")
+    for version, kind, entries, size in cache.stats():
+        print(f"parser v{version}  {kind:<5} {entries:>8} entries  {size / 1e6:>10.1f} MB")
+    print(f"total {cache.total() / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Threaded pipeline primitives for the loader.
+
+A Stage is a pool of worker threads that take items from a bounded input
+queue, apply a function and put the result on a bounded output queue.
+Because every queue is bounded, a slow stage blocks the stages upstream of
+it (backpressure), so the number of items in flight -- temp files, cover
+bytes -- stays fixed however large the backlog is.
+
+Items are tuples whose first element is the S3 key. A function that raises
+turns its item into a Failed, which later stages forward untouched so the
+consumer at the end of the pipeline sees every key exactly once. The DONE
+sentinel flows down the pipeline once every worker of a stage has finished.
+"""
+
+import queue
+import threading
+
+DONE = object()
+
+
+class Failed:
+    """An item that raised in `stage`; forwarded to the end of the pipeline."""
+
+    def __init__(self, stage, item, error):
+        self.stage = stage
+        self.item  = item
+        self.error = error
+
+    @property
+    def key(self):
+        return self.item[0]
+
+
+class Stage:
+    """`workers` threads applying `fn` to items from `inbox` into `outbox`.
+
+    fn may return None to drop an item. A stage with no outbox is a sink;
+    its failures are printed since there is nowhere to forward them.
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox=None):
+        self.name    = name
+        self.fn      = fn
+        self.inbox   = inbox
+        self.outbox  = outbox
+        self.active  = 0
+        self._lock   = threading.Lock()
+        self._remaining = workers
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                self.inbox.put(DONE)   # let sibling workers see it too
+                break
+            if isinstance(item, Failed):
+                result = item
+            else:
+                with self._lock:
+                    self.active += 1
+                try:
+                    result = self.fn(item)
+                except Exception as e:
+                    result = Failed(self.name, item, e)
+                finally:
+                    with self._lock:
+                        self.active -= 1
+            if result is None:
+                continue
+            if self.outbox is not None:
+                self.outbox.put(result)
+            elif isinstance(result, Failed):
+                print(f"  ERROR in {result.stage} stage for {result.key}: {result.error}", flush=True)
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last and self.outbox is not None:
+            self.outbox.put(DONE)
+
+
+def feed(q, items):
+    """Put items then DONE on `q` from a background thread; returns the thread.
+    `items` may be a lazy generator; if it raises, the pipeline still ends."""
+    def run():
+        try:
+            for item in items:
+                q.put(item)
+        except Exception as e:
+            print(f"  ERROR feeding pipeline: {e}", flush=True)
+        finally:
+            q.put(DONE)
+    t = threading.Thread(target=run, name="feed", daemon=True)
+    t.start()
+    return t
+
+
+def bounded(depth):
+    return queue.Queue(maxsize=depth)
@@ -0,0 +1,211 @@
+"""
+S3 I/O helpers for the loader.
+
+S3RangeFile is a seekable, read-only file object over a single S3 object. It
+fetches only the byte ranges a reader actually touches (via HTTP Range GETs),
+in fixed-size blocks that are cached for the lifetime of the file object, so
+zipfile.ZipFile and mutagen can open an object in place without downloading it.
+
+HashingWriter hashes an object's bytes (SHA-256) as a download streams
+them, into a file or into memory, so the content hash costs no second read.
+
+connection_stats reports how many HTTP connections a boto3 client has opened
+versus requests made over them, to show keep-alive reuse.
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_MAX_BLOCKS = 256
+
+
+class S3RangeFile(io.RawIOBase):
+    """Seekable view of s3://bucket/key backed by block-cached Range GETs.
+
+    Contiguous missing blocks are fetched with a single request, so one large
+    read (a whole moov atom, a cover image) costs one round trip. Counters
+    bytes_fetched and requests report the transfer actually made.
+    """
+
+    def __init__(self, s3, bucket, key, size=None,
+                 block_size=DEFAULT_BLOCK_SIZE, max_blocks=DEFAULT_MAX_BLOCKS):
+        super().__init__()
+        self._s3        = s3
+        self.bucket     = bucket
+        self.key        = key
+        self.name       = key
+        if size is None:
+            size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.size       = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._blocks    = OrderedDict()   # block index -> bytes
+        self._pos       = 0
+        self.bytes_fetched = 0
+        self.requests      = 0
+
+    # ── io.RawIOBase interface ────────────────────────────────────────────────
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        if pos < 0:
+            raise OSError("negative seek position")
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        end = self.size if size is None or size < 0 else min(self._pos + size, self.size)
+        if self._pos >= end:
+            return b""
+        data = self.read_range(self._pos, end)
+        self._pos = end
+        return data
+
+    def readall(self):
+        return self.read(-1)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    # ── Range fetching ────────────────────────────────────────────────────────
+
+    def read_range(self, start, end):
+        """Return bytes [start, end) of the object, fetching missing blocks."""
+        bs = self.block_size
+        first, last = start // bs, (end - 1) // bs
+        parts = []
+        b = first
+        while b <= last:
+            if b in self._blocks:
+                self._blocks.move_to_end(b)
+                parts.append(self._blocks[b])
+                b += 1
+                continue
+            run_end = b
+            while run_end < last and run_end + 1 not in self._blocks:
+                run_end += 1
+            data = self._fetch(b * bs, min((run_end + 1) * bs, self.size))
+            for i in range(b, run_end + 1):
+                chunk = data[(i - b) * bs:(i - b + 1) * bs]
+                self._store(i, chunk)
+                parts.append(chunk)
+            b = run_end + 1
+        buf = b"".join(parts)
+        offset = start - first * bs
+        return buf[offset:offset + (end - start)]
+
+    def _fetch(self, start, end):
+        resp = self._s3.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}",
+        )
+        data = resp["Body"].read()
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        return data
+
+    def _store(self, index, chunk):
+        self._blocks[index] = chunk
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+
+
+class HashingWriter:
+    """Write-only sink that hashes everything written to it and passes it on
+    to `f`, or keeps it in memory if `f` is None. It has no seek or tell, so
+    s3transfer's download_fileobj writes parts to it strictly in order."""
+
+    def __init__(self, f=None):
+        self._f      = f
+        self._chunks = [] if f is None else None
+        self._sha256 = hashlib.sha256()
+        self.size    = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        if self._f is None:
+            self._chunks.append(bytes(data))
+        else:
+            self._f.write(data)
+        return len(data)
+
+    def getvalue(self):
+        """The bytes written, when kept in memory."""
+        return b"".join(self._chunks)
+
+    def digest(self):
+        """(sha256 hex digest, size) of everything written."""
+        return self._sha256.hexdigest(), self.size
+
+
+class FetchStats:
+    """Thread-safe per-run totals of bytes transferred vs. object sizes.
+    `on_add`, if given, is called with the bytes fetched by each add(), e.g.
+    to feed a metrics counter that outlives reset()."""
+
+    def __init__(self, on_add=None):
+        self._lock   = threading.Lock()
+        self._on_add = on_add
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.objects       = 0
+            self.object_bytes  = 0
+            self.fetched_bytes = 0
+            self.requests      = 0
+
+    def add(self, fetched, size, requests=1):
+        with self._lock:
+            self.objects       += 1
+            self.object_bytes  += size
+            self.fetched_bytes += fetched
+            self.requests      += requests
+        if self._on_add is not None:
+            self._on_add(fetched)
+
+    def summary(self):
+        with self._lock:
+            pct = 100.0 * self.fetched_bytes / self.object_bytes if self.object_bytes else 0.0
+            return (
+                f"fetched {self.fetched_bytes} of {self.object_bytes} bytes "
+                f"({pct:.2f}%) across {self.objects} objects in {self.requests} requests"
+            )
+
+
+def connection_stats(client):
+    """Return (connections_opened, requests) across a boto3 client's urllib3
+    connection pools. Requests minus connections is the number of requests
+    that reused a kept-alive connection. Reads botocore/urllib3 internals, so
+    returns (0, 0) if their layout changes."""
+    try:
+        manager = client._endpoint.http_session._manager
+        pools = [manager.pools[k] for k in manager.pools.keys()]
+    except (AttributeError, KeyError):
+        return 0, 0
+    opened   = sum(getattr(p, "num_connections", 0) for p in pools)
+    requests = sum(getattr(p, "num_requests", 0) for p in pools)
+    return opened, requests
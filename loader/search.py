@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Ranked catalog search over epubs and m4bs.
+
+Every catalog row carries a stored `search` tsvector (see search_vector in
+schema.sql) weighted title > author > series > description; for m4bs the
+author is the artist and album and narrator stand in for the series. The
+loader's upserts keep it current: it is a generated column, and for EPUBs
+the author names it reads are written with the row (author_names).
+
+search() matches a query in one of two ways, each backed by GIN indexes:
+
+  - full text: every word of the query, as a prefix, against `search`, so
+    "harb sign" finds "Harbor Signal" and the words may come from different
+    fields ("harbor smuggler" finds it by its title and description). Hits
+    are ranked by ts_rank (normalised by document length).
+  - trigrams, when full text finds nothing: the whole query against the
+    title and the author (pg_trgm's `<%` word similarity), so misspellings
+    such as "Harbr Signl" still find it. Hits are ranked by the better of
+    the two similarities.
+
+Hits are returned a page at a time with the total count. Usage:
+
+  python search.py QUERY... [--kind epub|m4b] [--limit N] [--page N] [--exact]
+"""
+
+import argparse
+import collections
+import re
+
+Hit = collections.namedtuple("Hit", "kind id s3_key title authors series rank")
+
+# One branch per table and match; search() joins the wanted tables with
+# UNION ALL. The query is passed as constants (not joined in) so each WHERE
+# can be planned as a scan of the table's GIN indexes.
+TEXT_HITS = {
+    "epub": """
+        SELECT 'epub' AS kind, id, s3_key, title, author_names AS authors, series,
+               ts_rank(search, to_tsquery('simple', %(tsquery)s), 1) AS rank
+        FROM epubs
+        WHERE gone_at IS NULL
+          AND search @@ to_tsquery('simple', %(tsquery)s)
+    """,
+    "m4b": """
+        SELECT 'm4b' AS kind, id, s3_key, title, artist AS authors, album AS series,
+               ts_rank(search, to_tsquery('simple', %(tsquery)s), 1) AS rank
+        FROM m4bs
+        WHERE gone_at IS NULL
+          AND search @@ to_tsquery('simple', %(tsquery)s)
+    """,
+}
+
+SIMILAR_HITS = {
+    "epub": """
+        SELECT 'epub' AS kind, id, s3_key, title, author_names AS authors, series,
+               greatest(word_similarity(%(text)s, title),
+                        word_similarity(%(text)s, coalesce(author_names, ''))) AS rank
+        FROM epubs
+        WHERE gone_at IS NULL
+          AND (%(text)s <%% title OR %(text)s <%% author_names)
+    """,
+    "m4b": """
+        SELECT 'm4b' AS kind, id, s3_key, title, artist AS authors, album AS series,
+               greatest(word_similarity(%(text)s, coalesce(title, '')),
+                        word_similarity(%(text)s, coalesce(artist, ''))) AS rank
+        FROM m4bs
+        WHERE gone_at IS NULL
+          AND (%(text)s <%% title OR %(text)s <%% artist)
+    """,
+}
+
+# The count comes from its own row so it is known even past the last page.
+PAGE = """
+    WITH hits AS ({hits})
+    SELECT total.n, page.*
+    FROM (SELECT count(*) AS n FROM hits) total
+    LEFT JOIN LATERAL (
+        SELECT * FROM hits ORDER BY rank DESC, kind, id LIMIT %(limit)s OFFSET %(offset)s
+    ) page ON true
+"""
+
+# Words as the 'simple' text search parser splits them: runs of letters and
+# digits.
+WORD = re.compile(r"[^\W_]+")
+
+
+def prefix_query(text):
+    """A to_tsquery string matching every word of `text` as a prefix, or
+    None if it has no words."""
+    words = WORD.findall(text.lower())
+    return " & ".join(f"{word}:*" for word in words) if words else None
+
+
+def search_query(text, kind=None, limit=20, offset=0, similar=False):
+    """(sql, params) of one page of full-text hits, or of trigram hits if
+    `similar`; None if `text` has no words."""
+    tsquery = prefix_query(text)
+    if tsquery is None:
+        return None
+    branches = SIMILAR_HITS if similar else TEXT_HITS
+    hits = " UNION ALL ".join(sql for k, sql in branches.items() if kind in (None, k))
+    params = {"tsquery": tsquery, "text": text.strip(), "limit": limit, "offset": offset}
+    return PAGE.format(hits=hits), params
+
+
+def _page(conn, query):
+    with conn.cursor() as cur:
+        cur.execute(*query)
+        rows = cur.fetchall()
+    return rows[0][0], [Hit(*row[1:]) for row in rows if row[1] is not None]
+
+
+def search(conn, text, kind=None, limit=20, offset=0, fuzzy=True):
+    """Search the live catalog for `text`.
+
+    `kind` limits the search to "epub" or "m4b" rows; `fuzzy=False` never
+    falls back to trigram matches. Returns (total, hits) where hits is the
+    [Hit] from `offset` on, at most `limit` of them, best first, and total
+    counts every match.
+    """
+    query = search_query(text, kind, limit, offset)
+    if query is None:
+        return 0, []
+    total, hits = _page(conn, query)
+    if total == 0 and fuzzy:
+        total, hits = _page(conn, search_query(text, kind, limit, offset, similar=True))
+    return total, hits
+
+
+def main():
+    # Only the command line needs the loader's connection settings.
+    import loader as ld
+
+    parser = argparse.ArgumentParser(description="Search the catalog.")
+    parser.add_argument("query", nargs="+")
+    parser.add_argument("--kind", choices=("epub", "m4b"), help="Only this kind (default: both)")
+    parser.add_argument("--limit", type=int, default=20, help="Hits per page (default: 20)")
+    parser.add_argument("--page", type=int, default=1, help="Page number, from 1 (default: 1)")
+    parser.add_argument("--exact", action="store_true", help="No typo-tolerant trigram matches")
+    args = parser.parse_args()
+
+    conn = ld.connect_db()
+    try:
+        total, hits = search(
+            conn, " ".join(args.query), args.kind, args.limit, (args.page - 1) * args.limit,
+            fuzzy=not args.exact,
+        )
+    finally:
+        conn.close()
+    first = (args.page - 1) * args.limit
+    for i, hit in enumerate(hits, first + 1):
+        series = f" [{hit.series}]" if hit.series else ""
+        print(f"{i:>4}. {hit.rank:5.2f}  [{hit.kind}] {hit.title} / {hit.authors or '?'}{series}")
+        print(f"              {hit.s3_key}")
+    print(f"{first + 1 if hits else 0}-{first + len(hits)} of {total} hits")
+
+
+if __name__ == "__main__":
+    main()
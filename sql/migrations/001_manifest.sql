@@ -0,0 +1,15 @@
+-- Object manifest (see loader/catalog.py) and gone_at on catalog rows.
+
+ALTER TABLE epubs ADD COLUMN IF NOT EXISTS gone_at TIMESTAMPTZ;
+ALTER TABLE m4bs  ADD COLUMN IF NOT EXISTS gone_at TIMESTAMPTZ;
+
+CREATE TABLE IF NOT EXISTS s3_objects (
+    s3_key          TEXT        PRIMARY KEY,
+    kind            TEXT        NOT NULL,
+    etag            TEXT        NOT NULL,
+    size            BIGINT      NOT NULL,
+    last_modified   TIMESTAMPTZ NOT NULL,
+    loaded_etag     TEXT,
+    first_seen_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    gone_at         TIMESTAMPTZ
+);
@@ -0,0 +1,19 @@
+-- Load jobs on the manifest: leased claims, attempts, errors and backoff
+-- (see loader/jobs.py). Rows already loaded at their current etag are done.
+
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS claimed_by      TEXT;
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS lease_until     TIMESTAMPTZ;
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS attempts        INT NOT NULL DEFAULT 0;
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS last_error      TEXT;
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS attempted_at    TIMESTAMPTZ;
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ;
+
+ALTER TABLE s3_objects ADD COLUMN IF NOT EXISTS state TEXT;
+UPDATE s3_objects SET state = CASE WHEN loaded_etag = etag THEN 'done' ELSE 'pending' END
+WHERE state IS NULL;
+ALTER TABLE s3_objects ALTER COLUMN state SET DEFAULT 'pending';
+ALTER TABLE s3_objects ALTER COLUMN state SET NOT NULL;
+
+DROP INDEX IF EXISTS idx_s3_objects_pending;
+CREATE INDEX IF NOT EXISTS idx_s3_objects_todo ON s3_objects(s3_key)
+    WHERE gone_at IS NULL AND state <> 'done';
@@ -0,0 +1,16 @@
+-- Checkpointed re-extraction runs (see loader/backfill.py).
+
+CREATE TABLE IF NOT EXISTS backfills (
+    name            TEXT        PRIMARY KEY,
+    extractors      TEXT[]      NOT NULL,
+    state           TEXT        NOT NULL DEFAULT 'running',
+    last_epub_id    INT         NOT NULL DEFAULT 0,
+    last_m4b_id     INT         NOT NULL DEFAULT 0,
+    updated_rows    BIGINT      NOT NULL DEFAULT 0,
+    skipped_rows    BIGINT      NOT NULL DEFAULT 0,
+    failed_rows     BIGINT      NOT NULL DEFAULT 0,
+    bytes_fetched   BIGINT      NOT NULL DEFAULT 0,
+    started_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at     TIMESTAMPTZ
+);
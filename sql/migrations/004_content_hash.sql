@@ -0,0 +1,12 @@
+-- Content hashes for byte-identical copies under different keys (see
+-- loader/duplicates.py).
+
+ALTER TABLE epubs ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE epubs ADD COLUMN IF NOT EXISTS content_size BIGINT;
+ALTER TABLE m4bs  ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE m4bs  ADD COLUMN IF NOT EXISTS content_size BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_epubs_content_hash ON epubs(content_hash, content_size)
+    WHERE content_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_m4bs_content_hash  ON m4bs(content_hash, content_size)
+    WHERE content_hash IS NOT NULL;
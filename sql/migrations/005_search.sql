@@ -0,0 +1,34 @@
+-- Catalog search (see loader/search.py): weighted full-text documents and
+-- title/author trigrams. search_vector is defined as in schema.sql.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION search_vector(a TEXT, b TEXT, c TEXT, d TEXT)
+RETURNS TSVECTOR LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('simple'::regconfig, coalesce(a, '')), 'A') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(b, '')), 'B') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(c, '')), 'C') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(d, '')), 'D')
+$$;
+
+-- author_names is filled before the generated column is added, so each row
+-- is rewritten once.
+ALTER TABLE epubs ADD COLUMN IF NOT EXISTS author_names TEXT;
+UPDATE epubs e SET author_names = a.names
+FROM (
+    SELECT epub_id, string_agg(author, '; ' ORDER BY position, id) AS names
+    FROM epub_authors GROUP BY epub_id
+) a
+WHERE a.epub_id = e.id AND e.author_names IS NULL;
+
+ALTER TABLE epubs ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS
+    (search_vector(title, author_names, series, description)) STORED;
+ALTER TABLE m4bs  ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS
+    (search_vector(title, artist, coalesce(album, '') || ' ' || coalesce(narrator, ''), description)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_epubs_search       ON epubs USING gin (search);
+CREATE INDEX IF NOT EXISTS idx_m4bs_search        ON m4bs  USING gin (search);
+CREATE INDEX IF NOT EXISTS idx_epubs_title_trgm   ON epubs USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_epubs_authors_trgm ON epubs USING gin (author_names gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_m4bs_title_trgm    ON m4bs  USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_m4bs_artist_trgm   ON m4bs  USING gin (artist gin_trgm_ops);
@@ -1,5 +1,24 @@
 -- ebooks metadata schema
 -- Raw data as extracted from the epub OPF; normalization happens externally.
+--
+-- This creates the current schema in an empty database. Databases created
+-- earlier are brought up to date by the numbered files in migrations/, each
+-- applied once (see loader/migrate.py); a change here needs a migration too.
+
+-- Trigram indexes for typo-tolerant title and author search (see search.py).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Full-text search document of a catalog row: four fields weighted A (title)
+-- to D (description). 'simple' neither stems nor drops stop words, since
+-- the library is multilingual. Stored search columns are computed with this
+-- at write time; changing it only affects rows written afterwards.
+CREATE OR REPLACE FUNCTION search_vector(a TEXT, b TEXT, c TEXT, d TEXT)
+RETURNS TSVECTOR LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('simple'::regconfig, coalesce(a, '')), 'A') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(b, '')), 'B') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(c, '')), 'C') ||
+           setweight(to_tsvector('simple'::regconfig, coalesce(d, '')), 'D')
+$$;
 
 -- ---------------------------------------------------------------------------
 -- Abstract book schema
@@ -78,8 +97,14 @@ CREATE TABLE IF NOT EXISTS epubs (
     identifier      TEXT,                       -- raw dc:identifier (UUID, URN, etc.)
     subject         TEXT,                       -- raw dc:subject tag
     cover_path      TEXT,                       -- path to cover image within the epub zip
+    content_hash    TEXT,                       -- SHA-256 (hex) of the object's bytes
+    content_size    BIGINT,                     -- bytes hashed for content_hash
+    author_names    TEXT,                       -- epub_authors names, "; "-joined, for search
+    search          TSVECTOR GENERATED ALWAYS AS
+                    (search_vector(title, author_names, series, description)) STORED,
     imported_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
-    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    gone_at         TIMESTAMPTZ                 -- set when the object disappears from the bucket
 );
 
 CREATE TABLE IF NOT EXISTS epub_authors (
@@ -94,6 +119,14 @@ CREATE INDEX IF NOT EXISTS idx_epub_authors_epub_id ON epub_authors(epub_id);
 CREATE INDEX IF NOT EXISTS idx_epub_authors_author  ON epub_authors(author);
 CREATE INDEX IF NOT EXISTS idx_epubs_series         ON epubs(series);
 CREATE INDEX IF NOT EXISTS idx_epubs_s3_key         ON epubs(s3_key);
+CREATE INDEX IF NOT EXISTS idx_epubs_content_hash   ON epubs(content_hash, content_size)
+    WHERE content_hash IS NOT NULL;
+
+-- Catalog search (see search.py): the weighted full-text document, and
+-- trigrams of titles and authors for misspelled queries.
+CREATE INDEX IF NOT EXISTS idx_epubs_search       ON epubs USING gin (search);
+CREATE INDEX IF NOT EXISTS idx_epubs_title_trgm   ON epubs USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_epubs_authors_trgm ON epubs USING gin (author_names gin_trgm_ops);
 
 -- ---------------------------------------------------------------------------
 
@@ -115,12 +148,22 @@ CREATE TABLE IF NOT EXISTS m4bs (
     bitrate_kbps    INT,
     sample_rate     INT,
     channels        SMALLINT,
+    content_hash    TEXT,                        -- SHA-256 (hex) of the object's bytes
+    content_size    BIGINT,                      -- bytes hashed for content_hash
+    search          TSVECTOR GENERATED ALWAYS AS
+                    (search_vector(title, artist, coalesce(album, '') || ' ' || coalesce(narrator, ''), description)) STORED,
     imported_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
-    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    gone_at         TIMESTAMPTZ                  -- set when the object disappears from the bucket
 );
 
 CREATE INDEX IF NOT EXISTS idx_m4bs_artist ON m4bs(artist);
 CREATE INDEX IF NOT EXISTS idx_m4bs_s3_key ON m4bs(s3_key);
+CREATE INDEX IF NOT EXISTS idx_m4bs_content_hash ON m4bs(content_hash, content_size)
+    WHERE content_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_m4bs_search       ON m4bs USING gin (search);
+CREATE INDEX IF NOT EXISTS idx_m4bs_title_trgm   ON m4bs USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_m4bs_artist_trgm  ON m4bs USING gin (artist gin_trgm_ops);
 
 CREATE TABLE IF NOT EXISTS m4b_chapters (
     id          SERIAL PRIMARY KEY,
@@ -156,3 +199,50 @@ CREATE TABLE IF NOT EXISTS book_m4bs (
     m4b_id      INT NOT NULL REFERENCES m4bs(id) ON DELETE CASCADE,
     PRIMARY KEY (book_id, m4b_id)
 );
+
+-- ---------------------------------------------------------------------------
+-- Loader object manifest: last listing of every EPUB/M4B in the bucket
+-- ---------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS s3_objects (
+    s3_key          TEXT        PRIMARY KEY,     -- full object key in the S3 bucket
+    kind            TEXT        NOT NULL,        -- 'epub' or 'm4b'
+    etag            TEXT        NOT NULL,        -- from list_objects_v2, quotes stripped
+    size            BIGINT      NOT NULL,
+    last_modified   TIMESTAMPTZ NOT NULL,
+    loaded_etag     TEXT,                        -- etag of the version in epubs/m4bs; null = needs load
+    first_seen_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    gone_at         TIMESTAMPTZ,                 -- set when the object disappears from the bucket
+
+    -- Load job for the current etag (see loader/jobs.py)
+    state           TEXT        NOT NULL DEFAULT 'pending', -- 'pending', 'running', 'done', 'failed', 'quarantined'
+    attempts        INT         NOT NULL DEFAULT 0,  -- claims of the current etag so far
+    last_error      TEXT,                        -- error from the last failed attempt
+    attempted_at    TIMESTAMPTZ,                 -- when the last attempt was claimed
+    next_attempt_at TIMESTAMPTZ,                 -- a failed job is retried after this (backoff)
+    claimed_by      TEXT,                        -- loader replica currently loading it
+    lease_until     TIMESTAMPTZ                  -- claim expires after this; others may take it
+);
+
+-- Jobs still to run.
+CREATE INDEX IF NOT EXISTS idx_s3_objects_todo ON s3_objects(s3_key)
+    WHERE gone_at IS NULL AND state <> 'done';
+
+-- ---------------------------------------------------------------------------
+-- Backfills: re-extraction runs over loaded rows (see loader/backfill.py)
+-- ---------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS backfills (
+    name            TEXT        PRIMARY KEY,
+    extractors      TEXT[]      NOT NULL,
+    state           TEXT        NOT NULL DEFAULT 'running', -- 'running', 'paused', 'done'
+    last_epub_id    INT         NOT NULL DEFAULT 0,  -- checkpoint: epubs rows up to this id are done
+    last_m4b_id     INT         NOT NULL DEFAULT 0,  -- checkpoint: m4bs rows up to this id are done
+    updated_rows    BIGINT      NOT NULL DEFAULT 0,
+    skipped_rows    BIGINT      NOT NULL DEFAULT 0,  -- reloaded by the loader while being read
+    failed_rows     BIGINT      NOT NULL DEFAULT 0,
+    bytes_fetched   BIGINT      NOT NULL DEFAULT 0,
+    started_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at     TIMESTAMPTZ
+);
@@ -0,0 +1,77 @@
+"""
+Shared fixtures. The loader and bench modules are scripts run from their own
+directories, so both are put on sys.path here.
+
+loader.py reads its object store settings at import; tests never reach the
+store, so placeholders are filled in for any that are not set.
+
+Tests that need Postgres use the `db` fixture: a scratch database named
+$POSTGRES_DB_test, created with the current schema on the server the
+POSTGRES_* variables point at (the same ones the loader reads), and dropped
+afterwards. They are skipped when no server is reachable.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "loader"))
+sys.path.insert(0, str(REPO_DIR / "bench"))
+
+for name in (
+    "OBJECT_STORE_BUCKET_ENDPOINT", "OBJECT_STORE_ACCESS_KEY_ID", "OBJECT_STORE_SECRET_ACCESS_KEY",
+    "OBJECT_STORE_BUCKET_NAME", "OBJECT_STORE_BUCKET_REGION",
+):
+    os.environ.setdefault(name, "test")
+
+SCHEMA_FILE    = REPO_DIR / "sql" / "schema.sql"
+MIGRATIONS_DIR = REPO_DIR / "sql" / "migrations"
+
+
+def connect(dbname):
+    import psycopg2
+    return psycopg2.connect(
+        host=os.environ.get("POSTGRES_HOST", "localhost"),
+        port=int(os.environ.get("POSTGRES_PORT", "5432")),
+        user=os.environ.get("POSTGRES_USER", "vibelib"),
+        password=os.environ.get("POSTGRES_PASSWORD"),
+        dbname=dbname,
+    )
+
+
+@pytest.fixture
+def db():
+    """A connection to a freshly migrated scratch database."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    admin_db = os.environ.get("POSTGRES_DB", "vibelib")
+    name = f"{admin_db}_test"
+    try:
+        admin = connect(admin_db)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres unavailable: {e}")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cur.execute(f'CREATE DATABASE "{name}"')
+
+    from migrate import migrate
+
+    conn = connect(name)
+    try:
+        migrate(conn, SCHEMA_FILE, MIGRATIONS_DIR)
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        admin.close()
+
+
+@pytest.fixture
+def connect_db(db):
+    """Opens further connections to the `db` database, for code that makes
+    its own (as loader.connect_db does)."""
+    return lambda: connect(db.info.dbname)
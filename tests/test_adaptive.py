@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+import adaptive
+from adaptive import AIMD, AsyncSlots, Slots
+
+SLOW_DOWN = ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A manual clock for AIMD windows: clock.now is what time.monotonic()
+    returns inside adaptive."""
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(adaptive, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def controller(initial, minimum=1, maximum=16):
+    changes = []
+    ctl = AIMD(initial, minimum, maximum, window=1.0,
+               on_change=lambda old, new, reason: changes.append((old, new)))
+    return ctl, changes
+
+
+def window(ctl, clock, nbytes=0, done=1, errors=0, throttles=0, busy=True):
+    """Feed one window's worth of observations and close it."""
+    if busy:
+        ctl.busy(ctl.limit)
+    for _ in range(errors):
+        ctl.observe(error=ValueError("bad zip"))
+    for _ in range(throttles):
+        ctl.observe(error=SLOW_DOWN)
+    for _ in range(done - 1):
+        ctl.observe(done=True)
+    clock.now += ctl.window
+    ctl.observe(nbytes, done=done > 0)
+    return ctl.limit
+
+
+def test_additive_increase_while_throughput_rises(clock):
+    ctl, changes = controller(2)
+    assert [window(ctl, clock, n) for n in (1000, 2000, 4000)] == [3, 4, 5]
+    assert changes == [(2, 3), (3, 4), (4, 5)]
+
+
+def test_no_increase_unless_every_slot_was_busy(clock):
+    ctl, changes = controller(2)
+    assert [window(ctl, clock, n, busy=False) for n in (1000, 2000, 4000)] == [2, 2, 2]
+    assert changes == []
+
+
+def test_increase_without_gain_is_undone_then_probed(clock):
+    ctl, _ = controller(2)
+    limits = [window(ctl, clock, 1000) for _ in range(6)]
+    # Up one, no gain so back down, then PROBE_AFTER flat windows and a probe.
+    assert limits == [3, 2, 2, 2, 2, 3]
+    assert adaptive.PROBE_AFTER == 3
+
+
+def test_empty_window_changes_nothing(clock):
+    ctl, changes = controller(4)
+    assert window(ctl, clock, done=0) == 4
+    assert changes == []
+
+
+def test_throttle_halves(clock):
+    ctl, changes = controller(8)
+    assert window(ctl, clock, 1000, done=20, throttles=1) == 4
+    assert window(ctl, clock, 1000, done=20, throttles=1) == 2
+    assert changes == [(8, 4), (4, 2)]
+
+
+def test_error_rate_halves(clock):
+    ctl, _ = controller(8)
+    # 1 error in 11 attempts is within ERROR_RATE; 2 in 12 is not.
+    assert window(ctl, clock, 1000, done=10, errors=1, busy=False) == 8
+    assert window(ctl, clock, 1000, done=10, errors=2, busy=False) == 4
+
+
+def test_clamped_to_bounds(clock):
+    assert AIMD(100, 2, 8).limit == 8
+    assert AIMD(0, 2, 8).limit == 2
+    ctl = AIMD(1, 0, 0)
+    assert (ctl.minimum, ctl.maximum, ctl.limit) == (1, 1, 1)
+
+    ctl, changes = controller(3, minimum=2, maximum=4)
+    assert window(ctl, clock, 1000, throttles=1) == 2
+    assert window(ctl, clock, 1000, throttles=1) == 2
+    assert [window(ctl, clock, n) for n in (2000, 4000, 8000)] == [3, 4, 4]
+    assert changes == [(3, 2), (2, 3), (3, 4)]
+
+
+def test_slots_admit_at_most_limit():
+    ctl = AIMD(3, 1, 16, window=3600)
+    slots = Slots(ctl)
+    lock, held, peak = threading.Lock(), [0], [0]
+
+    def download():
+        with slots.slot():
+            with lock:
+                held[0] += 1
+                peak[0] = max(peak[0], held[0])
+            time.sleep(0.01)
+            with lock:
+                held[0] -= 1
+
+    threads = [threading.Thread(target=download) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (peak[0], slots.active) == (3, 0)
+
+
+def test_slots_wait_for_a_lowered_limit():
+    ctl = AIMD(2, 1, 16, window=3600)
+    slots = Slots(ctl)
+    release, entered = threading.Event(), []
+
+    def download(n):
+        with slots.slot():
+            entered.append(n)
+            release.wait()
+
+    first = [threading.Thread(target=download, args=(n,)) for n in range(2)]
+    for t in first:
+        t.start()
+    while len(entered) < 2:
+        time.sleep(0.001)
+    ctl.limit = 1
+    late = threading.Thread(target=download, args=(2,))
+    late.start()
+    time.sleep(0.05)
+    # Both holders have to leave before the late one fits under limit 1.
+    assert sorted(entered) == [0, 1]
+    release.set()
+    for t in (*first, late):
+        t.join()
+    assert sorted(entered) == [0, 1, 2] and slots.active == 0
+
+
+@pytest.mark.parametrize("error", [SLOW_DOWN, ValueError("bad zip")])
+def test_slots_report_failures(clock, error):
+    ctl, changes = controller(8)
+    slots = Slots(ctl)
+    with pytest.raises(type(error)):
+        with slots.slot():
+            raise error
+    clock.now += ctl.window
+    ctl.observe()
+    assert (changes, slots.active) == ([(8, 4)], 0)
+
+
+def test_async_slots_admit_at_most_limit():
+    ctl = AIMD(3, 1, 16, window=3600)
+    held, peak = [0], [0]
+
+    async def main():
+        slots = AsyncSlots(ctl)
+
+        async def download():
+            async with slots.slot():
+                held[0] += 1
+                peak[0] = max(peak[0], held[0])
+                await asyncio.sleep(0.01)
+                held[0] -= 1
+
+        await asyncio.gather(*(download() for _ in range(12)))
+        return slots
+
+    slots = asyncio.run(main())
+    assert (peak[0], slots.active) == (3, 0)
@@ -0,0 +1,202 @@
+import asyncio
+import os
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("aiobotocore")
+
+import async_engine  # noqa: E402
+import catalog  # noqa: E402
+import jobs  # noqa: E402
+from async_engine import MemoryBudget  # noqa: E402
+
+WORKER = "test-loader"
+
+
+def test_memory_budget():
+    budget = MemoryBudget(100)
+    assert budget.reserve("a", 60)
+    assert not budget.reserve("b", 50)   # would go over: spooled instead
+    assert budget.reserve("b", 40)
+    assert budget.used == 100
+
+    budget.release("a")
+    budget.release("a")                  # releasing twice is harmless
+    assert budget.used == 40
+    budget.release("never-reserved")
+    assert budget.used == 40
+    assert budget.reserve("c", 60)
+
+
+# ── asyncpg statements against Postgres ───────────────────────────────────────
+
+
+def run(db, test):
+    """Run `test(pool)` with an asyncpg pool on the `db` database."""
+    async def main():
+        pool = await asyncpg.create_pool(
+            host=db.info.host, port=db.info.port, database=db.info.dbname,
+            user=db.info.user, password=os.environ.get("POSTGRES_PASSWORD"),
+            min_size=1, max_size=2,
+        )
+        try:
+            return await test(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+
+def add_objects(conn, keys, state="pending"):
+    with conn.cursor() as cur:
+        for key in keys:
+            cur.execute(
+                "INSERT INTO s3_objects (s3_key, kind, etag, size, last_modified, state, "
+                "attempts, claimed_by) VALUES (%s, %s, 'e1', 100, now(), %s, %s, %s)",
+                (key, "epub" if key.endswith(".epub") else "m4b", state,
+                 int(state == "running"), WORKER if state == "running" else None),
+            )
+    conn.commit()
+
+
+def execute(conn, sql):
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+def query(conn, sql):
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+def test_claim_and_fail(db):
+    add_objects(db, ["a.epub", "b.epub", "c.m4b"])
+
+    async def test(pool):
+        claimed = [row async for row in async_engine.claims(pool, WORKER, 2, 60)]
+        async with pool.acquire() as conn:
+            execute(db, "UPDATE s3_objects SET etag = 'e2' WHERE s3_key = 'c.m4b'")
+            results = [
+                await async_engine.fail(conn, WORKER, "a.epub", "e1", "bad zip"),
+                await async_engine.fail(conn, "other-loader", "b.epub", "e1", "bad zip"),
+                await async_engine.fail(conn, WORKER, "c.m4b", "e1", "bad chapters"),
+            ]
+        return claimed, results
+
+    claimed, (a, b, c) = run(db, test)
+    assert claimed == [
+        ("a.epub", 100, "e1", False, False),
+        ("b.epub", 100, "e1", False, False),
+        ("c.m4b", 100, "e1", False, False),
+    ]
+    assert a[:2] == ("failed", 1) and a[2] is not None
+    assert b is None and jobs.describe_failure(b).startswith("job was taken over")
+    assert c == ("pending", 1, None)
+    assert query(db, "SELECT s3_key, state, last_error, claimed_by FROM s3_objects ORDER BY s3_key") == [
+        ("a.epub", "failed", "bad zip", None),
+        ("b.epub", "running", None, WORKER),
+        ("c.m4b", "pending", None, None),
+    ]
+
+
+def records(n_epubs=5, n_m4bs=2, authors=2):
+    return [
+        ("epub", f"book{i}.epub", "e1",
+         {"title": f"Book {i}", "description": "A\x00 book.", "series_position": 1.5},
+         [(f"Author {i}.{j}", "aut", j + 1) for j in range(authors)])
+        for i in range(n_epubs)
+    ] + [
+        ("m4b", f"audio{i}.m4b", "e1",
+         {"title": f"Audio {i}", "duration_s": 3600, "has_cover": True},
+         [(j + 1, f"Chapter {j + 1}", j * 60000) for j in range(3)])
+        for i in range(n_m4bs)
+    ]
+
+
+def catalog_rows(conn):
+    return [
+        query(conn, "SELECT to_jsonb(t) - 'id' - 'imported_at' - 'updated_at' FROM epubs t ORDER BY s3_key"),
+        query(conn, "SELECT to_jsonb(t) - 'id' - 'imported_at' - 'updated_at' FROM m4bs t ORDER BY s3_key"),
+        query(conn, "SELECT e.s3_key, a.author, a.role, a.position FROM epub_authors a "
+                    "JOIN epubs e ON e.id = a.epub_id ORDER BY e.s3_key, a.position"),
+        query(conn, "SELECT m.s3_key, c.position, c.title, c.start_ms FROM m4b_chapters c "
+                    "JOIN m4bs m ON m.id = c.m4b_id ORDER BY m.s3_key, c.position"),
+        query(conn, "SELECT s3_key, state, loaded_etag, claimed_by FROM s3_objects ORDER BY s3_key"),
+    ]
+
+
+def test_write_records_matches_catalog(db, monkeypatch):
+    """The asyncpg writer stores exactly what catalog.write_records does,
+    also when its statements are split to fit the parameter limit."""
+    batch = records()
+    add_objects(db, [r[1] for r in batch], state="running")
+    with db:
+        catalog.write_records(db, batch)
+    expected = catalog_rows(db)
+    execute(db, "TRUNCATE epubs, m4bs CASCADE")
+    execute(db, f"UPDATE s3_objects SET state = 'running', loaded_etag = NULL, claimed_by = '{WORKER}'")
+
+    monkeypatch.setattr(async_engine, "MAX_PARAMS", 40)   # two records per upsert
+
+    async def test(pool):
+        async with pool.acquire() as conn, conn.transaction():
+            return await async_engine.write_records(conn, batch)
+
+    ids = run(db, test)
+    assert catalog_rows(db) == expected
+    assert sorted(ids.items()) == sorted(
+        query(db, "SELECT s3_key, id FROM epubs UNION ALL SELECT s3_key, id FROM m4bs")
+    )
+    assert expected[4][0] == ("audio0.m4b", "done", "e1", None)
+
+
+def test_write_records_replaces_children(db):
+    add_objects(db, ["book0.epub"], state="running")
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            for authors in (3, 1):
+                async with conn.transaction():
+                    await async_engine.write_records(conn, records(1, 0, authors))
+
+    run(db, test)
+    assert query(db, "SELECT author FROM epub_authors") == [("Author 0.0",)]
+    assert query(db, "SELECT count(*) FROM epubs") == [(1,)]
+
+
+def test_batch_writer_bad_record_fails_alone(db):
+    batch = records(3, 0)
+    batch[1] = batch[1][:4] + ([("Ada Byrne", "aut")],)   # malformed author row
+    add_objects(db, [r[1] for r in batch], state="running")
+
+    async def test(pool):
+        writer = async_engine.AsyncBatchWriter(pool)
+        for record in batch:
+            writer.add(record, f"cover-{record[1]}")
+        return await writer.write(writer.take())
+
+    written, failed = run(db, test)
+    assert [(r[1], extra) for r, _, extra in written] == [
+        ("book0.epub", "cover-book0.epub"), ("book2.epub", "cover-book2.epub"),
+    ]
+    assert [(r[1], type(e)) for r, e in failed] == [("book1.epub", ValueError)]
+    assert query(db, "SELECT s3_key, state FROM s3_objects ORDER BY s3_key") == [
+        ("book0.epub", "done"), ("book1.epub", "running"), ("book2.epub", "done"),
+    ]
+
+
+def test_sync_manifest_matches_catalog(db):
+    now = query(db, "SELECT now()")[0][0]
+    listing = [(f"k{i}.epub", "epub", f"e{i}", 100 + i, now) for i in range(5)]
+
+    async def test(pool):
+        async with pool.acquire() as conn:
+            return await async_engine.sync_manifest(conn, listing)
+
+    to_load, gone = run(db, test)
+    assert (to_load, gone) == ([(f"k{i}.epub", 100 + i, f"e{i}", False) for i in range(5)], 0)
+    assert catalog.sync_manifest(db, listing[1:]) == (to_load[1:], 1)
@@ -0,0 +1,142 @@
+import concurrent.futures
+import signal
+
+import pytest
+
+import backfill
+
+NAMES = ["epub-identifiers"]
+KEYS = [f"book{n}.epub" for n in range(1, 6)]
+
+
+class Crash(BaseException):
+    """The process dying mid-batch: nothing after it runs or commits."""
+
+
+@pytest.fixture
+def catalog(db):
+    """Five loaded epubs with done jobs; returns their ids in key order."""
+    with db.cursor() as cur:
+        for key in KEYS:
+            cur.execute(
+                "INSERT INTO s3_objects (s3_key, kind, etag, size, last_modified, loaded_etag, state) "
+                "VALUES (%s, 'epub', 'e1', 100, now(), 'e1', 'done')",
+                (key,),
+            )
+            cur.execute("INSERT INTO epubs (s3_key, title) VALUES (%s, %s) RETURNING id", (key, key))
+    db.commit()
+    with db.cursor() as cur:
+        cur.execute("SELECT id FROM epubs ORDER BY s3_key")
+        ids = [row[0] for row in cur.fetchall()]
+    db.commit()
+    return ids
+
+
+@pytest.fixture
+def extracted(monkeypatch, connect_db):
+    """Runs backfills in-process against the test database, with an
+    extractor that records the keys it is called for instead of reading
+    the bucket."""
+    keys = []
+
+    def extract(kind, key, size, names):
+        keys.append(key)
+        return {"asin": f"B-{key}", "isbn": None, "identifier": f"urn:{key}"}, None, None, size
+
+    monkeypatch.setattr(backfill, "extract", extract)
+    monkeypatch.setattr(backfill.ld, "connect_db", connect_db)
+    monkeypatch.setattr(
+        concurrent.futures, "ProcessPoolExecutor",
+        lambda **_: concurrent.futures.ThreadPoolExecutor(max_workers=2),
+    )
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    yield keys
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+
+def run(batch=2):
+    backfill.Backfill("ids", NAMES, workers=2, batch=batch, rate=0, yield_to_loader=False).run()
+
+
+def checkpoint(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT state, last_epub_id, updated_rows, bytes_fetched FROM backfills WHERE name = 'ids'"
+        )
+        row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def asins(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT asin FROM epubs ORDER BY s3_key")
+        rows = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return rows
+
+
+def test_resume_after_interrupted_checkpoint(db, catalog, extracted, monkeypatch):
+    write_batch, batches = backfill.write_batch, []
+
+    def crash_in_second_batch(conn, kind, columns, results):
+        updated = write_batch(conn, kind, columns, results)
+        batches.append(updated)
+        if len(batches) == 2:
+            raise Crash()  # after the UPDATE, before its checkpoint commits
+        return updated
+
+    monkeypatch.setattr(backfill, "write_batch", crash_in_second_batch)
+    with pytest.raises(Crash):
+        run()
+
+    # The first batch and its checkpoint committed; the second rolled back.
+    assert checkpoint(db) == ("running", catalog[1], 2, 200)
+    assert asins(db) == ["B-book1.epub", "B-book2.epub", None, None, None]
+
+    monkeypatch.setattr(backfill, "write_batch", write_batch)
+    extracted.clear()
+    run()
+
+    # The resumed run starts from the checkpoint and redoes the lost batch.
+    assert extracted == KEYS[2:]
+    assert checkpoint(db) == ("done", catalog[4], 5, 500)
+    assert asins(db) == [f"B-{key}" for key in KEYS]
+
+
+def test_resume_after_pause(db, catalog, extracted, monkeypatch):
+    write_batch = backfill.write_batch
+
+    def pause_after_first_batch(conn, kind, columns, results):
+        backfill.pause("ids")
+        return write_batch(conn, kind, columns, results)
+
+    monkeypatch.setattr(backfill, "write_batch", pause_after_first_batch)
+    run()
+    assert checkpoint(db) == ("paused", catalog[1], 2, 200)
+
+    monkeypatch.setattr(backfill, "write_batch", write_batch)
+    extracted.clear()
+    run()
+    assert extracted == KEYS[2:]
+    assert checkpoint(db)[:3] == ("done", catalog[4], 5)
+
+
+def test_skips_rows_reloaded_meanwhile(db, catalog, extracted, monkeypatch):
+    """A row the loader reloads between read and write keeps its new values
+    and counts as skipped."""
+    write_batch = backfill.write_batch
+
+    def reload_first(conn, kind, columns, results):
+        with db.cursor() as cur:
+            cur.execute("UPDATE s3_objects SET etag = 'e2', loaded_etag = 'e2' WHERE s3_key = %s", (KEYS[0],))
+        db.commit()
+        return write_batch(conn, kind, columns, results)
+
+    monkeypatch.setattr(backfill, "write_batch", reload_first)
+    run(batch=10)
+    with db.cursor() as cur:
+        cur.execute("SELECT state, updated_rows, skipped_rows FROM backfills WHERE name = 'ids'")
+        assert cur.fetchone() == ("done", 4, 1)
+    assert asins(db) == [None] + [f"B-{key}" for key in KEYS[1:]]
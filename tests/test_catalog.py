@@ -0,0 +1,60 @@
+from catalog import BatchWriter
+import jobs
+
+
+def epub(key, title, authors=(("Ada Byrne", "aut", 1),)):
+    return ("epub", key, "e1", {"title": title, "description": "A book."}, list(authors))
+
+
+def add_objects(conn, *keys):
+    with conn.cursor() as cur:
+        for key in keys:
+            cur.execute(
+                "INSERT INTO s3_objects (s3_key, kind, etag, size, last_modified, state, "
+                "attempts, claimed_by) VALUES (%s, 'epub', 'e1', 100, now(), 'running', 1, 'w')",
+                (key,),
+            )
+    conn.commit()
+
+
+def test_flush_strips_nul(db):
+    add_objects(db, "a.epub", "b.epub")
+    writer = BatchWriter(db)
+    writer.add(epub("a.epub", "Harbor\x00 Signal", [("Ada\x00 Byrne", "aut", 1)]), "cover-a")
+    writer.add(epub("b.epub", "Amber River"), "cover-b")
+
+    written, failed = writer.flush()
+    assert failed == []
+    assert [(record[1], extra) for record, _, extra in written] == [
+        ("a.epub", "cover-a"), ("b.epub", "cover-b"),
+    ]
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT e.title, e.author_names, a.author FROM epubs e "
+            "JOIN epub_authors a ON a.epub_id = e.id WHERE e.s3_key = 'a.epub'"
+        )
+        assert cur.fetchone() == ("Harbor Signal", "Ada Byrne", "Ada Byrne")
+        cur.execute("SELECT s3_key, state FROM s3_objects ORDER BY s3_key")
+        assert cur.fetchall() == [("a.epub", "done"), ("b.epub", "done")]
+
+
+def test_flush_bad_record_fails_alone(db):
+    """A record that fails to write, for any reason, is returned as failed
+    and the rest of its batch is written."""
+    add_objects(db, "a.epub", "b.epub", "c.epub")
+    writer = BatchWriter(db)
+    writer.add(epub("a.epub", "Amber River"))
+    writer.add(epub("b.epub", "Broken", [("Ada Byrne", "aut")]))  # malformed author row
+    writer.add(epub("c.epub", "Iron Crown"))
+
+    written, failed = writer.flush()
+    assert [record[1] for record, _, _ in written] == ["a.epub", "c.epub"]
+    assert [(record[1], type(e)) for record, e in failed] == [("b.epub", ValueError)]
+
+    # The loader records the failure on the job and carries on.
+    (_, key, etag, *_), e = failed[0]
+    state, attempts, _ = jobs.fail(db, "w", key, etag, f"write: {e}")
+    assert (state, attempts) == ("failed", 1)
+    with db.cursor() as cur:
+        cur.execute("SELECT s3_key FROM epubs ORDER BY s3_key")
+        assert cur.fetchall() == [("a.epub",), ("c.epub",)]
@@ -0,0 +1,82 @@
+import io
+import random
+
+import pytest
+
+from chapters import SAMPLE_GAP, read_chapters
+from make_corpus import m4b_bytes, make_m4b
+from mp4atoms import AtomError, read_moov
+
+# Seeds 0-23 of make_m4b cover every chapter format (QuickTime track, Nero
+# chpl, both, none) with moov both before and after mdat.
+SEEDS = range(24)
+
+
+class CountingFile(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def corpus_m4b(seed, audio_bytes=4096, interleave=False):
+    f = CountingFile(m4b_bytes(make_m4b(random.Random(seed), seed, audio_bytes, interleave)))
+    return read_moov(f), f
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_read_chapters(seed):
+    header, f = corpus_m4b(seed)
+    chapters = read_chapters(header, f)
+
+    assert [pos for pos, _, _ in chapters] == list(range(1, len(chapters) + 1))
+    for pos, title, _ in chapters:
+        assert title.startswith(f"Chapter {pos}: ")
+    starts = [start for _, _, start in chapters]
+    assert starts == sorted(set(starts))
+    assert not chapters or starts[0] == 0
+    if b"chpl" not in header and b"chap" not in header:
+        assert chapters == []
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_read_chapters_without_file(seed):
+    """Without a file object only chpl can be read; QuickTime-only files
+    report that their chapters need one."""
+    header, f = corpus_m4b(seed)
+    chapters = read_chapters(header)
+    if b"chpl" in header:
+        # With both formats, the QuickTime track and chpl agree.
+        assert chapters == read_chapters(header, f)
+    elif b"chap" in header:
+        assert chapters is None
+    else:
+        assert chapters == []
+
+
+def test_read_chapters_corpus_covers_every_format():
+    formats = set()
+    for seed in SEEDS:
+        header, _ = corpus_m4b(seed)
+        formats.add((b"chap" in header, b"chpl" in header))
+    assert formats == {(True, False), (False, True), (True, True), (False, False)}
+
+
+def test_read_chapters_truncated_moov():
+    header, f = corpus_m4b(0)
+    with pytest.raises(AtomError):
+        read_chapters(header[:len(header) - 40], f)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_read_chapters_interleaved(seed):
+    """Chapter samples stored between audio chunks read the same as stored
+    together, and at most SAMPLE_GAP of audio is read per chapter."""
+    audio_bytes = 4 * 1024 * 1024
+    header, f = corpus_m4b(seed, audio_bytes, interleave=True)
+    expected = read_chapters(*corpus_m4b(seed, audio_bytes))
+    f.bytes_read = 0
+    assert read_chapters(header, f) == expected
+    assert f.bytes_read <= len(expected) * (SAMPLE_GAP + 256)
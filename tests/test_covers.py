@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import threading
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import covers  # noqa: E402
+from covers import (  # noqa: E402
+    _atomic_symlink, blob_path, derived_path, ensure_derivatives, gc, save_record_cover,
+    store_blob,
+)
+
+
+def png(color, size=(40, 60)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+RED, BLUE = png("red"), png("blue")
+
+
+def leftovers(root):
+    return [p for p in root.rglob(".tmp-*")]
+
+
+def test_store_blob_dedup(tmp_path):
+    digest, path, written = store_blob(tmp_path, RED, "png")
+    assert written and path == blob_path(tmp_path, digest, "png")
+    assert path.read_bytes() == RED
+    mtime = path.stat().st_mtime_ns
+
+    assert store_blob(tmp_path, RED, "png") == (digest, path, False)
+    assert path.stat().st_mtime_ns == mtime
+    assert store_blob(tmp_path, BLUE, "png")[0] != digest
+    assert len(list((tmp_path / "blobs").rglob("*.png"))) == 2
+
+
+def test_atomic_symlink_replaces_link(tmp_path):
+    a, b = tmp_path / "blobs" / "a.png", tmp_path / "blobs" / "b.png"
+    a.parent.mkdir()
+    a.write_bytes(RED)
+    b.write_bytes(BLUE)
+    link = tmp_path / "epub" / "1.png"
+    link.parent.mkdir()
+
+    assert _atomic_symlink(a, link) is True
+    assert os.readlink(link) == "../blobs/a.png" and link.read_bytes() == RED
+    assert _atomic_symlink(a, link) is False
+    assert _atomic_symlink(b, link) is True
+    assert os.readlink(link) == "../blobs/b.png" and link.read_bytes() == BLUE
+    assert leftovers(tmp_path) == []
+
+
+def test_atomic_symlink_replaces_legacy_dir(tmp_path):
+    target = tmp_path / "derived" / "ab" / "abc"
+    target.mkdir(parents=True)
+    legacy = tmp_path / "epub" / "1"
+    legacy.mkdir(parents=True)
+    (legacy / "160.webp").write_bytes(b"old")
+
+    assert _atomic_symlink(target, legacy) is True
+    assert legacy.is_symlink() and legacy.resolve() == target.resolve()
+
+
+def test_save_record_cover_status(tmp_path):
+    assert save_record_cover("epub", 1, RED, "png", tmp_path, derivatives=False)[1] == "new"
+    assert save_record_cover("m4b", 7, RED, "png", tmp_path, derivatives=False)[1] == "linked"
+    assert save_record_cover("epub", 1, RED, "png", tmp_path, derivatives=False)[1] == "unchanged"
+
+
+def test_gc_keeps_referenced_blobs(tmp_path):
+    red, _ = save_record_cover("epub", 1, RED, "png", tmp_path)
+    save_record_cover("m4b", 2, RED, "png", tmp_path)
+    blue, _ = save_record_cover("epub", 3, BLUE, "png", tmp_path)
+    orphan, _, _ = store_blob(tmp_path, png("green"), "png")
+
+    assert gc(tmp_path) == 1
+    assert not blob_path(tmp_path, orphan, "png").exists()
+    for digest in (red, blue):
+        assert blob_path(tmp_path, digest, "png").exists()
+        assert derived_path(tmp_path, digest).is_dir()
+
+    # Relinking epub 3 to the red cover leaves blue unreferenced.
+    save_record_cover("epub", 3, RED, "png", tmp_path)
+    assert gc(tmp_path) == 2
+    assert not blob_path(tmp_path, blue, "png").exists()
+    assert not derived_path(tmp_path, blue).exists()
+    assert (tmp_path / "epub" / "3.png").read_bytes() == RED
+
+
+def test_ensure_derivatives(tmp_path):
+    digest, blob, _ = store_blob(tmp_path, png("red", (400, 600)), "png")
+    dest = ensure_derivatives(tmp_path, digest, blob)
+    manifest = json.loads((dest / "manifest.json").read_text())
+    assert manifest["sizes"] == sorted(covers.COVER_SIZES)
+    assert {v["file"] for v in manifest["variants"]} <= set(os.listdir(dest))
+    assert ensure_derivatives(tmp_path, digest, blob) == dest
+    assert leftovers(tmp_path) == []
+
+
+def test_ensure_derivatives_keeps_a_concurrent_build(tmp_path, monkeypatch):
+    """A worker that finishes second discards its build instead of deleting
+    the directory the first one put in place."""
+    digest, blob, _ = store_blob(tmp_path, RED, "png")
+    make_derivatives, calls, first = covers.make_derivatives, [], []
+
+    def racing(src, out_dir, **kwargs):
+        calls.append(out_dir)
+        if len(calls) == 1:
+            # The other worker builds and renames into place meanwhile.
+            dest = ensure_derivatives(tmp_path, digest, blob)
+            first.extend((dest, dest.stat().st_ino))
+        return make_derivatives(src, out_dir, **kwargs)
+
+    monkeypatch.setattr(covers, "make_derivatives", racing)
+    dest = ensure_derivatives(tmp_path, digest, blob)
+    assert len(calls) == 2
+    assert dest == first[0] and dest.stat().st_ino == first[1]
+    assert leftovers(tmp_path) == []
+
+
+def test_ensure_derivatives_from_many_threads(tmp_path):
+    digest, blob, _ = store_blob(tmp_path, RED, "png")
+    start, errors = threading.Barrier(8), []
+
+    def build():
+        start.wait()
+        try:
+            dest = ensure_derivatives(tmp_path, digest, blob)
+            json.loads((dest / "manifest.json").read_text())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and leftovers(tmp_path) == []
+
+
+def test_ensure_derivatives_replaces_stale(tmp_path):
+    digest, blob, _ = store_blob(tmp_path, RED, "png")
+    dest = derived_path(tmp_path, digest)
+    dest.mkdir(parents=True)
+    (dest / "manifest.json").write_text(json.dumps({"sizes": [1]}))
+    (dest / "1.webp").write_bytes(b"old")
+
+    ensure_derivatives(tmp_path, digest, blob)
+    assert json.loads((dest / "manifest.json").read_text())["sizes"] == sorted(covers.COVER_SIZES)
+    assert not (dest / "1.webp").exists()
+    assert leftovers(tmp_path) == []
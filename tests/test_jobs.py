@@ -0,0 +1,151 @@
+import datetime
+
+import pytest
+
+import jobs
+
+WORKER = "test-loader"
+
+
+def add_object(conn, key, etag="e1"):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO s3_objects (s3_key, kind, etag, size, last_modified) "
+            "VALUES (%s, 'epub', %s, 100, now())",
+            (key, etag),
+        )
+    conn.commit()
+
+
+def job(conn, key):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT state, attempts, next_attempt_at - now(), last_error, claimed_by "
+            "FROM s3_objects WHERE s3_key = %s",
+            (key,),
+        )
+        row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def backoff_over(conn, key):
+    """Make a failed job claimable now, as if its backoff had passed."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE s3_objects SET next_attempt_at = now() - interval '1 second' "
+            "WHERE s3_key = %s",
+            (key,),
+        )
+    conn.commit()
+
+
+def test_claim_and_fail_backs_off(db):
+    add_object(db, "a.epub")
+    assert [row[0] for row in jobs.claim(db, WORKER, 10, 60)] == ["a.epub"]
+    state, attempts, _, _, claimed_by = job(db, "a.epub")
+    assert (state, attempts, claimed_by) == ("running", 1, WORKER)
+
+    delays = []
+    for attempt in range(1, jobs.QUARANTINE_AFTER):
+        state, attempts, _ = jobs.fail(db, WORKER, "a.epub", "e1", "bad zip")
+        assert (state, attempts) == ("failed", attempt)
+        _, _, delay, last_error, claimed_by = job(db, "a.epub")
+        assert (last_error, claimed_by) == ("bad zip", None)
+        delays.append(round(delay.total_seconds()))
+        # Not claimable until the backoff has passed.
+        assert jobs.claim(db, WORKER, 10, 60) == []
+        backoff_over(db, "a.epub")
+        assert len(jobs.claim(db, WORKER, 10, 60)) == 1
+
+    base = jobs.RETRY_BASE_SECONDS
+    expected = [min(base * 2 ** i, jobs.RETRY_MAX_SECONDS) for i in range(len(delays))]
+    assert delays == pytest.approx(expected, abs=2)
+
+
+def test_quarantine_after_attempts(db):
+    add_object(db, "a.epub")
+    for _ in range(jobs.QUARANTINE_AFTER - 1):
+        jobs.claim(db, WORKER, 10, 60)
+        jobs.fail(db, WORKER, "a.epub", "e1", "bad zip")
+        backoff_over(db, "a.epub")
+
+    jobs.claim(db, WORKER, 10, 60)
+    state, attempts, _ = jobs.fail(db, WORKER, "a.epub", "e1", "bad zip")
+    assert (state, attempts) == ("quarantined", jobs.QUARANTINE_AFTER)
+    backoff_over(db, "a.epub")
+    assert jobs.claim(db, WORKER, 10, 60) == []
+
+    assert jobs.requeue(db, states=("quarantined",)) == ["a.epub"]
+    assert job(db, "a.epub")[:2] == ("pending", 0)
+    assert len(jobs.claim(db, WORKER, 10, 60)) == 1
+
+
+def test_expired_lease_quarantined(db):
+    """A job whose process keeps dying is quarantined instead of reclaimed."""
+    add_object(db, "a.epub")
+    add_object(db, "b.epub")
+    with db.cursor() as cur:
+        cur.execute(
+            "UPDATE s3_objects SET state = 'running', claimed_by = 'dead', "
+            "lease_until = now() - interval '1 minute', attempts = %s",
+            (jobs.QUARANTINE_AFTER,),
+        )
+        cur.execute("UPDATE s3_objects SET attempts = 1 WHERE s3_key = 'b.epub'")
+    db.commit()
+
+    # b's lease expired with attempts to spare: reclaimed.
+    assert [(row[0], row[4]) for row in jobs.claim(db, WORKER, 10, 60)] == [("b.epub", True)]
+    state, _, _, last_error, claimed_by = job(db, "a.epub")
+    assert (state, claimed_by) == ("quarantined", None)
+    assert last_error == f"lease expired {jobs.QUARANTINE_AFTER} times"
+
+
+def test_claim_leases(db):
+    add_object(db, "a.epub")
+    add_object(db, "b.epub")
+    assert [row[0] for row in jobs.claim(db, WORKER, 1, 60)] == ["a.epub"]
+    assert [row[0] for row in jobs.claim(db, "other-loader", 10, 60)] == ["b.epub"]
+    # Both are leased: nothing left to claim.
+    assert jobs.claim(db, WORKER, 10, 60) == []
+
+    with db.cursor() as cur:
+        cur.execute(
+            "UPDATE s3_objects SET lease_until = now() - interval '1 minute' "
+            "WHERE s3_key = 'b.epub'"
+        )
+    db.commit()
+    # b's holder died: its expired lease is reclaimed, and flagged as such.
+    assert [(row[0], row[4]) for row in jobs.claim(db, WORKER, 10, 60)] == [("b.epub", True)]
+    state, attempts, _, _, claimed_by = job(db, "b.epub")
+    assert (state, attempts, claimed_by) == ("running", 2, WORKER)
+
+
+def test_fail_after_etag_changed(db):
+    add_object(db, "a.epub")
+    jobs.claim(db, WORKER, 10, 60)
+    with db.cursor() as cur:
+        cur.execute("UPDATE s3_objects SET etag = 'e2' WHERE s3_key = 'a.epub'")
+    db.commit()
+
+    state, _, next_attempt_at = jobs.fail(db, WORKER, "a.epub", "e1", "bad zip")
+    assert (state, next_attempt_at) == ("pending", None)
+    assert job(db, "a.epub")[3] is None
+
+
+def test_fail_after_takeover(db):
+    add_object(db, "a.epub")
+    jobs.claim(db, WORKER, 10, 60)
+    assert jobs.fail(db, "other-loader", "a.epub", "e1", "bad zip") is None
+    assert jobs.describe_failure(None) == "job was taken over by another replica"
+    assert job(db, "a.epub")[0] == "running"
+
+
+def test_release(db):
+    add_object(db, "a.epub")
+    add_object(db, "b.epub")
+    jobs.claim(db, WORKER, 10, 60)
+    jobs.fail(db, WORKER, "b.epub", "e1", "bad zip")
+    assert jobs.release(db, WORKER) == 1
+    assert job(db, "a.epub")[0] == "pending"
+    assert isinstance(job(db, "b.epub")[2], datetime.timedelta)
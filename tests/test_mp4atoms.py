@@ -0,0 +1,83 @@
+import io
+import random
+import struct
+
+import pytest
+
+from make_corpus import box, m4b_bytes, make_m4b
+from mp4atoms import AtomError, iter_atoms, read_moov
+from s3io import S3RangeFile
+from test_s3io import RangeS3
+
+AUDIO_BYTES = 4 * 1024 * 1024
+BLOCK       = 64 * 1024
+
+
+def corpus_m4b(moov_first):
+    """The first make_corpus M4B with moov before (or after) mdat, as bytes,
+    and its ftyp + moov."""
+    for seed in range(100):
+        data = m4b_bytes(make_m4b(random.Random(seed), seed, AUDIO_BYTES))
+        moov = data.index(b"moov") - 4
+        if (moov < AUDIO_BYTES) == moov_first:
+            ftyp_size = struct.unpack(">I", data[:4])[0]
+            moov_size = struct.unpack(">I", data[moov:moov + 4])[0]
+            return data, data[:ftyp_size] + data[moov:moov + moov_size]
+    raise AssertionError("no such seed")
+
+
+def range_file(data):
+    s3 = RangeS3(data)
+    return S3RangeFile(s3, "books", "a.m4b", len(data), block_size=BLOCK), s3
+
+
+@pytest.mark.parametrize("moov_first", [True, False], ids=["moov-first", "moov-last"])
+def test_read_moov_skips_mdat(moov_first):
+    data, expected = corpus_m4b(moov_first)
+    f, s3 = range_file(data)
+    assert read_moov(f) == expected
+    # Never the audio: the first block (ftyp and the mdat header) and the
+    # blocks holding moov.
+    assert f.bytes_fetched <= len(expected) + 2 * BLOCK
+    assert len(s3.ranges) <= 2
+
+
+def test_iter_atoms():
+    data, _ = corpus_m4b(False)
+    atoms = [(kind, size) for kind, _, size, _ in iter_atoms(io.BytesIO(data))]
+    assert [kind for kind, _ in atoms] == [b"ftyp", b"mdat", b"moov"]
+    assert sum(size for _, size in atoms) == len(data)
+
+
+def test_extended_and_open_ended_sizes():
+    ftyp = box(b"ftyp", b"M4B ")
+    mdat = struct.pack(">I4sQ", 1, b"mdat", 16 + 1000) + bytes(1000)
+    moov = struct.pack(">I4s", 0, b"moov") + b"rest of file"
+    f = io.BytesIO(ftyp + mdat + moov)
+    assert [(k, s, h) for k, _, s, h in iter_atoms(f)] == [
+        (b"ftyp", len(ftyp), 8), (b"mdat", 1016, 16), (b"moov", 20, 8),
+    ]
+    assert read_moov(f) == ftyp + moov
+
+
+@pytest.mark.parametrize("cut, message", [
+    (-10, "truncated moov atom"),
+    (AUDIO_BYTES // 2, "no moov atom found"),   # inside mdat, before moov
+])
+def test_truncated_file(cut, message):
+    data, _ = corpus_m4b(False)
+    f, _ = range_file(data[:cut])
+    with pytest.raises(AtomError, match=message):
+        read_moov(f)
+
+
+def test_truncated_extended_header():
+    data = box(b"ftyp", b"M4B ") + struct.pack(">I4s", 1, b"mdat") + bytes(4)
+    with pytest.raises(AtomError, match="truncated 64-bit"):
+        read_moov(io.BytesIO(data))
+
+
+def test_invalid_atom_size():
+    data = box(b"ftyp", b"M4B ") + struct.pack(">I4s", 4, b"mdat")
+    with pytest.raises(AtomError, match="invalid atom size"):
+        read_moov(io.BytesIO(data))
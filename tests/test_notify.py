@@ -0,0 +1,171 @@
+import json
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import pytest
+
+import notify
+from notify import Receiver, parse_events, payload
+
+BUCKET = "books"
+WHEN   = "2026-01-01T00:00:00.000Z"
+
+
+def record(event, key, bucket=BUCKET, **obj):
+    return {
+        "eventName": f"s3:{event}",
+        "eventTime": WHEN,
+        "s3": {"bucket": {"name": bucket}, "object": {"key": key, **obj}},
+    }
+
+
+def test_parse_events():
+    created, removed = parse_events({"Records": [
+        record("ObjectCreated:Put", "new/a%20book+one.epub", size=10, eTag='"e1"'),
+        record("ObjectCreated:CompleteMultipartUpload", "Big%2FOne.M4B", size=20),
+        record("ObjectCreated:Put", "other.epub", bucket="elsewhere", size=1, eTag="x"),
+        record("ObjectCreated:Put", "cover.jpg", size=1, eTag="x"),
+        record("ObjectRemoved:Delete", "old.epub"),
+        record("ObjectCreated:Copy", "moved.epub", size=5, eTag="e5"),
+        record("ObjectRemoved:Delete", "moved.epub"),
+    ]}, BUCKET)
+
+    when = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert created == {
+        "new/a book one.epub": ("new/a book one.epub", "epub", "e1", 10, when),
+        "Big/One.M4B":         ("Big/One.M4B", "m4b", None, 20, when),
+    }
+    # The last record for a key wins.
+    assert removed == {"old.epub", "moved.epub"}
+
+
+def test_parse_events_recreated_after_removal():
+    created, removed = parse_events({"Records": [
+        record("ObjectRemoved:Delete", "a.epub"),
+        record("ObjectCreated:Put", "a.epub", size=1, eTag="e2"),
+    ]}, BUCKET)
+    assert list(created) == ["a.epub"] and removed == set()
+
+
+def test_parse_events_without_records():
+    assert parse_events({}, BUCKET) == ({}, set())
+    assert parse_events({"Records": None}, BUCKET) == ({}, set())
+
+
+def test_payload_round_trip():
+    created, _ = parse_events(payload("dir/a book?.epub", "e1", 7, bucket=BUCKET), BUCKET)
+    assert [row[:4] for row in created.values()] == [("dir/a book?.epub", "epub", "e1", 7)]
+    _, removed = parse_events(payload("dir/a book?.epub", removed=True, bucket=BUCKET), BUCKET)
+    assert removed == {"dir/a book?.epub"}
+
+
+class Conn:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    """A running Receiver for BUCKET whose apply_events calls are recorded
+    in receiver.applied, and whose HEADs in receiver.heads."""
+    applied, heads = [], []
+
+    def apply_events(conn, created, removed):
+        applied.append((created, set(removed)))
+        return [row[0] for row in created]
+
+    def head(key):
+        heads.append(key)
+        return "head-etag", 99
+
+    monkeypatch.setattr(notify, "apply_events", apply_events)
+    receiver = Receiver(0, Conn, head, BUCKET, token="secret").start()
+    receiver.applied, receiver.heads = applied, heads
+    yield receiver
+    receiver.stop()
+
+
+def post(receiver, body, token="secret"):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    request = urllib.request.Request(f"http://127.0.0.1:{receiver.port}/", data=body, method="POST")
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def test_receiver_applies_created_and_removed(receiver):
+    status, text = post(receiver, {"Records": [
+        record("ObjectCreated:Put", "a%20b.epub", size=10, eTag="e1"),
+        record("ObjectCreated:Put", "c.m4b"),
+        record("ObjectRemoved:Delete", "gone.m4b"),
+    ]})
+    assert (status, text) == (200, "2 keys queued\n")
+
+    [(created, removed)] = receiver.applied
+    assert [row[:4] for row in created] == [
+        ("a b.epub", "epub", "e1", 10),
+        ("c.m4b", "m4b", "head-etag", 99),
+    ]
+    assert removed == {"gone.m4b"}
+    assert receiver.heads == ["c.m4b"]
+    assert receiver.wake.is_set()
+
+
+@pytest.mark.parametrize("records", [
+    [record("ObjectCreated:Put", "a.epub", bucket="elsewhere", size=1, eTag="x")],
+    [record("ObjectCreated:Put", "notes.txt", size=1, eTag="x")],
+    [record("ObjectCreated:Put", "a.epub.part", size=1, eTag="x")],
+    [],
+])
+def test_receiver_ignores_irrelevant_records(receiver, records):
+    assert post(receiver, {"Records": records}) == (200, "0 keys queued\n")
+    assert receiver.applied == [] and receiver.heads == []
+    assert not receiver.wake.is_set()
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"[1, 2]", b'{"Records": [1]}'])
+def test_receiver_rejects_malformed_bodies(receiver, body):
+    status, text = post(receiver, body)
+    assert status == 400 and text.startswith("bad notification")
+    assert receiver.applied == []
+
+
+def test_receiver_requires_token(receiver):
+    body = payload("a.epub", "e1", 1, bucket=BUCKET)
+    assert post(receiver, body, token=None)[0] == 401
+    assert post(receiver, body, token="wrong")[0] == 401
+    assert receiver.applied == []
+
+
+def test_receiver_reports_database_errors(receiver, monkeypatch):
+    def apply_events(conn, created, removed):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(notify, "apply_events", apply_events)
+    # 503, so the object store retries the notification.
+    assert post(receiver, payload("a.epub", "e1", 1, bucket=BUCKET))[0] == 503
+
+
+def test_receive_updates_manifest(db, connect_db):
+    receiver = Receiver(0, connect_db, None, BUCKET)
+    try:
+        assert receiver.receive(payload("a book.epub", "e1", 10, bucket=BUCKET)) == 1
+        assert receiver.receive(payload("a book.epub", removed=True, bucket=BUCKET)) == 0
+    finally:
+        receiver.server.server_close()
+
+    with db.cursor() as cur:
+        cur.execute("SELECT s3_key, kind, etag, size, state, gone_at IS NOT NULL FROM s3_objects")
+        assert cur.fetchall() == [("a book.epub", "epub", "e1", 10, "pending", True)]
+    db.commit()
@@ -0,0 +1,60 @@
+import io
+import random
+import zipfile
+
+import pytest
+from xml.parsers import expat
+
+from make_corpus import NAMES, make_epub
+from opf import find_opf_path, opf_base, read_opf, read_opf_tree
+
+SEEDS = range(24)
+
+
+def corpus_opf(seed):
+    zf = zipfile.ZipFile(io.BytesIO(make_epub(random.Random(seed), seed)))
+    path = find_opf_path(zf)
+    return zf, zf.read(path), opf_base(path)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_read_opf(seed):
+    zf, data, base = corpus_opf(seed)
+    meta, authors, cover_path = read_opf(data, base)
+
+    assert meta["title"]
+    assert meta["publisher"].endswith(" Press")
+    assert meta["language"] in ("en", "en-US", "de", "fr")
+    assert meta["identifier"].startswith("urn:uuid:")
+    assert authors and authors[0][1] == "aut"
+    assert [pos for _, _, pos in authors] == list(range(1, len(authors) + 1))
+    assert all(name in NAMES for name, _, _ in authors)
+    if "series" in meta:
+        assert 1 <= meta["series_position"] <= 12
+    if cover_path is not None:
+        assert cover_path in zf.namelist()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_read_opf_matches_tree(seed):
+    _, data, base = corpus_opf(seed)
+    assert read_opf(data, base) == read_opf_tree(data, base)
+
+
+def test_read_opf_corpus_covers_cover_styles():
+    covers = set()
+    for seed in SEEDS:
+        _, data, base = corpus_opf(seed)
+        covers.add(read_opf(data, base)[2] is not None)
+    assert covers == {True, False}
+
+
+def test_read_opf_no_metadata():
+    data = b'<package xmlns="http://www.idpf.org/2007/opf"><manifest/></package>'
+    assert read_opf(data) is None
+
+
+def test_read_opf_malformed():
+    _, data, base = corpus_opf(0)
+    with pytest.raises(expat.ExpatError):
+        read_opf(data[:len(data) // 2], base)
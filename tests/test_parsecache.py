@@ -0,0 +1,164 @@
+import concurrent.futures
+import datetime
+import hashlib
+import io
+import random
+import time
+
+import pytest
+
+import jobs
+import parsecache
+from make_corpus import make_epub
+from parsecache import ParseCache
+
+
+def epub_result(n):
+    meta = {"title": f"Book {n}", "description": "x" * 1000}
+    return meta, [(f"Author {n}", "aut", 1)], bytes([n % 256]) * 2000, "jpg"
+
+
+def fill(cache, keys):
+    for n in keys:
+        cache.put(f"books/{n}.epub", f"etag{n}", "epub", epub_result(n))
+        time.sleep(0.001)  # distinct used_at, so LRU order is well defined
+
+
+def test_round_trip(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache.db"), 10**9, parser_version=1)
+    fill(cache, [1])
+    assert cache.get("books/1.epub", "etag1") == epub_result(1)
+    assert cache.get("books/1.epub", "etag2") is None
+
+
+def test_parser_version_misses(tmp_path):
+    path = str(tmp_path / "cache.db")
+    fill(ParseCache(path, 10**9, parser_version=1), [1])
+    assert ParseCache(path, 10**9, parser_version=2).get("books/1.epub", "etag1") is None
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsecache, "EVICT_BATCH", 1)
+    cache = ParseCache(str(tmp_path / "cache.db"), 10**9, parser_version=1)
+    fill(cache, range(10))
+    entry = cache.total() // 10
+    # Use the oldest two again, so 2 and 3 are now the least recently used.
+    cache.get("books/0.epub", "etag0")
+    cache.get("books/1.epub", "etag1")
+
+    cache.max_bytes = entry * 9
+    fill(cache, [10])
+
+    # 11 entries over a cap of 9: evicted down to 90% of it (8), oldest first.
+    assert cache.total() <= cache.max_bytes * 0.9
+    kept = {n for n in range(11) if cache.get(f"books/{n}.epub", f"etag{n}") is not None}
+    assert kept == {0, 1, 5, 6, 7, 8, 9, 10}
+
+
+def test_total_tracks_deletes(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache.db"), 10**9, parser_version=1)
+    fill(cache, range(5))
+    assert cache.evict(0) == 5
+    assert cache.total() == 0
+    assert cache.stats() == []
+
+
+def test_drop_versions(tmp_path):
+    path = str(tmp_path / "cache.db")
+    fill(ParseCache(path, 10**9, parser_version=1), [1, 2])
+    cache = ParseCache(path, 10**9, parser_version=2)
+    fill(cache, [3])
+    assert cache.drop_versions(2) == 2
+    assert [(version, entries) for version, _, entries, _ in cache.stats()] == [(2, 1)]
+
+
+# ── Rebuilding the catalog from the cache ────────────────────────────────────
+
+class FakeS3:
+    """Serves `objects` ({key: bytes}) to the loader and counts GETs."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.gets = 0
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        yield {"Contents": [
+            {"Key": key, "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+             "Size": len(data), "LastModified": now}
+            for key, data in self.objects.items()
+        ]}
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        return {"Body": FakeBody(self.objects[Key])}
+
+
+class FakeBody(io.BytesIO):
+    def iter_chunks(self, size):
+        return iter(lambda: self.read(size), b"")
+
+
+@pytest.fixture
+def bucket():
+    return FakeS3({f"books/{n}.epub": make_epub(random.Random(n), n) for n in range(5)})
+
+
+@pytest.fixture
+def loader(connect_db, bucket, tmp_path, monkeypatch):
+    """The loader module, set to run in-process against the test database,
+    `bucket` and a parse cache under tmp_path."""
+    import loader as ld
+
+    lister = jobs.ListerLock(connect_db)
+    monkeypatch.setattr(ld, "connect_db", connect_db)
+    monkeypatch.setattr(ld, "shared_s3", lambda: bucket)
+    monkeypatch.setattr(ld, "LISTER", lister)
+    monkeypatch.setattr(ld, "PARSE_CACHE", str(tmp_path / "parse-cache.db"))
+    monkeypatch.setattr(ld, "_parse_cache", None)
+    monkeypatch.setattr(ld, "COVERS_DIR", str(tmp_path / "covers"))
+    monkeypatch.setattr(ld, "COVER_DERIVATIVES", False)
+    monkeypatch.setattr(
+        concurrent.futures, "ProcessPoolExecutor",
+        lambda **_: concurrent.futures.ThreadPoolExecutor(max_workers=2),
+    )
+    yield ld
+    if lister._conn is not None:
+        lister._conn.close()
+
+
+def catalog_titles(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT s3_key, title FROM epubs ORDER BY s3_key")
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+def test_rebuild_from_cache_after_truncate(db, loader, bucket):
+    loader.run_once()
+    assert bucket.gets == 5
+    loaded = catalog_titles(db)
+    assert len(loaded) == 5
+
+    with db.cursor() as cur:
+        cur.execute("TRUNCATE epubs, m4bs CASCADE")
+    db.commit()
+    bucket.gets = 0
+    loader.run_once()
+
+    # The listing reopened every done job; all five reloaded from the cache.
+    assert bucket.gets == 0
+    assert catalog_titles(db) == loaded
+
+
+def test_requeue_done_reloads_from_cache(db, loader, bucket):
+    loader.run_once()
+    assert sorted(jobs.requeue(db, states=("done",))) == [f"books/{n}.epub" for n in range(5)]
+    bucket.gets = 0
+    loader.run_once(reconcile=False)
+    assert bucket.gets == 0
+    assert jobs.state_counts(db) == {"done": 5}
@@ -0,0 +1,123 @@
+import io
+import random
+import re
+
+import pytest
+
+from s3io import S3RangeFile
+
+BLOCK = 16
+
+
+class RangeS3:
+    """Serves Range GETs of one object from `data`, recording each range."""
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+        self.heads = 0
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = map(int, re.fullmatch(r"bytes=(\d+)-(\d+)", Range).groups())
+        assert start <= end < len(self.data)
+        self.ranges.append((start, end + 1))
+        return {"Body": io.BytesIO(self.data[start:end + 1])}
+
+    def head_object(self, Bucket, Key):
+        self.heads += 1
+        return {"ContentLength": len(self.data)}
+
+
+def range_file(data, max_blocks=8, size=True):
+    s3 = RangeS3(data)
+    f = S3RangeFile(s3, "books", "a.epub", len(data) if size else None,
+                    block_size=BLOCK, max_blocks=max_blocks)
+    return f, s3
+
+
+DATA = bytes(range(256)) * 2   # 512 bytes, 32 blocks
+
+
+def test_block_cached():
+    f, s3 = range_file(DATA)
+    assert f.read_range(3, 9) == DATA[3:9]
+    assert f.read_range(0, 16) == DATA[0:16]
+    assert s3.ranges == [(0, 16)]
+    assert (f.requests, f.bytes_fetched) == (1, 16)
+
+
+def test_read_across_blocks_is_one_request():
+    f, s3 = range_file(DATA)
+    assert f.read_range(10, 70) == DATA[10:70]
+    assert s3.ranges == [(0, 80)]
+
+
+def test_only_missing_blocks_fetched():
+    f, s3 = range_file(DATA)
+    f.read_range(16, 17)
+    f.read_range(48, 49)
+    s3.ranges.clear()
+    # Blocks 1 and 3 are cached: 0, 2 and 4-5 are fetched, one run each.
+    assert f.read_range(5, 90) == DATA[5:90]
+    assert s3.ranges == [(0, 16), (32, 48), (64, 96)]
+
+
+def test_last_block_is_short():
+    f, s3 = range_file(DATA[:100])
+    assert f.read_range(90, 100) == DATA[90:100]
+    assert s3.ranges == [(80, 100)]
+
+
+def test_lru_eviction():
+    f, s3 = range_file(DATA, max_blocks=2)
+    f.read_range(0, 1)      # block 0
+    f.read_range(16, 17)    # block 1
+    f.read_range(0, 1)      # block 0 is now the most recently used
+    f.read_range(32, 33)    # block 2 evicts block 1
+    assert s3.ranges == [(0, 16), (16, 32), (32, 48)]
+    f.read_range(0, 1)
+    assert len(s3.ranges) == 3
+    f.read_range(16, 17)
+    assert s3.ranges[3:] == [(16, 32)]
+
+
+def test_seek_and_read():
+    f, s3 = range_file(DATA)
+    assert f.seek(100) == 100 and f.read(10) == DATA[100:110]
+    assert f.seek(-20, io.SEEK_CUR) == 90 and f.read(5) == DATA[90:95]
+    assert f.seek(-8, io.SEEK_END) == 504 and f.read() == DATA[504:]
+    assert f.tell() == 512 and f.read(10) == b""
+    assert f.seek(600) == 600 and f.read() == b""
+    with pytest.raises(OSError):
+        f.seek(-1)
+    with pytest.raises(ValueError):
+        f.seek(0, 3)
+
+    buf = bytearray(20)
+    f.seek(500)
+    assert f.readinto(buf) == 12 and bytes(buf[:12]) == DATA[500:]
+
+
+def test_random_reads_match_source():
+    rng = random.Random(1)
+    data = rng.randbytes(5000)
+    f, s3 = range_file(data, max_blocks=16)
+    for _ in range(500):
+        start = rng.randrange(len(data))
+        size = rng.choice((1, 7, BLOCK, 3 * BLOCK + 5, 400))
+        f.seek(start)
+        assert f.read(size) == data[start:start + size]
+    assert f.bytes_fetched == sum(end - start for start, end in s3.ranges)
+    assert f.requests == len(s3.ranges)
+
+
+def test_size_from_head():
+    f, s3 = range_file(DATA, size=False)
+    assert (f.size, s3.heads) == (512, 1)
+
+
+def test_closed():
+    f, _ = range_file(DATA)
+    f.close()
+    with pytest.raises(ValueError):
+        f.read(1)
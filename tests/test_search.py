@@ -0,0 +1,40 @@
+import pytest
+
+from search import prefix_query, search_query
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("harbor", "harbor:*"),
+    ("Harb Sign", "harb:* & sign:*"),
+    ("  the   last\torchard ", "the:* & last:* & orchard:*"),
+    # Punctuation and tsquery operators separate words and never reach the query.
+    ("o'brien & co|ltd (2nd ed.)", "o:* & brien:* & co:* & ltd:* & 2nd:* & ed:*"),
+    ("!:*<->", None),
+    ("snake_case", "snake:* & case:*"),
+    # Letters beyond ASCII are word characters, lowercased as Postgres does.
+    ("Ærø Øl", "ærø:* & øl:*"),
+    ("Straße", "straße:*"),
+    ("", None),
+    ("   ", None),
+])
+def test_prefix_query(text, expected):
+    assert prefix_query(text) == expected
+
+
+def test_search_query_no_words():
+    assert search_query("--") is None
+
+
+def test_search_query_kind():
+    sql, params = search_query("harbor", kind="m4b", limit=5, offset=10)
+    assert "FROM m4bs" in sql and "FROM epubs" not in sql
+    assert params["limit"] == 5 and params["offset"] == 10
+    sql, _ = search_query("harbor", similar=True)
+    assert "FROM m4bs" in sql and "FROM epubs" in sql and "<%%" in sql
+
+
+def test_prefix_query_parses_in_postgres(db):
+    with db.cursor() as cur:
+        for text in ("o'brien & co|ltd (2nd ed.)", "Ærø Øl", "harb sign"):
+            cur.execute("SELECT to_tsquery('simple', %s)::text", (prefix_query(text),))
+            assert cur.fetchone()[0]